@@ -1,3 +1,91 @@
 # Psychology Clinic Triage Tool
 # App package initialization
 
+"""
+Psychology Clinic Triage Tool
+Application factory
+
+    from app import create_app
+    app = create_app()
+
+Used by gunicorn (gunicorn.conf.py), the development server (app.py), the
+ASGI entry point (app/asgi.py), the benchmarks and scripts. Heavy
+dependencies are only imported where they're needed: pandas and openpyxl
+when a spreadsheet is ingested.
+"""
+
+import os
+import secrets
+
+from flask import Flask, render_template, redirect, url_for
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_app(config=None):
+    """Create and configure the application; config overrides the settings below"""
+    app = Flask(__name__)
+
+    # Configure application
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(16)  # Set SECRET_KEY in production
+    app.config['UPLOAD_FOLDER'] = os.environ.get('TRIAGE_UPLOAD_FOLDER') or os.path.join(ROOT, 'uploads')
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+    app.config['INGEST_STREAMING_THRESHOLD'] = 5 * 1024 * 1024  # Stream workbooks larger than 5MB
+    app.config['SEARCH_BACKEND'] = 'index'  # 'index' (in-memory bitsets) or 'sqlite' (indexed query)
+    app.config['SEARCH_PAGE_SIZE'] = 20  # Search results shown per page
+    app.config['SCORING'] = {}  # Overrides of app.models.scoring.DEFAULT_WEIGHTS, e.g. {'allow_conditional': True}
+    app.config['ALLOCATION_DEFAULT_CAPACITY'] = 5  # New referrals a clinician can take when the roster has no 'capacity'
+    app.config['SEARCH_CACHE'] = 'memory'  # 'memory' (per worker), 'sqlite' (shared by workers) or 'off'
+    app.config['SEARCH_CACHE_SIZE'] = 256  # Cached searches kept
+    app.config['SEARCH_CACHE_TTL'] = 300  # Seconds before a cached search is recomputed
+    app.config['METRICS_ENABLED'] = True  # Serve Prometheus metrics at /metrics
+    app.config['PROFILE_SAMPLE_RATE'] = 0.0  # Fraction of requests to profile (super admins can add ?profile=1)
+    app.config['AUDIT_LOG'] = True  # Append every search to the audit log under uploads/audit/
+    app.config['AUDIT_SEGMENT_BYTES'] = 16 * 1024 * 1024  # Start a new audit log segment after 16MB...
+    app.config['AUDIT_SEGMENT_SECONDS'] = 3600  # ...or an hour
+    app.config['AUDIT_RETENTION_DAYS'] = 365  # Days compacted audit archives are kept (0 keeps them all)
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'  # werkzeug method; users are rehashed when they next log in
+    app.config['LOGIN_RATE_LIMIT'] = 10  # Failed logins allowed per client address, and per username from one (0 to disable)
+    app.config['LOGIN_RATE_WINDOW'] = 60  # Seconds those failed logins are counted over
+    app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRIAGE_TRUSTED_PROXIES', 0))  # Proxies whose X-Forwarded-* headers are trusted
+    app.config['ASGI_THREADS'] = 16  # Under app.asgi: threads running the app for most requests
+    app.config['ASGI_SEARCH_THREADS'] = 4  # Under app.asgi: threads kept for the JSON search and autocomplete
+    app.config.update(config or {})
+
+    # Behind a reverse proxy, take the client's address from X-Forwarded-For so
+    # login rate limits apply per client rather than to the proxy
+    if app.config['TRUSTED_PROXIES']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        proxies = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # Import routes here, once the package has loaded, to avoid circular imports
+    from app.routes import auth_routes, admin_routes, triage_routes
+    from app.utils import metrics
+
+    # Register blueprints
+    app.register_blueprint(auth_routes.bp)
+    app.register_blueprint(admin_routes.bp)
+    app.register_blueprint(triage_routes.bp)
+
+    # Request timing, JSON request logs, the profiler hook and /metrics
+    metrics.init_app(app)
+
+    # Root route redirects to login
+    @app.route('/')
+    def index():
+        return redirect(url_for('auth.login'))
+
+    # Error handlers
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return render_template('error.html', error_code=404, error_message="Page not found"), 404
+
+    @app.errorhandler(500)
+    def internal_server_error(e):
+        return render_template('error.html', error_code=500, error_message="Internal server error"), 500
+
+    return app
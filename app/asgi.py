@@ -0,0 +1,217 @@
+"""
+Psychology Clinic Triage Tool
+ASGI entry point, for serving under an event loop (pip install uvicorn):
+
+    TRIAGE_ASGI=1 gunicorn -c gunicorn.conf.py            (uvicorn's gunicorn workers)
+    uvicorn --factory app.asgi:create_asgi_app            (a single process)
+
+Under gunicorn's sync workers each request holds a worker until it's done. A
+slow upload or a client on a poor connection holds one too, so a few of those
+can leave /triage/search waiting. Here the event loop holds the connections
+instead. Request bodies are read without tying up a thread, and the Flask app
+only runs once the whole request has arrived.
+
+The app runs on a thread pool. The JSON search and presentation autocomplete
+endpoints get a small pool of their own, so uploads, batch matching and page
+renders waiting on the main pool never hold them up. Roster reads (the stat()
+of current.json, snapshot loads and the availability overlay) happen on those
+threads and never on the event loop. At startup the roster is loaded in a
+thread before the first request is accepted.
+"""
+
+import asyncio
+import contextvars
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from app.utils import prefork
+
+# Endpoints served from their own thread pool
+SEARCH_PATHS = ('/triage/api/search', '/triage/api/presentations')
+
+# Separator used to join repeated Cookie headers (RFC 6265 section 5.4)
+COOKIE_SEPARATOR = '; '
+
+_DONE = object()
+
+
+class TriageASGI:
+    """ASGI adapter running the Flask app on thread pools"""
+
+    def __init__(self, flask_app, threads=16, search_threads=4):
+        self.flask_app = flask_app
+        self.max_body = flask_app.config.get('MAX_CONTENT_LENGTH')
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='triage')
+        self.search_pool = ThreadPoolExecutor(search_threads, thread_name_prefix='triage-search')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Load the roster before accepting requests, off the event loop (a
+                # preloaded gunicorn worker already has it)
+                await loop.run_in_executor(self.search_pool, prefork.load, self.flask_app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Let requests already running finish
+                await loop.run_in_executor(None, self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        self.search_pool.shutdown(wait=True)
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        if body is False:
+            await send_text(send, 413, 'Request entity too large')
+            return
+
+        environ = build_environ(scope, body)
+        pool = self.search_pool if environ['PATH_INFO'] in SEARCH_PATHS else self.pool
+        loop = asyncio.get_running_loop()
+        # Flask keeps the request context in context variables; a streamed response must
+        # carry on in the same context whichever pool thread produces its next chunk
+        context = contextvars.Context()
+        status, headers, chunks, iterator = await loop.run_in_executor(pool, context.run, self.run_app, environ)
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        if iterator is None:
+            # The whole body in one message, so it goes out in one write
+            await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+            return
+        # Servers may quietly drop messages sent after the client has gone, so
+        # watch for the disconnect rather than streaming the rest to no one
+        disconnected = asyncio.create_task(wait_for_disconnect(receive))
+        try:
+            for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            # A streamed response (e.g. batch NDJSON) is produced one chunk per trip to the pool
+            while not disconnected.done():
+                chunk = await loop.run_in_executor(pool, context.run, next, iterator, _DONE)
+                if chunk is _DONE:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            await loop.run_in_executor(pool, context.run, close_response, iterator)
+
+    # Helper function to read the whole request body: None if the client left, False if it's too large
+    async def read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            size += len(chunks[-1])
+            if self.max_body is not None and size > self.max_body:
+                return False
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    def run_app(self, environ):
+        """Call the WSGI app (in a pool thread), returning (status, headers, chunks, iterator still to stream)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        iterator = iter(self.flask_app(environ, start_response))
+        first = next(iterator, _DONE)
+        chunks = [] if first is _DONE else [first]
+
+        # Responses of a known length are read in full here, saving a trip to the pool per chunk
+        if first is _DONE or any(name.lower() == 'content-length' for name, _ in response['headers']):
+            chunks.extend(iterator)
+            close_response(iterator)
+            iterator = None
+        return response['status'], response['headers'], chunks, iterator
+
+
+# Helper function to wait until the client disconnects
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+# Helper function to close a WSGI response, which ends any streaming request context
+def close_response(iterator):
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+
+
+# Helper function to send a short plain text response
+async def send_text(send, status, text):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': text.encode()})
+
+
+def build_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP request whose body has been read"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            # The body has already been read in full
+            continue
+        key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+        if key in environ:
+            # Repeated headers are combined as one comma-separated list, except
+            # cookies, which a client may send as several Cookie headers
+            value = f"{environ[key]}{COOKIE_SEPARATOR if key == 'HTTP_COOKIE' else ','}{value}"
+        environ[key] = value
+    # The whole body was read, so it's no longer chunked
+    environ.pop('HTTP_TRANSFER_ENCODING', None)
+    return environ
+
+
+def create_asgi_app(config=None):
+    """Create the Flask app and wrap it for an ASGI server; config is passed to create_app"""
+    flask_app = create_app(config)
+    return TriageASGI(flask_app, flask_app.config['ASGI_THREADS'], flask_app.config['ASGI_SEARCH_THREADS'])
@@ -0,0 +1,303 @@
+"""
+Caseload-aware allocation of a batch of referrals
+
+A search ranks the same clinicians first for every referral with the same
+criteria, so a backlog triaged one referral at a time piles onto the first
+Available clinician. allocate() assigns each referral in a batch to at most
+one eligible clinician instead. No clinician gets more referrals than their
+capacity, and the total match score is as high as possible. Among allocations
+with the same total, it prefers the clinicians a search ranks first
+(Available, then roster order).
+
+A clinician's capacity is the number of new referrals they can take, from
+the roster's 'capacity' column; clinicians without one get a default. The
+eligibility rules and scores are those of the triage search (see
+app.models.shards). Referrals with the same criteria are grouped, so each
+distinct search only runs once.
+
+There are two solvers:
+
+    flow    Exact. Builds a min-cost flow one referral at a time. Each referral
+            takes the cheapest path of reassignments, found with Dijkstra over
+            the clinicians and potentials that keep edge costs non-negative.
+            The path may move earlier referrals to other clinicians or leave
+            one unassigned.
+    greedy  Faster, but not always optimal. Referrals with the fewest eligible
+            clinicians go first, and each goes to the best-ranked clinician
+            with capacity left.
+
+Greedy always runs first. If it gives every referral a clinician at the best
+score that referral could get, no allocation scores more, so the flow is
+skipped (usually the case for strict searches, where every match scores
+100).
+"""
+
+import time
+
+import numpy as np
+
+from app.models.batch import REFERRAL_FIELDS, validate_referral
+
+SOLVERS = ('flow', 'greedy')
+
+# Capacity of clinicians with no 'capacity' value on the roster
+DEFAULT_CAPACITY = 5
+
+
+def parse_capacity(value, default=DEFAULT_CAPACITY):
+    """Return a capacity as a whole number of referrals (default if it's blank or not a number)"""
+    if value is None or isinstance(value, bool):
+        return default
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return default
+    if number != number:  # NaN from an empty spreadsheet cell
+        return default
+    return max(0, int(number))
+
+
+def get_capacities(roster, default=DEFAULT_CAPACITY, overrides=None):
+    """Return every clinician's capacity as an array in roster order
+
+    overrides maps clinician_name to a capacity that replaces the roster's.
+    """
+    names = roster.column('clinician_name')
+    overrides = overrides or {}
+    return np.array([parse_capacity(overrides.get(name, value), default)
+                     for name, value in zip(names, roster.column('capacity'))], dtype=np.int64)
+
+
+def allocate(roster, referrals, weights, default_capacity=DEFAULT_CAPACITY, capacities=None, solver='flow'):
+    """Assign a batch of referrals to eligible clinicians within their capacity
+
+    weights are the scoring weights a search would use (see
+    app.models.scoring), and capacities maps clinician_name to a capacity
+    that overrides the roster's. Returns (results, summary): one dict per
+    referral, in order, with the roster row assigned (or None), its score and
+    detail bits, the number of eligible clinicians and any validation error.
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver: {solver}")
+    started = time.perf_counter()
+
+    # Group valid referrals by their criteria
+    kinds = {}
+    members = []
+    results = []
+    for i, referral in enumerate(referrals):
+        error = validate_referral(referral)
+        results.append({'referral': referral, 'row': None, 'score': None, 'details': 0, 'match_count': 0,
+                        'error': error})
+        if error is None:
+            kind = kinds.setdefault(tuple(referral[field] for field in REFERRAL_FIELDS), len(kinds))
+            if kind == len(members):
+                members.append([])
+            members[kind].append(i)
+
+    # Run each distinct search once
+    matches = [roster.shards.score(*criteria, weights) for criteria in kinds]
+    for kind, ranked in enumerate(matches):
+        for i in members[kind]:
+            results[i]['match_count'] = len(ranked)
+
+    capacity = get_capacities(roster, default_capacity, capacities)
+    flat = np.array([(kind, row, score, details) for kind, ranked in enumerate(matches)
+                     for row, score, details in ranked], dtype=np.int64).reshape(-1, 4)
+    # Clinicians with no capacity, and matches scoring nothing, can't take a referral
+    flat = flat[(capacity[flat[:, 1]] > 0) & (flat[:, 2] > 0)]
+    rows = np.unique(flat[:, 1])
+    pair_kinds, pair_columns = flat[:, 0], np.searchsorted(rows, flat[:, 1])
+
+    # Cost of each referral kind at each clinician: minus the score, scaled so
+    # that the search rank (which adds less than one point in total) only
+    # breaks ties. Infinite where the clinician isn't eligible
+    available = roster.availability_index.available[rows]
+    position = np.empty(len(rows), dtype=np.int64)
+    position[np.lexsort((rows, ~available))] = np.arange(len(rows))
+    scale = len(rows) * (len(referrals) + 1)
+    cost = np.full((len(matches), len(rows)), np.inf)
+    cost[pair_kinds, pair_columns] = position[pair_columns] - flat[:, 2] * scale
+    scores = np.zeros(cost.shape, dtype=np.int64)
+    scores[pair_kinds, pair_columns] = flat[:, 2]
+    details = np.zeros(cost.shape, dtype=np.int64)
+    details[pair_kinds, pair_columns] = flat[:, 3]
+
+    # Greedy first. If that gives every referral a clinician at its best
+    # score, no allocation scores more, so the flow isn't needed
+    demand = [len(indices) for indices in members]
+    assigned = _solve_greedy(cost, demand, capacity[rows])
+    if solver == 'flow' and not _best_scores(assigned, scores, demand):
+        assigned = _solve_flow(cost, demand, capacity[rows])
+
+    # Hand each kind's clinicians to its referrals in order, best-ranked first
+    total = 0
+    for kind, counts in enumerate(assigned):
+        indices = iter(members[kind])
+        for j in sorted(counts, key=lambda j: cost[kind, j]):
+            for _ in range(counts[j]):
+                results[next(indices)].update(row=int(rows[j]), score=int(scores[kind, j]),
+                                              details=int(details[kind, j]))
+                total += int(scores[kind, j])
+
+    load = np.bincount([result['row'] for result in results if result['row'] is not None],
+                       minlength=len(capacity))
+    names = roster.column('clinician_name')
+    summary = {
+        'solver': solver,
+        'referrals': len(referrals),
+        'assigned': int(load.sum()),
+        'unassigned': sum(1 for result in results if result['row'] is None and result['error'] is None),
+        'errors': sum(1 for result in results if result['error'] is not None),
+        'total_score': total,
+        'clinicians': [{'name': names[row], 'assigned': int(load[row]), 'capacity': int(capacity[row])}
+                       for row in np.flatnonzero(load).tolist()],
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    return results, summary
+
+
+# Helper function to check whether every referral was assigned a clinician at the best score it could have
+def _best_scores(assigned, scores, demand):
+    best = scores.max(axis=1, initial=0)
+    return all(sum(counts.values()) == demand[kind] and all(scores[kind, j] == best[kind] for j in counts)
+               for kind, counts in enumerate(assigned) if best[kind] > 0)
+
+
+# Helper function to add or remove one referral of a kind from a clinician
+def _hold(held, load, column, kind, change):
+    count = held[column].get(kind, 0) + change
+    if count:
+        held[column][kind] = count
+    else:
+        del held[column][kind]
+    load[column] += change
+
+
+# Helper function to solve the allocation exactly, as a min-cost flow built one referral at a time
+def _solve_flow(cost, demand, capacity):
+    kinds, size = cost.shape
+
+    columns = np.arange(size)
+    # Potentials for the clinicians and for the end of a path (spare capacity,
+    # or leaving a referral unassigned)
+    potential = np.zeros(size)
+    end_potential = 0.0
+    load = np.zeros(size, dtype=np.int64)
+    held = [{} for _ in range(size)]
+
+    # Edges out of each clinician, kept up to date as referrals move: the
+    # cheapest change in cost from moving one of their referrals to each other
+    # clinician (and the kind moved), and from leaving one unassigned
+    move_cost = np.full((size, size), np.inf)
+    move_kind = np.zeros((size, size), dtype=np.int64)
+    drop_cost = np.full(size, np.inf)
+    drop_kind = np.full(size, -1)
+    candidate = np.empty(size)
+    better = np.empty(size, dtype=bool)
+
+    def refresh(column):
+        if not held[column]:
+            move_cost[column] = np.inf
+            drop_cost[column] = np.inf
+            return
+        holding = np.fromiter(held[column], dtype=np.int64, count=len(held[column]))
+        current = cost[holding, column]
+        moves = cost[holding] - current[:, None]
+        best = moves.argmin(axis=0)
+        move_cost[column] = moves[best, columns]
+        move_kind[column] = holding[best]
+        k = int(current.argmax())
+        drop_cost[column] = -current[k]
+        drop_kind[column] = holding[k]
+
+    # Referrals with the fewest eligible clinicians first: the same result, with
+    # shorter paths. Referrals no clinician can take stay unassigned
+    eligible = np.isfinite(cost).sum(axis=1)
+    for kind in np.argsort(eligible, kind='stable').tolist():
+        if not eligible[kind]:
+            continue
+        for _ in range(demand[kind]):
+            # Dijkstra from the new referral. Labels are path costs minus
+            # potentials; leaving the new referral unassigned costs 0
+            dist = cost[kind] - potential
+            unvisited = dist.copy()
+            parent = np.full(size, -1)
+            moved = np.full(size, -1)
+            end = -end_potential
+            end_parent = end_kind = -1
+
+            # Stop once no clinician is nearer than the end (ties go to the end)
+            while size:
+                node = int(unvisited.argmin())
+                label = unvisited[node]
+                if label >= end:
+                    break
+                unvisited[node] = np.inf
+                base = label + potential[node]
+
+                if load[node] < capacity[node] and base - end_potential < end:
+                    end, end_parent, end_kind = base - end_potential, node, -1
+                if not held[node]:
+                    continue
+                np.add(move_cost[node], base, out=candidate)
+                np.subtract(candidate, potential, out=candidate)
+                np.less(candidate, dist, out=better)
+                np.copyto(dist, candidate, where=better)
+                np.copyto(unvisited, candidate, where=better)
+                np.copyto(parent, node, where=better)
+                np.copyto(moved, move_kind[node], where=better)
+                if base + drop_cost[node] - end_potential < end:
+                    end, end_parent, end_kind = base + drop_cost[node] - end_potential, node, int(drop_kind[node])
+
+            potential += np.minimum(dist, end)
+            end_potential += end
+            if end_parent == -1:
+                continue
+
+            # Apply the path from the new referral's clinician to the end
+            path = [end_parent]
+            while parent[path[-1]] != -1:
+                path.append(int(parent[path[-1]]))
+            path.reverse()
+            _hold(held, load, path[0], kind, 1)
+            for source, target in zip(path, path[1:]):
+                _hold(held, load, source, int(moved[target]), -1)
+                _hold(held, load, target, int(moved[target]), 1)
+            if end_kind != -1:
+                _hold(held, load, end_parent, end_kind, -1)
+            for column in path:
+                refresh(column)
+
+    return _by_kind(held, kinds)
+
+
+# Helper function to allocate greedily, the referrals with the fewest eligible clinicians first
+def _solve_greedy(cost, demand, capacity):
+    kinds, size = cost.shape
+    load = np.zeros(size, dtype=np.int64)
+    held = [{} for _ in range(size)]
+    if not size:
+        return _by_kind(held, kinds)
+    eligible = np.isfinite(cost).sum(axis=1)
+
+    for kind in np.argsort(eligible, kind='stable').tolist():
+        if not eligible[kind]:
+            continue
+        for _ in range(demand[kind]):
+            options = np.where(load < capacity, cost[kind], np.inf)
+            j = int(np.argmin(options))
+            if not options[j] < 0:
+                break
+            _hold(held, load, j, kind, 1)
+
+    return _by_kind(held, kinds)
+
+
+# Helper function to turn clinicians' {kind: count} into each kind's {column: count}
+def _by_kind(held, kinds):
+    assigned = [{} for _ in range(kinds)]
+    for column, counts in enumerate(held):
+        for kind, count in counts.items():
+            assigned[kind][column] = count
+    return assigned
@@ -0,0 +1,116 @@
+"""
+Presentation autocomplete for the Psychology Clinic Triage Tool
+
+Built once per roster snapshot from its presentation names. Lookups use
+sorted lists of names and words with binary search, so a prefix lookup
+doesn't scan every name. Matches are ranked in tiers, then alphabetically:
+
+    0  the name starts with the query            "anx"  -> Anxiety
+    1  each query word starts a word in the name "dis eat" -> Eating Disorders
+    2  the query appears anywhere in the name    "iety" -> Anxiety
+    3  each query word is one typo away from the
+       start of a word in the name (only tried
+       when nothing else matches)                "anxeity" -> Anxiety
+"""
+
+from bisect import bisect_left
+
+# Query words shorter than this must match exactly; typos are only allowed in longer ones
+MIN_TYPO_LENGTH = 4
+
+
+# Helper function to split a name or query into lower-case words
+def words(text):
+    return text.lower().replace('_', ' ').split()
+
+
+# Helper function to check whether two strings are at most one edit apart
+# (an insertion, deletion, substitution or swap of neighbouring letters)
+def within_one_edit(a, b):
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i += 1
+    if i == len(a) or i == len(b):
+        return True
+    return (a[i + 1:] == b[i + 1:]            # substitution
+            or a[i + 1:] == b[i:]             # deletion from a
+            or a[i:] == b[i + 1:]             # insertion into a
+            or (a[i] == b[i + 1:i + 2] and b[i] == a[i + 1:i + 2] and a[i + 2:] == b[i + 2:]))  # swap
+
+
+class Autocomplete:
+    """Ranked lookups over a fixed list of names"""
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        self.lower = [name.lower() for name in self.names]
+        # Names sorted by lower-case form, for prefix lookups
+        self._by_lower = sorted(range(len(self.names)), key=lambda i: self.lower[i])
+        self._sorted_lower = [self.lower[i] for i in self._by_lower]
+        # Every (word, name id) pair, sorted by word
+        self._words = sorted((word, i) for i, name in enumerate(self.names) for word in words(name))
+        self._word_keys = [word for word, _ in self._words]
+        # Names containing each distinct word, for typo matching
+        self._word_ids = {}
+        for word, i in self._words:
+            self._word_ids.setdefault(word, set()).add(i)
+
+    # Helper function to get the ids of names with a word starting with prefix
+    def _word_prefix(self, prefix):
+        ids = set()
+        start = bisect_left(self._word_keys, prefix)
+        for word, i in self._words[start:]:
+            if not word.startswith(prefix):
+                break
+            ids.add(i)
+        return ids
+
+    def search(self, query, limit=None):
+        """Return names matching query, best first"""
+        query = query.strip().lower()
+        if not query:
+            return self.names[:limit]
+
+        tiers = ([], [], [], [])
+        seen = set()
+
+        # 0: the whole name starts with the query
+        start = bisect_left(self._sorted_lower, query)
+        for position in range(start, len(self._sorted_lower)):
+            if not self._sorted_lower[position].startswith(query):
+                break
+            seen.add(self._by_lower[position])
+            tiers[0].append(self._by_lower[position])
+
+        # 1: every query word starts a word in the name (a query of only
+        # separators, such as "_", has no words and keeps tiers 0 and 2)
+        query_words = words(query)
+        ids = None
+        for word in query_words:
+            matched = self._word_prefix(word)
+            ids = matched if ids is None else ids & matched
+        tiers[1].extend(i for i in sorted(ids or ()) if i not in seen)
+        seen.update(tiers[1])
+
+        # 2: the query appears anywhere in the name
+        tiers[2].extend(i for i, name in enumerate(self.lower) if i not in seen and query in name)
+        seen.update(tiers[2])
+
+        # 3: allow one typo per query word, only when nothing matched as typed
+        if not seen and query_words and all(len(word) >= MIN_TYPO_LENGTH for word in query_words):
+            ids = None
+            for word in query_words:
+                # Compare against each distinct word once, not once per name
+                matched = set()
+                for name_word, word_ids in self._word_ids.items():
+                    if (within_one_edit(word, name_word[:len(word)])
+                            or within_one_edit(word, name_word[:len(word) + 1])
+                            or within_one_edit(word, name_word[:len(word) - 1])):
+                        matched |= word_ids
+                ids = matched if ids is None else ids & matched
+            tiers[3].extend(sorted(ids))
+
+        results = [self.names[i] for tier in tiers for i in tier]
+        return results[:limit]
@@ -0,0 +1,210 @@
+"""
+Clinician availability for the Psychology Clinic Triage Tool
+
+Availability edits made by admins are stored as per-clinician rows in the
+SQLite database rather than by rewriting the roster snapshot. An update is one
+upsert plus one change-log insert in a single transaction, so its cost doesn't
+depend on the size of the roster and concurrent edits from different workers
+can't overwrite each other.
+
+Rows are keyed by snapshot id. When a spreadsheet is uploaded, the edits for
+clinicians still on the roster are copied to the new snapshot (see
+copy_overrides()), unless the admin chooses to start from the availability
+the spreadsheet contains. Readers overlay the rows for the live snapshot on
+top of it; a version counter tells them when to reload. Each location also
+has its own counter, bumped only by edits to clinicians based there, so
+the search structures and cached results for other sites stay valid (see
+app.models.shards).
+
+Dates are stored as ISO strings (YYYY-MM-DD), parsed when they are written.
+Once a waitlisted clinician's available from date arrives, the next read of
+the roster rolls their status over to Available (see roll_over()).
+"""
+
+from datetime import date, datetime
+
+from app.models.database import get_db, get_counter, bump_counter
+
+AVAILABILITY_FIELDS = ('availability_status', 'available_from_date', 'availability_notes')
+
+VERSION_KEY = 'availability_version'
+
+# Per-location counters are stored as VERSION_KEY:<primary_location>
+LOCATION_VERSION_PREFIX = VERSION_KEY + ':'
+
+# Statuses that end on the available from date, and the status they become
+ROLLOVER_STATUSES = ('Waitlist',)
+ROLLOVER_TO = 'Available'
+
+# Recorded as the changed_by of automatic rollovers in the change log
+ROLLOVER_USER = 'rollover'
+
+# Formats accepted for available_from_date besides ISO dates, e.g. typed into the spreadsheet
+DATE_FORMATS = ('%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y', '%d %B %Y', '%d %b %Y')
+
+
+def parse_date(value):
+    """Return an available_from_date value as a date, or None if it isn't one"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        # Covers the admin form's YYYY-MM-DD and spreadsheet datetimes stored as text
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalise_date(value, strict=True):
+    """Return an available_from_date value as an ISO date string, or None if blank
+
+    Values that aren't dates raise ValueError, or are returned unchanged if
+    strict is False.
+    """
+    parsed = parse_date(value)
+    if parsed is not None:
+        return parsed.isoformat()
+    if not strict:
+        return value
+    if value is not None and str(value).strip():
+        raise ValueError(f"'{value}' is not a date")
+    return None
+
+
+def get_version(upload_folder=None):
+    """Return a counter that changes whenever any availability is updated"""
+    return get_counter(get_db(upload_folder), VERSION_KEY)
+
+
+def get_location_versions(upload_folder=None):
+    """Return {primary_location: counter} for every location whose availability has been edited
+
+    Blank locations are keyed as ''.
+    """
+    # ';' sorts straight after ':', so this is a range scan of the meta table's key
+    rows = get_db(upload_folder).execute('SELECT key, value FROM meta WHERE key > ? AND key < ?',
+                                         (LOCATION_VERSION_PREFIX, VERSION_KEY + ';'))
+    return {row['key'][len(LOCATION_VERSION_PREFIX):]: row['value'] for row in rows}
+
+
+# Helper function to bump the availability version, and the location versions of the given clinicians
+def _bump_versions(db, snapshot, clinician_names):
+    bump_counter(db, VERSION_KEY)
+    locations = set()
+    for name in clinician_names:
+        row = db.execute('SELECT primary_location FROM clinicians WHERE snapshot = ? AND clinician_name = ? '
+                         'AND name_primary = 1', (snapshot, name)).fetchone()
+        if row is not None:
+            locations.add(row[0] or '')
+    for location in locations:
+        bump_counter(db, LOCATION_VERSION_PREFIX + location)
+
+
+def get_overrides(snapshot, upload_folder=None):
+    """Return {clinician_name: {field: value}} of admin edits for a snapshot"""
+    rows = get_db(upload_folder).execute(
+        'SELECT clinician_name, availability_status, available_from_date, availability_notes '
+        'FROM availability WHERE snapshot = ?', (snapshot,))
+    return {row['clinician_name']: {field: row[field] for field in AVAILABILITY_FIELDS} for row in rows}
+
+
+def copy_overrides(old_snapshot, new_snapshot, upload_folder=None):
+    """Carry a snapshot's edits over to a new snapshot, for clinicians who are still on it
+
+    The new snapshot must already be in the clinicians table. Returns the
+    number of edits copied.
+    """
+    db = get_db(upload_folder)
+    return db.execute(
+        'INSERT OR IGNORE INTO availability (snapshot, clinician_name, availability_status, available_from_date, '
+        'availability_notes, updated_at) '
+        'SELECT ?, clinician_name, availability_status, available_from_date, availability_notes, updated_at '
+        'FROM availability WHERE snapshot = ? AND clinician_name IN '
+        '(SELECT clinician_name FROM clinicians WHERE snapshot = ?)',
+        (new_snapshot, old_snapshot, new_snapshot)).rowcount
+
+
+def update_availability(snapshot, clinician_name, availability_status, available_from_date,
+                        availability_notes, changed_by=None, upload_folder=None):
+    """Set one clinician's availability and record the change"""
+    db = get_db(upload_folder)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    values = (availability_status, normalise_date(available_from_date), availability_notes)
+
+    # BEGIN IMMEDIATE takes the write lock up front, so concurrent updates queue
+    # instead of failing part-way through
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute(
+            'INSERT INTO availability (snapshot, clinician_name, availability_status, available_from_date, '
+            'availability_notes, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(snapshot, clinician_name) DO UPDATE SET '
+            'availability_status = excluded.availability_status, '
+            'available_from_date = excluded.available_from_date, '
+            'availability_notes = excluded.availability_notes, '
+            'updated_at = excluded.updated_at',
+            (snapshot, clinician_name) + values + (now,))
+        db.execute(
+            'INSERT INTO availability_log (snapshot, clinician_name, availability_status, available_from_date, '
+            'availability_notes, changed_by, changed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (snapshot, clinician_name) + values + (changed_by, now))
+        _bump_versions(db, snapshot, [clinician_name])
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def roll_over(snapshot, due, upload_folder=None):
+    """Mark clinicians whose available from date has arrived as available
+
+    due maps clinician_name to their current {field: value}, as read from the
+    roster. Clinicians whose availability was changed since are skipped, so
+    workers rolling over at the same time only record each change once.
+    Returns the number of clinicians updated.
+    """
+    db = get_db(upload_folder)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rolled = []
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        for clinician_name, fields in due.items():
+            row = db.execute('SELECT availability_status, available_from_date FROM availability '
+                             'WHERE snapshot = ? AND clinician_name = ?', (snapshot, clinician_name)).fetchone()
+            if row is not None and (row['availability_status'], row['available_from_date']) != \
+                    (fields['availability_status'], fields['available_from_date']):
+                continue
+
+            values = (ROLLOVER_TO, fields['available_from_date'], fields['availability_notes'])
+            db.execute(
+                'INSERT INTO availability (snapshot, clinician_name, availability_status, available_from_date, '
+                'availability_notes, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(snapshot, clinician_name) DO UPDATE SET '
+                'availability_status = excluded.availability_status, '
+                'updated_at = excluded.updated_at',
+                (snapshot, clinician_name) + values + (now,))
+            db.execute(
+                'INSERT INTO availability_log (snapshot, clinician_name, availability_status, available_from_date, '
+                'availability_notes, changed_by, changed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (snapshot, clinician_name) + values + (ROLLOVER_USER, now))
+            rolled.append(clinician_name)
+        if rolled:
+            _bump_versions(db, snapshot, rolled)
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    return len(rolled)
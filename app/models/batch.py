@@ -0,0 +1,143 @@
+"""
+Batch triage for the Psychology Clinic Triage Tool
+
+Matches a list of referrals against the roster in one vectorised pass. The
+roster's 'Y' flags are held as a boolean matrix (columns x clinicians), so a
+block of referrals becomes a few fancy-indexed ANDs over NumPy arrays. The
+eligibility rules and ranking are the same as search_clinicians().
+"""
+
+import csv
+import io
+import json
+
+import numpy as np
+
+from app.models.roster import FLAG_Y
+from app.models.search_index import CLOSED_STATUSES, presentation_key
+
+REFERRAL_FIELDS = ('age_group', 'presentation', 'funding_source', 'location')
+
+# Number of referrals matched per block, which bounds the size of the
+# referral x clinician matrix held in memory at once
+CHUNK_SIZE = 1024
+
+
+class FlagMatrix:
+    """Boolean matrix of the roster's 'Y' flags and locations"""
+
+    def __init__(self, roster):
+        size = len(roster)
+
+        # Flag columns first, then any other columns holding literal 'Y' values
+        columns = list(roster.flag_columns) + list(roster.y_rows)
+        self.column_ids = {column: i for i, column in enumerate(columns)}
+        # The extra last row is all False, for columns no clinician flags
+        self.missing_column = len(columns)
+        self.flags = np.zeros((len(columns) + 1, size), dtype=bool)
+        self.flags[:len(roster.flag_columns)] = (np.asarray(roster.flags) == FLAG_Y).T
+        for column, rows in roster.y_rows.items():
+            self.flags[self.column_ids[column], rows] = True
+
+        primary_locations = roster.column('primary_location')
+        locations = sorted(set(primary_locations), key=str)
+        self.location_ids = {location: i for i, location in enumerate(locations)}
+        # Two extra rows: unknown locations (all False) and "Flexible" (all True)
+        self.missing_location = len(locations)
+        self.flexible = len(locations) + 1
+        self.locations = np.zeros((len(locations) + 2, size), dtype=bool)
+        self.locations[self.flexible] = True
+        self.locations[[self.location_ids[location] for location in primary_locations], np.arange(size)] = True
+
+        statuses = roster.column('availability_status')
+        self.open = np.array([status not in CLOSED_STATUSES for status in statuses], dtype=bool)
+        available = np.array([status == 'Available' for status in statuses], dtype=bool)
+
+        # Ranking order: Available first, then roster order (all scores are equal)
+        self.order = np.argsort(~available, kind='stable')
+
+    def column(self, name):
+        return self.column_ids.get(name, self.missing_column)
+
+    def location(self, name):
+        if name == "Flexible":
+            return self.flexible
+        return self.location_ids.get(name, self.missing_location)
+
+    def match(self, referrals):
+        """Return a referrals x clinicians boolean matrix, columns in ranked order"""
+        presentations = [self.column(presentation_key(r['presentation']) + '_treats') for r in referrals]
+        age_groups = [self.column(r['age_group']) for r in referrals]
+        funding = [self.column(r['funding_source']) for r in referrals]
+        mhcp = np.array([r['funding_source'] == 'mhcp' for r in referrals], dtype=bool)
+        locations = [self.location(r['location']) for r in referrals]
+
+        eligible = self.flags[presentations] & self.flags[age_groups]
+        # Special case: if MHCP is selected, all clinicians are considered to accept it
+        eligible &= self.flags[funding] | mhcp[:, None]
+        eligible &= self.locations[locations]
+        eligible &= self.open
+
+        return eligible[:, self.order]
+
+
+# Helper function to check a referral has every field filled in
+def validate_referral(referral):
+    missing = [field for field in REFERRAL_FIELDS if not referral.get(field)]
+    if missing:
+        return f"Missing fields: {', '.join(missing)}"
+    invalid = [field for field in REFERRAL_FIELDS if not isinstance(referral[field], str)]
+    if invalid:
+        return f"Invalid fields: {', '.join(invalid)}"
+    return None
+
+
+def match_referrals(matrix, referrals, chunk_size=CHUNK_SIZE):
+    """Yield (referral, ranked clinician ids or None, error) for each referral, in order"""
+    for start in range(0, len(referrals), chunk_size):
+        chunk = referrals[start:start + chunk_size]
+
+        valid = []
+        errors = {}
+        for i, referral in enumerate(chunk):
+            error = validate_referral(referral)
+            if error:
+                errors[i] = error
+            else:
+                valid.append(i)
+
+        eligible = matrix.match([chunk[i] for i in valid]) if valid else None
+        rows = {i: row for row, i in enumerate(valid)}
+
+        for i, referral in enumerate(chunk):
+            if i in errors:
+                yield referral, None, errors[i]
+            else:
+                ids = matrix.order[np.flatnonzero(eligible[rows[i]])]
+                yield referral, ids.tolist(), None
+
+
+def parse_referrals(text, fmt=None):
+    """Parse a CSV or JSON list of referrals into a list of dicts
+
+    JSON input may be a list of objects or a list of
+    [age_group, presentation, funding_source, location] lists. CSV input must
+    have a header row naming the referral fields.
+    """
+    if fmt is None:
+        fmt = 'json' if text.lstrip()[:1] in ('[', '{') else 'csv'
+
+    if fmt == 'json':
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('referrals', [])
+        referrals = []
+        for item in data:
+            if isinstance(item, dict):
+                referrals.append({field: item.get(field) for field in REFERRAL_FIELDS})
+            else:
+                referrals.append(dict(zip(REFERRAL_FIELDS, item)))
+        return referrals
+
+    reader = csv.DictReader(io.StringIO(text))
+    return [{field: (row.get(field) or '').strip() for field in REFERRAL_FIELDS} for row in reader]
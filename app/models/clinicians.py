@@ -0,0 +1,165 @@
+"""
+Normalised clinician tables for the Psychology Clinic Triage Tool
+
+Each roster snapshot is mirrored into the database as one clinicians row per
+clinician plus one capabilities row per 'Y' or 'Conditional' flag. A
+clinician carried over unchanged from the previous snapshot gets a new
+clinicians row that points at the capabilities rows already written for it
+(flags_id), so only changed clinicians add capabilities rows. The
+composite indexes match the search predicates, so a triage search is a single
+indexed query. Availability edits come from the availability table, exactly
+as they are overlaid on the in-memory roster.
+"""
+
+import numpy as np
+
+from app.models.database import get_db
+from app.models.roster import FLAG_VALUES, KEEP_SNAPSHOTS
+from app.models.search_index import CLOSED_STATUSES
+
+# Flag values stored in the capabilities table
+STORED_VALUES = ('Y', 'Conditional')
+
+SEARCH_SQL = """
+SELECT c.row,
+       CASE WHEN av.clinician_name IS NOT NULL THEN av.availability_status
+            ELSE c.availability_status END AS status
+FROM capabilities p
+JOIN clinicians c ON c.flags_id = p.clinician_id
+JOIN capabilities a ON a.clinician_id = c.flags_id AND a.code = :age_group AND a.value = 'Y'
+LEFT JOIN availability av
+       ON c.name_primary = 1 AND av.snapshot = c.snapshot AND av.clinician_name = c.clinician_name
+WHERE p.code = :presentation_column AND p.value = 'Y'
+  AND c.snapshot = :snapshot
+  AND (:location = 'Flexible' OR c.primary_location = :location)
+  AND (:funding_source = 'mhcp' OR EXISTS (
+        SELECT 1 FROM capabilities f
+        WHERE f.code = :funding_source AND f.value = 'Y' AND f.clinician_id = c.flags_id))
+  AND IFNULL(status, '') NOT IN ({closed})
+ORDER BY status IS NOT 'Available', c.row
+""".format(closed=', '.join(f"'{status}'" for status in CLOSED_STATUSES))
+
+
+# Helper function to check whether a snapshot is already in the database
+def _has_snapshot(db, snapshot):
+    return db.execute('SELECT 1 FROM clinicians WHERE snapshot = ? LIMIT 1', (snapshot,)).fetchone() is not None
+
+
+def add_snapshot(roster, upload_folder=None, diff=None):
+    """Copy a roster snapshot into the database (before it goes live)
+
+    Given a RosterDiff (see app.models.roster_diff), rows unchanged since its
+    base snapshot are copied from the base's rows within the database and
+    share their capabilities; only added and changed rows are written from
+    Python.
+    """
+    db = get_db(upload_folder)
+    snapshot = roster.meta['snapshot']
+    if _has_snapshot(db, snapshot):
+        return
+
+    names = roster.column('clinician_name')
+    locations = roster.column('primary_location')
+    statuses = roster.column('availability_status')
+    primary_rows = set(roster.name_index.values())
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Another worker may have copied it in while we waited for the lock
+        if _has_snapshot(db, snapshot):
+            db.execute('COMMIT')
+            return
+
+        if diff is not None and _has_snapshot(db, diff.snapshot):
+            _copy_rows(db, diff, snapshot, primary_rows)
+            rows = diff.written_rows()
+            ids = [db.execute('INSERT INTO clinicians (snapshot, row, clinician_name, name_primary, '
+                              'primary_location, availability_status) VALUES (?, ?, ?, ?, ?, ?)',
+                              (snapshot, i, names[i], int(i in primary_rows), locations[i], statuses[i])).lastrowid
+                   for i in rows]
+            db.executemany('UPDATE clinicians SET flags_id = id WHERE id = ?', ((i,) for i in ids))
+        else:
+            rows = list(range(len(roster)))
+            db.executemany(
+                'INSERT INTO clinicians (snapshot, row, clinician_name, name_primary, primary_location, '
+                'availability_status) VALUES (?, ?, ?, ?, ?, ?)',
+                ((snapshot, i, names[i], int(i in primary_rows), locations[i], statuses[i]) for i in rows))
+            db.execute('UPDATE clinicians SET flags_id = id WHERE snapshot = ?', (snapshot,))
+            ids = [row[0] for row in db.execute('SELECT id FROM clinicians WHERE snapshot = ? ORDER BY row',
+                                                (snapshot,))]
+
+        # Flags of the rows just written; ids[k] is the id of rows[k]
+        codes = np.asarray(roster.flags)[rows]
+        stored = [FLAG_VALUES.index(value) for value in STORED_VALUES]
+        for j, column in enumerate(roster.flag_columns):
+            column_codes = codes[:, j]
+            for value, code in zip(STORED_VALUES, stored):
+                matches = (column_codes == code).nonzero()[0].tolist()
+                db.executemany('INSERT INTO capabilities (clinician_id, code, value) VALUES (?, ?, ?)',
+                               ((ids[k], column, value) for k in matches))
+        # Literal 'Y' values outside the flag columns still count as matches
+        positions = {row: k for k, row in enumerate(rows)}
+        for column, y_rows in roster.y_rows.items():
+            db.executemany('INSERT INTO capabilities (clinician_id, code, value) VALUES (?, ?, ?)',
+                           ((ids[positions[i]], column, 'Y') for i in y_rows if i in positions))
+
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+# Helper function to copy a diff's unchanged rows from its base snapshot, sharing their capabilities
+def _copy_rows(db, diff, snapshot, primary_rows):
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS row_map ('
+               'old_row INTEGER PRIMARY KEY, new_row INTEGER NOT NULL, name_primary INTEGER NOT NULL)')
+    db.execute('DELETE FROM row_map')
+    db.executemany('INSERT INTO row_map (old_row, new_row, name_primary) VALUES (?, ?, ?)',
+                   ((old_row, row, int(row in primary_rows))
+                    for row, old_row in enumerate(diff.old_rows) if old_row is not None))
+    db.execute('INSERT INTO clinicians (snapshot, row, clinician_name, name_primary, primary_location, '
+               'availability_status, flags_id) '
+               'SELECT ?, m.new_row, c.clinician_name, m.name_primary, c.primary_location, c.availability_status, '
+               'c.flags_id FROM row_map m JOIN clinicians c ON c.snapshot = ? AND c.row = m.old_row',
+               (snapshot, diff.snapshot))
+
+
+def remove_old_snapshots(snapshot, upload_folder=None):
+    """Delete all but the newest KEEP_SNAPSHOTS snapshots, and their availability edits
+
+    Workers that haven't re-read current.json yet still search the snapshot
+    they have, so the few before the live one stay, as on disk.
+    """
+    db = get_db(upload_folder)
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Snapshot ids start with their creation time, so they sort oldest first
+        snapshots = [row[0] for row in db.execute(
+            'SELECT snapshot FROM clinicians UNION SELECT snapshot FROM availability ORDER BY 1')]
+        old = [name for name in snapshots[:-KEEP_SNAPSHOTS] if name != snapshot]
+        if old:
+            db.execute('CREATE TEMP TABLE IF NOT EXISTS old_snapshots (snapshot TEXT PRIMARY KEY)')
+            db.execute('DELETE FROM old_snapshots')
+            db.executemany('INSERT INTO old_snapshots (snapshot) VALUES (?)', ((name,) for name in old))
+            # Capabilities still shared with a snapshot that's kept stay
+            db.execute('DELETE FROM capabilities WHERE clinician_id IN '
+                       '(SELECT flags_id FROM clinicians WHERE snapshot IN old_snapshots '
+                       'EXCEPT SELECT flags_id FROM clinicians WHERE snapshot NOT IN old_snapshots)')
+            db.execute('DELETE FROM clinicians WHERE snapshot IN old_snapshots')
+            db.execute('DELETE FROM availability WHERE snapshot IN old_snapshots')
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def search_rows(snapshot, age_group, presentation_column, funding_source, location, upload_folder=None):
+    """Return the roster rows matching a search, ranked Available first"""
+    rows = get_db(upload_folder).execute(SEARCH_SQL, {
+        'snapshot': snapshot,
+        'age_group': age_group,
+        'presentation_column': presentation_column,
+        'funding_source': funding_source,
+        'location': location,
+    })
+    return [row[0] for row in rows]
@@ -0,0 +1,215 @@
+"""
+SQLite database for the Psychology Clinic Triage Tool
+
+The database lives at uploads/triage.db and runs in WAL mode, so readers in
+every worker never block the single writer. Each thread gets its own
+connection, opened on first use, and any pending schema migrations are
+applied when a connection is opened.
+"""
+
+import os
+import sqlite3
+import threading
+
+from flask import current_app
+
+DATABASE_FILENAME = 'triage.db'
+
+# Seconds a writer waits for another process's write lock before giving up
+BUSY_TIMEOUT = 10
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    # 1: availability edits and their change log
+    """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+
+    -- Current availability set by admins, per snapshot and clinician
+    CREATE TABLE IF NOT EXISTS availability (
+        snapshot TEXT NOT NULL,
+        clinician_name TEXT NOT NULL,
+        availability_status TEXT,
+        available_from_date TEXT,
+        availability_notes TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (snapshot, clinician_name)
+    );
+
+    -- Append-only history of every availability change
+    CREATE TABLE IF NOT EXISTS availability_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        snapshot TEXT NOT NULL,
+        clinician_name TEXT NOT NULL,
+        availability_status TEXT,
+        available_from_date TEXT,
+        availability_notes TEXT,
+        changed_by TEXT,
+        changed_at TEXT NOT NULL
+    );
+    """,
+    # 2: normalised roster tables and user accounts
+    """
+    -- One row per clinician in each roster snapshot
+    CREATE TABLE clinicians (
+        id INTEGER PRIMARY KEY,
+        snapshot TEXT NOT NULL,
+        row INTEGER NOT NULL,
+        clinician_name TEXT,
+        -- 1 for the row availability edits apply to (the first with this name)
+        name_primary INTEGER NOT NULL,
+        primary_location TEXT,
+        availability_status TEXT,
+        UNIQUE (snapshot, row)
+    );
+    CREATE INDEX clinicians_location ON clinicians (snapshot, primary_location, row);
+
+    -- Presentation, age group and funding flags; only 'Y' and 'Conditional' are stored
+    CREATE TABLE capabilities (
+        clinician_id INTEGER NOT NULL,
+        code TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (code, value, clinician_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX capabilities_clinician ON capabilities (clinician_id);
+
+    CREATE TABLE users (
+        username TEXT PRIMARY KEY,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL,
+        name TEXT NOT NULL
+    );
+    """,
+    # 3: search results shared between workers
+    """
+    CREATE TABLE search_cache (
+        key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created REAL NOT NULL,
+        used REAL NOT NULL
+    );
+    CREATE INDEX search_cache_used ON search_cache (used);
+    """,
+    # 4: unchanged clinicians share their capabilities rows between snapshots
+    """
+    -- The id of the clinicians row the capabilities were written for; a row
+    -- carried over unchanged from an earlier snapshot keeps that row's
+    ALTER TABLE clinicians ADD COLUMN flags_id INTEGER;
+    UPDATE clinicians SET flags_id = id;
+    CREATE INDEX clinicians_flags ON clinicians (flags_id, snapshot);
+    """,
+    # 5: search audit rollups, and how far each audit log segment has been read into them
+    """
+    CREATE TABLE audit_rollups (
+        day TEXT NOT NULL,
+        age_group TEXT NOT NULL,
+        presentation TEXT NOT NULL,
+        funding_source TEXT NOT NULL,
+        location TEXT NOT NULL,
+        searches INTEGER NOT NULL,
+        zero_matches INTEGER NOT NULL,
+        PRIMARY KEY (day, age_group, presentation, funding_source, location)
+    );
+    CREATE TABLE audit_segments (
+        name TEXT PRIMARY KEY,
+        bytes_read INTEGER NOT NULL
+    );
+    """,
+]
+
+_local = threading.local()
+
+
+# Helper function to get the path of the database file
+def get_database_path(upload_folder=None):
+    if upload_folder is None:
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+    return os.path.join(upload_folder, DATABASE_FILENAME)
+
+
+def get_db(upload_folder=None):
+    """Return this thread's connection to the database, creating the schema if needed"""
+    path = get_database_path(upload_folder)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    db = connections.get(path)
+    if db is None:
+        db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        migrate(db)
+        connections[path] = db
+    return db
+
+
+def migrate(db):
+    """Apply any schema migrations this database hasn't had yet"""
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Re-check under the write lock in case another process just migrated
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        for number in range(version, len(MIGRATIONS)):
+            for statement in _statements(MIGRATIONS[number]):
+                db.execute(statement)
+            db.execute(f'PRAGMA user_version = {number + 1}')
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+# Helper function to split a migration script into statements (executescript would commit early)
+def _statements(script):
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip():
+                yield statement
+            statement = ''
+    if statement.strip():
+        yield statement
+
+
+def get_counter(db, key):
+    """Read a counter from the meta table (0 if it has never been set)"""
+    row = db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_counter(db, key):
+    """Increment a counter in the meta table; call inside a write transaction"""
+    db.execute('INSERT INTO meta (key, value) VALUES (?, 1) '
+               'ON CONFLICT(key) DO UPDATE SET value = value + 1', (key,))
+
+
+def close_connections():
+    """Close this thread's connections (run in a process before it forks workers)"""
+    connections = getattr(_local, 'connections', None) or {}
+    while connections:
+        connections.popitem()[1].close()
+
+
+# Connections inherited by a forked child, kept referenced so they are never
+# finalised there: closing one would use the parent's SQLite state (and with
+# WAL could checkpoint or remove the -wal/-shm files the parent still uses)
+_inherited = []
+
+
+# Connections must never be shared with a forked child process
+def _reset_after_fork():
+    _inherited.append(dict(_local.__dict__))
+    _local.__dict__.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
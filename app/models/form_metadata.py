@@ -0,0 +1,98 @@
+"""
+Search form metadata for the Psychology Clinic Triage Tool
+
+Everything the triage form needs from the roster: the option lists, their
+id -> label dicts and the rendered <option> elements. It is built once per
+roster snapshot, and availability edits don't change it. It also holds the
+rendered form page, so a repeat visit costs a dict lookup, and the page's
+ETag and Last-Modified values for conditional GETs.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+
+from markupsafe import Markup, escape
+
+AGE_GROUPS = (
+    {"id": "age_0_6", "label": "0-6 years"},
+    {"id": "age_6_12", "label": "6-12 years"},
+    {"id": "age_12_18", "label": "12-18 years"},
+    {"id": "age_18_plus", "label": "18+ years"},
+    {"id": "age_70_plus", "label": "70+ years"},
+)
+
+FUNDING_SOURCES = (
+    {"id": "mhcp", "label": "MHCP"},
+    {"id": "ndis", "label": "NDIS"},
+    {"id": "dva", "label": "DVA"},
+    {"id": "wc", "label": "Workers Compensation"},
+    {"id": "qps", "label": "QPS"},
+    {"id": "eap", "label": "EAP"},
+    {"id": "private", "label": "Private"},
+)
+
+# Locations always offered, ahead of any others in the roster
+DEFAULT_LOCATIONS = ("Maroochydore", "Sippy Downs", "Flexible")
+
+AGE_GROUP_LABELS = {group['id']: group['label'] for group in AGE_GROUPS}
+FUNDING_SOURCE_LABELS = {source['id']: source['label'] for source in FUNDING_SOURCES}
+
+# Templates the cached page is rendered from; their contents are part of its ETag
+PAGE_TEMPLATES = ('base.html', 'triage/index.html')
+
+
+# Helper function to render (value, label) pairs as <option> elements
+def render_options(items):
+    return Markup(''.join(f'<option value="{escape(value)}">{escape(label)}</option>' for value, label in items))
+
+
+class FormMetadata:
+    """Option lists, labels and cached renderings for one roster snapshot"""
+
+    def __init__(self, roster):
+        self.snapshot = (roster.meta or {}).get('snapshot')
+        self.presentations = roster.presentations
+        self.locations = list(DEFAULT_LOCATIONS) + [loc for loc in roster.locations if loc not in DEFAULT_LOCATIONS]
+        self.genders = roster.genders
+        self.age_group_labels = AGE_GROUP_LABELS
+        self.funding_source_labels = FUNDING_SOURCE_LABELS
+
+        self.options = {
+            'age_group': render_options((group['id'], group['label']) for group in AGE_GROUPS),
+            'funding_source': render_options((source['id'], source['label']) for source in FUNDING_SOURCES),
+            'location': render_options((location, location) for location in self.locations),
+            'gender_preference': render_options((gender, gender) for gender in self.genders),
+        }
+
+        # When the snapshot went live, to the second as HTTP dates are
+        created = roster.version[0] / 1e9 if roster.version else 0
+        self.last_modified = datetime.fromtimestamp(int(created), timezone.utc)
+
+        self._pages = {}
+
+    def etag(self, template_hash, *variant):
+        """ETag for a page rendered from this snapshot, the templates' contents and any variant (e.g. role)"""
+        key = repr((self.snapshot, template_hash) + variant).encode()
+        return hashlib.md5(key).hexdigest()
+
+    def page(self, key, render):
+        """Return the page cached under key, rendering it with render() the first time"""
+        html = self._pages.get(key)
+        if html is None:
+            html = self._pages[key] = render()
+        return html
+
+
+_template_hash = None
+
+
+def get_template_hash(app):
+    """Hash of the form page's templates, read once per process"""
+    global _template_hash
+    if _template_hash is None:
+        digest = hashlib.md5()
+        for name in PAGE_TEMPLATES:
+            source = app.jinja_env.loader.get_source(app.jinja_env, name)[0]
+            digest.update(source.encode())
+        _template_hash = digest.hexdigest()
+    return _template_hash
@@ -0,0 +1,647 @@
+"""
+Clinician roster store for the Psychology Clinic Triage Tool
+
+The roster is stored column-wise in a snapshot directory under
+uploads/roster/:
+
+    current.json          row count, column metadata and the live snapshot id
+    <snapshot>/flags.npy  Y/N/Conditional columns as a rows x columns int8 matrix
+    <snapshot>/text.json  the remaining columns, as one list per column
+    <snapshot>/notes.json free-text *_notes columns, only loaded when needed
+
+The flag matrix is memory-mapped, so every worker shares the same pages. A new
+snapshot is written to its own directory and made live by atomically replacing
+current.json, under a file lock so uploads from different processes can't
+interleave; readers stat that file to notice a new version. A legacy
+clinicians.json is converted to a snapshot the first time it is read.
+
+Snapshots are never edited. Availability changes made by admins live in the
+database (see app.models.availability) and are overlaid on the snapshot when
+the roster is read.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+from datetime import date, datetime
+from functools import cached_property
+
+import numpy as np
+from flask import current_app
+
+from app.models import availability
+from app.models.availability import AVAILABILITY_FIELDS
+from app.models.roster_diff import row_hashes, save_hashes
+from app.utils.locking import file_lock
+from app.utils.metrics import ROSTER_LOAD_SECONDS
+
+ROSTER_DIRNAME = 'roster'
+CURRENT_FILENAME = 'current.json'
+FLAGS_FILENAME = 'flags.npy'
+TEXT_FILENAME = 'text.json'
+NOTES_FILENAME = 'notes.json'
+LEGACY_FILENAME = 'clinicians.json'
+
+# Number of snapshots kept (directories and database rows), so a worker still
+# reading an older snapshot's lazily loaded notes, or searching its rows,
+# doesn't find them deleted underneath it
+KEEP_SNAPSHOTS = 3
+
+# Values of the flag columns, stored as their index in this tuple
+FLAG_VALUES = (None, 'Y', 'N', 'Conditional')
+FLAG_CODES = {value: code for code, value in enumerate(FLAG_VALUES)}
+FLAG_Y = FLAG_CODES['Y']
+
+# Loaded snapshots, and the rosters built from them with availability edits
+# applied, for this worker, keyed by roster folder
+_snapshots = {}
+_rosters = {}
+_lock = threading.Lock()
+
+
+class ClinicianRow(Mapping):
+    """Read-only dict-like view of one clinician in a roster"""
+
+    __slots__ = ('_roster', '_row')
+
+    def __init__(self, roster, row):
+        self._roster = roster
+        self._row = row
+
+    def __getitem__(self, column):
+        return self._roster.value(self._row, column)
+
+    # Overridden because Mapping.get adds a layer of calls to every lookup
+    def get(self, column, default=None):
+        try:
+            return self._roster.value(self._row, column)
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self._roster.columns)
+
+    def __len__(self):
+        return len(self._roster.columns)
+
+    def __repr__(self):
+        return f"ClinicianRow({dict(self)!r})"
+
+
+class Roster:
+    """An immutable, loaded snapshot of the clinician roster"""
+
+    def __init__(self, folder=None, meta=None, version=None, base=None, text=None):
+        meta = meta or {}
+        self.folder = folder
+        self.meta = meta
+        self.version = version
+        self.size = meta.get('rows', 0)
+        self.columns = meta.get('columns', [])
+        self.flag_columns = meta.get('flag_columns', [])
+        self.text_columns = meta.get('text_columns', [])
+        self.notes_columns = meta.get('notes_columns', [])
+        self._flag_ids = {column: j for j, column in enumerate(self.flag_columns)}
+        self._text_set = set(self.text_columns)
+        self._notes_set = set(self.notes_columns)
+        # The snapshot this roster applies availability edits to, if any, and the rows edited
+        self._base = base
+        self._edited_rows = []
+        # Availability counter of each location (see app.models.shards); None for a bare snapshot
+        self.location_versions = None
+        # Shards of the roster version this one replaced, to carry over unchanged ones
+        self._previous_shards = None
+
+        if base is not None:
+            self.flags = base.flags
+            self.text = text
+        elif folder is not None:
+            # Map the flags and read the core text columns straight away, so the
+            # snapshot stays readable even if a later upload replaces it
+            self.flags = self._load_flags()
+            with open(os.path.join(folder, TEXT_FILENAME), 'r') as f:
+                self.text = json.load(f)
+        else:
+            self.flags = np.zeros((0, 0), dtype=np.int8)
+            self.text = {}
+        # Plain ndarray view of the mapped flags; indexing it skips np.memmap's overhead
+        self._codes = np.asarray(self.flags)
+
+    def _load_flags(self):
+        if not self.size or not self.flag_columns:
+            return np.zeros((self.size, len(self.flag_columns)), dtype=np.int8)
+        return np.load(os.path.join(self.folder, FLAGS_FILENAME), mmap_mode='r')
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.clinicians)
+
+    @cached_property
+    def notes(self):
+        """Free-text notes columns, loaded on first use"""
+        if self._base is not None:
+            return self._base.notes
+        if self.folder is None:
+            return {}
+        with open(os.path.join(self.folder, NOTES_FILENAME), 'r') as f:
+            return json.load(f)
+
+    def value(self, row, column):
+        """Return one clinician's value for a column, raising KeyError if absent"""
+        values = self.text.get(column)
+        if values is not None:
+            return values[row]
+        j = self._flag_ids.get(column)
+        if j is not None:
+            return FLAG_VALUES[self._codes.item(row, j)]
+        if column in self._notes_set:
+            return self.notes[column][row]
+        raise KeyError(column)
+
+    def column(self, column):
+        """Return every clinician's value for a column (None where absent)"""
+        values = self.text.get(column)
+        if values is not None:
+            return values
+        j = self._flag_ids.get(column)
+        if j is not None:
+            return [FLAG_VALUES[code] for code in self.flags[:, j].tolist()]
+        if column in self._notes_set:
+            return self.notes[column]
+        return [None] * self.size
+
+    def row(self, row):
+        return ClinicianRow(self, row)
+
+    @cached_property
+    def clinicians(self):
+        """Dict-like views of every clinician, in roster order"""
+        return [ClinicianRow(self, i) for i in range(self.size)]
+
+    @property
+    def y_rows(self):
+        """Rows holding a literal 'Y' in columns that aren't flag columns"""
+        return self.meta.get('y_rows', {})
+
+    @cached_property
+    def name_index(self):
+        """Row of each clinician_name (the first, if a name is repeated)"""
+        rows = {}
+        for i, name in enumerate(self.column('clinician_name')):
+            rows.setdefault(name, i)
+        return rows
+
+    def with_availability(self, overrides, version, location_versions=None, previous=None):
+        """Return a roster sharing this snapshot's data with availability edits applied
+
+        overrides maps clinician_name to {field: value} for AVAILABILITY_FIELDS.
+        Only the availability columns are copied. location_versions are the
+        per-location availability counters; given the roster version this one
+        replaces, its shards for unchanged locations are carried over.
+        """
+        text = dict(self.text)
+        columns = list(self.columns)
+        text_columns = list(self.text_columns)
+        rows = self.name_index
+
+        for field in AVAILABILITY_FIELDS:
+            values = list(self.column(field))
+            if field not in self._text_set:
+                if field not in columns:
+                    columns.append(field)
+                text_columns.append(field)
+            for name, fields in overrides.items():
+                row = rows.get(name)
+                if row is not None:
+                    values[row] = fields[field]
+            text[field] = values
+
+        meta = dict(self.meta, columns=columns, text_columns=text_columns)
+        roster = Roster(self.folder, meta, version, base=self, text=text)
+        roster.name_index = rows
+        roster._edited_rows = [rows[name] for name in overrides if name in rows]
+        roster.location_versions = location_versions or {}
+        if previous is not None and previous._base is self:
+            roster._previous_shards = previous.__dict__.get('shards')
+        return roster
+
+    def rollover_due(self, day):
+        """Return {clinician_name: availability fields} of waitlisted clinicians available by a day number"""
+        names = self.column('clinician_name')
+        return {names[row]: {field: self.value(row, field) for field in AVAILABILITY_FIELDS}
+                for row in self.availability_index.rollover_rows(day)}
+
+    @cached_property
+    def location_rows(self):
+        """Rows of each primary_location, in location order"""
+        if self._base is not None:
+            return self._base.location_rows
+        rows = {}
+        for i, location in enumerate(self.column('primary_location')):
+            rows.setdefault(location, []).append(i)
+        return {location: np.array(rows[location], dtype=np.int64) for location in sorted(rows, key=str)}
+
+    @cached_property
+    def shards(self):
+        """The roster split by primary_location, each part with its own search structures"""
+        from app.models.shards import Shards
+        previous, self._previous_shards = self._previous_shards, None
+        if previous is None and self._base is not None:
+            previous = self._base.__dict__.get('shards')
+        return Shards(self, previous)
+
+    @cached_property
+    def availability_index(self):
+        """Sorted available from dates, built once per roster version"""
+        from app.models.search_index import AvailabilityIndex
+        statuses = self.column('availability_status')
+        dates = self.column('available_from_date')
+        primary_rows = list(self.name_index.values())
+        if self._base is not None:
+            # Only the edited clinicians' dates can differ from the snapshot's
+            return self._base.availability_index.with_changes(statuses, dates, self._edited_rows, primary_rows)
+        return AvailabilityIndex.from_values(statuses, dates, primary_rows)
+
+    @cached_property
+    def presentations(self):
+        """Display names of the presentations, e.g. 'Eating Disorders', sorted"""
+        return sorted(col.replace('_treats', '').replace('_', ' ').title()
+                      for col in self.columns if col.endswith('_treats'))
+
+    @cached_property
+    def autocomplete(self):
+        """Presentation autocomplete, built once per snapshot"""
+        if self._base is not None:
+            return self._base.autocomplete
+        from app.models.autocomplete import Autocomplete
+        return Autocomplete(self.presentations)
+
+    @cached_property
+    def locations(self):
+        """Distinct non-blank primary locations, sorted"""
+        return [location for location in self.location_rows if location]
+
+    @cached_property
+    def genders(self):
+        """Distinct non-blank genders, sorted"""
+        if self._base is not None:
+            return self._base.genders
+        return sorted({gender for gender in self.column('gender') if gender})
+
+    @cached_property
+    def form_metadata(self):
+        """Search form options and labels, built once per snapshot"""
+        if self._base is not None:
+            return self._base.form_metadata
+        from app.models.form_metadata import FormMetadata
+        return FormMetadata(self)
+
+    @cached_property
+    def matrix(self):
+        """Boolean flag matrix for batch triage, built on first use"""
+        # The batch module is only needed for batch matching, so import it lazily
+        from app.models.batch import FlagMatrix
+        return FlagMatrix(self)
+
+
+# Helper function to get the folder holding roster snapshots
+def get_roster_folder(upload_folder=None):
+    if upload_folder is None:
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+    return os.path.join(upload_folder, ROSTER_DIRNAME)
+
+
+# Helper function to get the path of the current snapshot's metadata file
+def get_roster_path(upload_folder=None):
+    return os.path.join(get_roster_folder(upload_folder), CURRENT_FILENAME)
+
+
+# Helper function to get the path of a pre-columnar clinicians.json roster
+def get_legacy_path(upload_folder=None):
+    if upload_folder is None:
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+    return os.path.join(upload_folder, LEGACY_FILENAME)
+
+
+# Helper function to build a version key from the file's stat result
+def _stat_version(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def roster_exists(upload_folder=None):
+    """Check whether a roster has been uploaded"""
+    return os.path.exists(get_roster_path(upload_folder)) or os.path.exists(get_legacy_path(upload_folder))
+
+
+def get_metadata(upload_folder=None):
+    """Return the current snapshot's row count and column metadata
+
+    Only current.json is read, so this is cheap enough for pages that just
+    need counts or column names.
+    """
+    snapshot = _snapshots.get(get_roster_folder(upload_folder))
+    if snapshot is not None and snapshot.version == _stat_version(get_roster_path(upload_folder)):
+        return snapshot.meta
+
+    try:
+        with open(get_roster_path(upload_folder), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return get_roster(upload_folder).meta
+
+
+# Helper function to get the live snapshot, reloading only if current.json has changed
+def _get_snapshot(upload_folder):
+    folder = get_roster_folder(upload_folder)
+    path = os.path.join(folder, CURRENT_FILENAME)
+    version = _stat_version(path)
+
+    snapshot = _snapshots.get(folder)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    if version is None:
+        # Convert a roster saved by an older version of the tool
+        legacy_path = get_legacy_path(upload_folder)
+        if os.path.exists(legacy_path):
+            with open(legacy_path, 'r') as f:
+                save_clinicians(json.load(f), upload_folder)
+            return _snapshots.get(folder)
+        return None
+
+    with _lock:
+        # Another thread may have reloaded while we waited for the lock
+        snapshot = _snapshots.get(folder)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with open(path, 'r') as f:
+            meta = json.load(f)
+
+        started = time.perf_counter()
+        snapshot = Roster(os.path.join(folder, meta['snapshot']), meta, version)
+        ROSTER_LOAD_SECONDS.observe(time.perf_counter() - started, kind='snapshot')
+
+        # Snapshots saved before the database held the roster are copied in on first load
+        from app.models import clinicians
+        clinicians.add_snapshot(snapshot, upload_folder)
+
+        _snapshots[folder] = snapshot
+        return snapshot
+
+
+def get_roster(upload_folder=None):
+    """Return the current roster: the live snapshot plus any availability edits
+
+    Costs one stat() and one small database read when nothing has changed.
+    """
+    snapshot = _get_snapshot(upload_folder)
+    if snapshot is None:
+        return Roster()
+
+    folder = get_roster_folder(upload_folder)
+    version = (snapshot.version, availability.get_version(upload_folder))
+
+    roster = _rosters.get(folder)
+    if roster is not None and roster.version == version:
+        return _roll_over(roster, upload_folder)
+
+    started = time.perf_counter()
+    # Read before the edits, so a concurrent edit can only make a shard look older than it is
+    location_versions = availability.get_location_versions(upload_folder)
+    overrides = availability.get_overrides(snapshot.meta['snapshot'], upload_folder)
+    previous = roster
+    roster = snapshot.with_availability(overrides, version, location_versions, previous)
+    ROSTER_LOAD_SECONDS.observe(time.perf_counter() - started, kind='availability')
+    if roster._previous_shards is not None or 'shards' in snapshot.__dict__:
+        # Carry over the shards of unchanged locations now, rather than holding on to the old roster
+        roster.shards
+    _rosters[folder] = roster
+    return _roll_over(roster, upload_folder)
+
+
+# Helper function to make waitlisted clinicians available once their date arrives, returning the current roster
+def _roll_over(roster, upload_folder):
+    today = date.today().toordinal()
+    if roster.availability_index.next_rollover > today:
+        return roster
+    # Written to the database like an admin edit, so every worker and the SQL search see it
+    if availability.roll_over(roster.meta['snapshot'], roster.rollover_due(today), upload_folder):
+        return get_roster(upload_folder)
+    return roster
+
+
+def get_clinicians(upload_folder=None):
+    """Return dict-like views of every clinician in the current roster
+
+    The views are read-only; use save_clinicians() to replace the roster or
+    availability.update_availability() to edit one clinician.
+    """
+    return get_roster(upload_folder).clinicians
+
+
+# Helper function to decide how a column is stored
+def _column_kind(name, values):
+    # Availability is edited by admins and overlaid on every read, so keep it with the core columns
+    if name in AVAILABILITY_FIELDS:
+        return 'text'
+    if name.endswith('_notes'):
+        return 'notes'
+    if any(value is not None for value in values) and all(value in FLAG_CODES for value in values):
+        return 'flag'
+    return 'text'
+
+
+def prepare_columns(columns):
+    """Normalise uploaded column values the way they are stored (safe to call more than once)"""
+    # Store dates as YYYY-MM-DD so they sort and compare; anything unreadable is kept as entered
+    if 'available_from_date' in columns:
+        columns = dict(columns, available_from_date=[availability.normalise_date(value, strict=False)
+                                                     for value in columns['available_from_date']])
+    return columns
+
+
+def get_snapshot(upload_folder=None):
+    """Return the live snapshot without availability edits applied, or None if there isn't one"""
+    return _get_snapshot(upload_folder)
+
+
+# Helper function to split columns into flag, text and notes columns, recording 'Y' rows outside flag columns
+def _classify_columns(columns):
+    flag_columns, text_columns, notes_columns = [], [], []
+    y_rows = {}
+    for name in columns:
+        kind = _column_kind(name, columns[name])
+        if kind == 'flag':
+            flag_columns.append(name)
+            continue
+        (notes_columns if kind == 'notes' else text_columns).append(name)
+        # Record literal 'Y' values outside flag columns so searches still see them
+        rows = [i for i, value in enumerate(columns[name]) if value == 'Y']
+        if rows:
+            y_rows[name] = rows
+    return flag_columns, text_columns, notes_columns, y_rows
+
+
+# Helper function to check a diff's base rows can be reused for these columns
+def _can_reuse(diff, columns):
+    if diff is None or diff.schema_changed:
+        return False
+    # Rows being written must still fit the base's flag columns
+    rows = diff.written_rows()
+    return all(columns[name][row] in FLAG_CODES for name in diff.base.flag_columns for row in rows)
+
+
+# Helper function to build the flag matrix and 'Y' rows by copying the base's unchanged rows
+def _reuse_rows(diff, columns, size):
+    base = diff.base
+    flags = np.zeros((size, len(base.flag_columns)), dtype=np.int8)
+    pairs = [(row, old_row) for row, old_row in enumerate(diff.old_rows) if old_row is not None]
+    if pairs and base.flag_columns:
+        new_rows, old_rows = zip(*pairs)
+        flags[list(new_rows)] = base._codes[list(old_rows)]
+    written = diff.written_rows()
+    for j, name in enumerate(base.flag_columns):
+        values = columns[name]
+        for row in written:
+            flags[row, j] = FLAG_CODES[values[row]]
+
+    moved = {old_row: row for row, old_row in pairs}
+    y_rows = {}
+    for name in base.text_columns + base.notes_columns:
+        rows = [moved[old_row] for old_row in base.y_rows.get(name, ()) if old_row in moved]
+        rows += [row for row in written if columns[name][row] == 'Y']
+        if rows:
+            y_rows[name] = sorted(rows)
+    return flags, y_rows
+
+
+def save_columns(columns, upload_folder=None, diff=None, keep_availability=True):
+    """Write a roster given as {column name: list of values} and make it live
+
+    Every list must have one entry per clinician. Values must already be
+    JSON-compatible. Given a RosterDiff against the live snapshot (see
+    app.models.roster_diff), unchanged rows are copied from it rather than
+    encoded and written to the database again. With keep_availability,
+    availability edits made in the app carry over to clinicians still on
+    the roster.
+    """
+    folder = get_roster_folder(upload_folder)
+    columns = prepare_columns(columns)
+    names = list(columns)
+    size = len(columns[names[0]]) if names else 0
+
+    hashes = diff.hashes if diff is not None else row_hashes(names, columns.__getitem__)
+
+    # Reused rows hold the same values as the new ones, so their encoding can be copied
+    if _can_reuse(diff, columns):
+        base = diff.base
+        flag_columns, text_columns, notes_columns = base.flag_columns, base.text_columns, base.notes_columns
+        flags, y_rows = _reuse_rows(diff, columns, size)
+    else:
+        diff = None
+        flag_columns, text_columns, notes_columns, y_rows = _classify_columns(columns)
+        flags = np.zeros((size, len(flag_columns)), dtype=np.int8)
+        for j, name in enumerate(flag_columns):
+            flags[:, j] = [FLAG_CODES[value] for value in columns[name]]
+
+    snapshot = datetime.now().strftime('%Y%m%d%H%M%S%f') + '-' + uuid.uuid4().hex[:8]
+    snapshot_folder = os.path.join(folder, snapshot)
+    os.makedirs(snapshot_folder)
+
+    # json.dumps runs in C; json.dump to a file would encode in Python
+    np.save(os.path.join(snapshot_folder, FLAGS_FILENAME), flags)
+    with open(os.path.join(snapshot_folder, TEXT_FILENAME), 'w') as f:
+        f.write(json.dumps({name: columns[name] for name in text_columns}))
+    with open(os.path.join(snapshot_folder, NOTES_FILENAME), 'w') as f:
+        f.write(json.dumps({name: columns[name] for name in notes_columns}))
+    save_hashes(snapshot_folder, hashes)
+
+    meta = {
+        'snapshot': snapshot,
+        'rows': size,
+        'columns': names,
+        'flag_columns': flag_columns,
+        'text_columns': text_columns,
+        'notes_columns': notes_columns,
+        'y_rows': y_rows,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'base_snapshot': diff.snapshot if diff is not None else None,
+    }
+
+    roster = Roster(snapshot_folder, meta)
+    path = os.path.join(folder, CURRENT_FILENAME)
+
+    # Imported here because the clinicians module builds on this one
+    from app.models import clinicians
+
+    with file_lock(folder):
+        # Mirror the snapshot into the database before it goes live, so
+        # database searches never see a snapshot id they don't have rows for
+        clinicians.add_snapshot(roster, upload_folder, diff)
+        # Read under the lock, in case another upload went live since the diff was taken
+        live = _read_meta(path)
+        if keep_availability and live:
+            availability.copy_overrides(live['snapshot'], snapshot, upload_folder)
+
+        with _lock:
+            # Swap the new snapshot in atomically so readers never see a partial roster
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, path)
+
+            roster.version = _stat_version(path)
+            # Build the search indexes now so the first search after an upload doesn't pay for them
+            for shard in roster.shards.values():
+                shard.index
+            _snapshots[folder] = roster
+
+        clinicians.remove_old_snapshots(snapshot, upload_folder)
+        _remove_old_snapshots(folder, snapshot)
+
+    return get_roster(upload_folder)
+
+
+# Helper function to read current.json, or None if no roster has been saved
+def _read_meta(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_clinicians(clinicians, upload_folder=None):
+    """Write a roster given as a list of clinician dicts and make it live"""
+    # Round-trip through JSON so stored values match what the old JSON roster held
+    clinicians = json.loads(json.dumps([dict(c) for c in clinicians], default=str))
+
+    names = []
+    seen = set()
+    for clinician in clinicians:
+        for name in clinician:
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+
+    columns = {name: [clinician.get(name) for clinician in clinicians] for name in names}
+    return save_columns(columns, upload_folder)
+
+
+# Helper function to delete all but the newest snapshot directories
+def _remove_old_snapshots(folder, live_snapshot):
+    snapshots = sorted(entry for entry in os.listdir(folder) if os.path.isdir(os.path.join(folder, entry)))
+    for snapshot in snapshots[:-KEEP_SNAPSHOTS]:
+        if snapshot != live_snapshot:
+            shutil.rmtree(os.path.join(folder, snapshot), ignore_errors=True)
@@ -0,0 +1,195 @@
+"""
+Row-level diff between the live roster and a re-uploaded spreadsheet
+
+Clinicians are matched on clinician_name. A name that appears more than once
+is matched by occurrence: the first with the first, and so on. Each row's
+columns are split into groups, and each group is hashed per row:
+
+    details       name, location, gender and other plain columns
+    capabilities  *_treats, *_service_type, age group and funding columns
+    notes         free-text *_notes columns
+    availability  availability_status, available_from_date, availability_notes
+
+The hashes are saved with every snapshot (hashes.json). A re-upload only
+hashes the new spreadsheet and compares. A row whose hashes all match is
+reused from the live snapshot as it is. Only added and changed rows are
+encoded and written to the database.
+"""
+
+import hashlib
+import json
+import os
+import re
+from datetime import date, datetime
+
+from app.models.availability import AVAILABILITY_FIELDS, normalise_date
+
+HASHES_FILENAME = 'hashes.json'
+
+GROUPS = ('details', 'capabilities', 'notes', 'availability')
+
+# Column names in the capabilities group besides *_treats and *_service_type
+CAPABILITY_COLUMNS = ('age_0_6', 'age_6_12', 'age_12_18', 'age_18_plus', 'age_70_plus',
+                      'mhcp', 'ndis', 'dva', 'wc', 'qps', 'eap', 'private')
+
+# Names listed in the upload report for each kind of change
+MAX_NAMES = 50
+
+# Date cells stored as text, e.g. '2026-03-02 00:00:00'
+_MIDNIGHT = re.compile(r'\d{4}-\d{2}-\d{2} 00:00:00')
+
+# Cell types that _hash_value leaves as they are
+PLAIN_TYPES = {str, int, bool, type(None)}
+
+
+# Helper function to decide which group a column belongs to
+def column_group(name):
+    if name in AVAILABILITY_FIELDS:
+        return 'availability'
+    if name.endswith('_notes'):
+        return 'notes'
+    if name.endswith('_treats') or name.endswith('_service_type') or name in CAPABILITY_COLUMNS:
+        return 'capabilities'
+    return 'details'
+
+
+# Helper function to put a cell value in one form, whichever reader produced
+# it: pandas reads whole numbers in a column with blanks as floats (5.0 where
+# openpyxl gives 5), and dates are compared as ISO strings, as prepare_columns
+# stores available_from_date
+def _hash_value(value):
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, (date, datetime)):
+        return normalise_date(value)
+    if isinstance(value, str) and _MIDNIGHT.fullmatch(value):
+        return value[:10]
+    return value
+
+
+# Helper function to apply _hash_value to a column, skipping the common case
+# of a column with nothing to change
+def _hash_column(values):
+    kinds = set(map(type, values))
+    if kinds <= PLAIN_TYPES and not any(_MIDNIGHT.fullmatch(value) for value in values
+                                        if type(value) is str and len(value) == 19):
+        return values
+    return [_hash_value(value) for value in values]
+
+
+# Helper function to hash one row's values (JSON-compatible, so repr() is unambiguous and much faster than json.dumps)
+def _digest(values):
+    return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
+
+def row_hashes(names, column):
+    """Hash every row of a roster per column group
+
+    names is the column order; column(name) returns that column's values.
+    Returns {'columns': {group: [column names]}, 'rows': {group: [hash per row]}}.
+    """
+    groups = {group: [name for name in names if column_group(name) == group] for group in GROUPS}
+    rows = {}
+    for group, group_names in groups.items():
+        values = [_hash_column(column(name)) for name in group_names]
+        rows[group] = [_digest(row) for row in zip(*values)] if values else None
+    return {'columns': groups, 'rows': rows}
+
+
+# Helper function to key rows by clinician_name and occurrence
+def row_keys(names):
+    seen = {}
+    keys = []
+    for name in names:
+        seen[name] = seen.get(name, -1) + 1
+        keys.append((name, seen[name]))
+    return keys
+
+
+def save_hashes(folder, hashes):
+    """Write a snapshot's row hashes"""
+    with open(os.path.join(folder, HASHES_FILENAME), 'w') as f:
+        f.write(json.dumps(hashes))
+
+
+def load_hashes(roster):
+    """Return a snapshot's row hashes, computing them if it predates hashes.json"""
+    try:
+        with open(os.path.join(roster.folder, HASHES_FILENAME), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, TypeError):
+        return row_hashes(roster.columns, roster.column)
+
+
+class RosterDiff:
+    """What a re-upload changes, row by row, relative to a base snapshot"""
+
+    def __init__(self, base, columns, hashes):
+        self.base = base
+        self.snapshot = base.meta['snapshot']
+        self.hashes = hashes
+        self.column_names = list(columns)
+
+        old_names = list(base.columns)
+        self.added_columns = [name for name in self.column_names if name not in old_names]
+        self.removed_columns = [name for name in old_names if name not in self.column_names]
+        # Row reuse needs the same columns, in the same order, as the base
+        self.schema_changed = self.column_names != old_names
+
+        old_hashes = load_hashes(base)
+        old_keys = {key: row for row, key in enumerate(row_keys(base.column('clinician_name')))}
+        new_keys = row_keys(columns['clinician_name'])
+        comparable = [group for group in GROUPS
+                      if hashes['columns'][group] == old_hashes['columns'][group] and hashes['rows'][group]]
+
+        # For each new row, the base row it can be copied from, or None if it must be written
+        self.old_rows = [None] * len(new_keys)
+        self.added = []
+        self.changed = {}
+        for row, key in enumerate(new_keys):
+            old_row = old_keys.pop(key, None)
+            if old_row is None:
+                self.added.append(key[0])
+                continue
+            groups = [group for group in comparable
+                      if hashes['rows'][group][row] != old_hashes['rows'][group][old_row]]
+            if groups:
+                self.changed[key[0]] = groups
+            elif not self.schema_changed:
+                self.old_rows[row] = old_row
+        self.removed = [key[0] for key in old_keys]
+
+    @property
+    def has_changes(self):
+        return bool(self.schema_changed or self.added or self.removed or self.changed)
+
+    @property
+    def reused(self):
+        """Number of rows copied from the base snapshot"""
+        return sum(1 for old_row in self.old_rows if old_row is not None)
+
+    def written_rows(self):
+        """New rows that must be encoded and written: added, changed, or every row if the schema changed"""
+        return [row for row, old_row in enumerate(self.old_rows) if old_row is None]
+
+    def summary(self, kept=()):
+        """The diff for the upload report; kept lists clinicians whose availability edits were kept"""
+        counts = {group: 0 for group in GROUPS}
+        for groups in self.changed.values():
+            for group in groups:
+                counts[group] += 1
+        return {
+            'base_snapshot': self.snapshot,
+            'added': len(self.added),
+            'removed': len(self.removed),
+            'changed': len(self.changed),
+            'unchanged': len(self.old_rows) - len(self.added) - len(self.changed),
+            'changed_groups': {group: count for group, count in counts.items() if count},
+            'added_names': self.added[:MAX_NAMES],
+            'removed_names': self.removed[:MAX_NAMES],
+            'changed_names': list(self.changed)[:MAX_NAMES],
+            'added_columns': self.added_columns,
+            'removed_columns': self.removed_columns,
+            'schema_changed': self.schema_changed,
+            'availability_kept': list(kept)[:MAX_NAMES],
+        }
@@ -0,0 +1,227 @@
+"""
+Weighted scoring for the Psychology Clinic Triage Tool
+
+By default a search only admits clinicians with a 'Y' for the presentation,
+age group and funding source, and they all score 100. The scoring engine can
+also admit near matches, with a deduction for each:
+
+    conditional_presentation  'Conditional' for the presentation (allow_conditional)
+    conditional_funding       'Conditional' for the funding source (allow_conditional)
+    adjacent_age              'Y' only for a neighbouring age group (allow_adjacent_age)
+    waitlist_week             per week until available_from_date, up to waitlist_max_weeks
+    gender_mismatch           gender differs from the requested preference
+
+Each criterion is held per clinician as a NumPy array, built once per roster
+version, for one location's shard of the roster (see app.models.shards). A
+search gathers the relevant arrays into a clinicians x deductions matrix, and
+the score is 100 minus its dot product with the weights. No per-clinician
+Python runs until the result dicts for the shown page are built. Ranking is
+Available first, then by score, then in roster order.
+"""
+
+from datetime import date
+
+import numpy as np
+
+from app.models.roster import FLAG_CODES
+from app.models.search_index import CLOSED_STATUSES, NO_DATE, presentation_key
+
+DEFAULT_WEIGHTS = {
+    'allow_conditional': False,
+    'allow_adjacent_age': False,
+    'conditional_presentation': 10,
+    'conditional_funding': 10,
+    'adjacent_age': 20,
+    'waitlist_week': 0,
+    'waitlist_max_weeks': 12,
+    'gender_mismatch': 15,
+}
+
+# Age groups in order, so each has neighbours
+AGE_ORDER = ('age_0_6', 'age_6_12', 'age_12_18', 'age_18_plus', 'age_70_plus')
+
+# Deductions, in feature-matrix column order, with the bit recording each in a result's details
+DEDUCTIONS = ('conditional_presentation', 'conditional_funding', 'adjacent_age', 'waitlist_week', 'gender_mismatch')
+DETAIL_BITS = {name: 1 << i for i, name in enumerate(DEDUCTIONS)}
+
+CODE_Y = FLAG_CODES['Y']
+CODE_CONDITIONAL = FLAG_CODES['Conditional']
+
+# The score every clinician gets when nothing is deducted
+FULL_SCORE = 100
+
+
+def get_weights(overrides=None):
+    """Return the default weights updated with any configured overrides"""
+    weights = dict(DEFAULT_WEIGHTS)
+    weights.update(overrides or {})
+    return weights
+
+
+def is_strict(weights, gender_preference=None):
+    """Check whether a search would score every match 100 and admit only exact matches"""
+    return (not weights['allow_conditional'] and not weights['allow_adjacent_age']
+            and not weights['waitlist_week'] and not gender_preference)
+
+
+def explain(details, clinician):
+    """Turn a result's detail bits into sentences for the results page"""
+    reasons = []
+    if details & DETAIL_BITS['conditional_presentation']:
+        reasons.append("Conditional treatment for this presentation")
+    if details & DETAIL_BITS['conditional_funding']:
+        reasons.append("Conditional acceptance of this funding")
+    if details & DETAIL_BITS['adjacent_age']:
+        reasons.append("Treats a neighbouring age group rather than this one")
+    if details & DETAIL_BITS['waitlist_week']:
+        reasons.append(f"Not available until {clinician.get('available_from_date')}")
+    if details & DETAIL_BITS['gender_mismatch']:
+        reasons.append("Does not match the gender preference")
+    return reasons
+
+
+class ScoringTable:
+    """Per-clinician numeric arrays for one roster version, over all its rows or some of them"""
+
+    def __init__(self, roster, rows=None, base=None):
+        self.roster = roster
+        # Roster rows covered, in ascending order; element i of every array is rows[i]
+        self.rows = np.arange(len(roster)) if rows is None else rows
+        self.size = len(self.rows)
+        self._row_ids = self.rows.tolist()
+
+        if base is None:
+            self.codes = np.asarray(roster.flags)[self.rows]
+            self.column_ids = {column: j for j, column in enumerate(roster.flag_columns)}
+            self.genders = np.array([_normalise(value) for value in self._values(roster.column('gender'))],
+                                    dtype=object)
+            self._columns = {}
+            self._locations = {}
+        else:
+            # Only availability differs from the snapshot, so share everything else
+            self.codes = base.codes
+            self.column_ids = base.column_ids
+            self.genders = base.genders
+            self._columns = base._columns
+            self._locations = base._locations
+
+        self.open = np.array([status not in CLOSED_STATUSES
+                              for status in self._values(roster.column('availability_status'))], dtype=bool)
+        self.dates = roster.availability_index
+        self.available = self.dates.available[self.rows]
+        self.rank = self.dates.rank[self.rows]
+
+        # Day number of each available_from_date (NaN when there isn't one)
+        days = self.dates.days[self.rows]
+        self.available_from = np.where(days == NO_DATE, np.nan, days.astype(float))
+
+    # Helper function to pick this table's rows out of a whole column
+    def _values(self, column):
+        return [column[row] for row in self._row_ids]
+
+    def column(self, name):
+        """Flag codes of a column for every clinician (all zero if there's no such column)"""
+        j = self.column_ids.get(name)
+        if j is not None:
+            return self.codes[:, j]
+        codes = self._columns.get(name)
+        if codes is None:
+            # Columns that also hold free text still count their 'Y'/'Conditional' cells
+            codes = np.array([FLAG_CODES.get(value, 0) if isinstance(value, str) else 0
+                              for value in self._values(self.roster.column(name))],
+                             dtype=np.int8)
+            self._columns[name] = codes
+        return codes
+
+    def location(self, name):
+        """Boolean array of clinicians eligible for a location ("Flexible" matches all)"""
+        if name == "Flexible":
+            return np.ones(self.size, dtype=bool)
+        mask = self._locations.get(name)
+        if mask is None:
+            mask = np.array([value == name for value in self._values(self.roster.column('primary_location'))],
+                            dtype=bool)
+            self._locations[name] = mask
+        return mask
+
+    def score(self, age_group, presentation, funding_source, location, weights, gender_preference=None, today=None,
+              available_by=None, earliest=False):
+        """Return [(roster row, score, detail bits)] for every eligible clinician, best first
+
+        available_by (a day number) and earliest work as in AvailabilityIndex.refine().
+        """
+        return to_results(*self.score_arrays(age_group, presentation, funding_source, location, weights,
+                                             gender_preference, today, available_by, earliest))
+
+    def score_arrays(self, age_group, presentation, funding_source, location, weights, gender_preference=None,
+                     today=None, available_by=None, earliest=False):
+        """Like score(), but return the roster rows, scores and detail bits as arrays, best first"""
+        features = np.zeros((self.size, len(DEDUCTIONS)))
+
+        presentation_codes = self.column(presentation_key(presentation) + '_treats')
+        eligible = self.open & self.location(location)
+        presentation_y = presentation_codes == CODE_Y
+        if weights['allow_conditional']:
+            conditional = presentation_codes == CODE_CONDITIONAL
+            features[:, 0] = conditional
+            presentation_y = presentation_y | conditional
+        eligible &= presentation_y
+
+        age_y = self.column(age_group) == CODE_Y
+        if weights['allow_adjacent_age'] and age_group in AGE_ORDER:
+            position = AGE_ORDER.index(age_group)
+            adjacent = np.zeros(self.size, dtype=bool)
+            for neighbour in AGE_ORDER[max(position - 1, 0):position + 2]:
+                adjacent |= self.column(neighbour) == CODE_Y
+            features[:, 2] = adjacent & ~age_y
+            age_y = age_y | adjacent
+        eligible &= age_y
+        if available_by is not None:
+            eligible &= self.dates.within(available_by)[self.rows]
+
+        # Special case: if MHCP is selected, all clinicians are considered to accept it
+        if funding_source != 'mhcp':
+            funding_codes = self.column(funding_source)
+            funding_y = funding_codes == CODE_Y
+            if weights['allow_conditional']:
+                conditional = funding_codes == CODE_CONDITIONAL
+                features[:, 1] = conditional
+                funding_y = funding_y | conditional
+            eligible &= funding_y
+
+        if weights['waitlist_week']:
+            today = (today or date.today()).toordinal()
+            weeks = np.nan_to_num((self.available_from - today) / 7, nan=0.0)
+            features[:, 3] = np.where(self.available, 0, np.clip(weeks, 0, weights['waitlist_max_weeks']))
+
+        if gender_preference:
+            features[:, 4] = self.genders != _normalise(gender_preference)
+
+        rows = np.flatnonzero(eligible)
+        features = features[rows]
+        weight_vector = np.array([weights[name] for name in DEDUCTIONS], dtype=float)
+        scores = np.clip(FULL_SCORE - features @ weight_vector, 0, FULL_SCORE).round().astype(int)
+        details = (features > 0) @ np.array([DETAIL_BITS[name] for name in DEDUCTIONS])
+
+        order = rank_order(rows, scores, self.available[rows], self.rank[rows], earliest)
+        return self.rows[rows[order]], scores[order], details[order]
+
+
+def rank_order(rows, scores, available, rank, earliest=False):
+    """Return the order that ranks scored rows: Available first, then highest score, then roster order
+
+    With earliest, Available first, then by available from date (rank), then by score.
+    """
+    if earliest:
+        return np.lexsort((rows, -scores, np.where(available, -1, rank)))
+    return np.lexsort((rows, -scores, ~available))
+
+
+def to_results(rows, scores, details):
+    """Zip ranked arrays into [(row, score, detail bits)]"""
+    return list(zip(rows.tolist(), scores.tolist(), details.tolist()))
+
+
+# Helper function to compare gender values case-insensitively
+def _normalise(value):
+    return str(value).strip().lower() if value is not None else None
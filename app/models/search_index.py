@@ -0,0 +1,199 @@
+"""
+Inverted search index for the Psychology Clinic Triage Tool
+
+Each flag column (age groups, *_treats presentations, funding sources) maps to
+an integer bitmask with bit i set when clinician i has a 'Y' in that column.
+Locations map to a bitmask of the clinicians based there. A search is then a
+handful of AND operations instead of a Python loop over every clinician.
+An index can cover only some of the roster's rows (one location's shard, see
+app.models.shards), in which case bit i stands for the i-th of those rows.
+
+AvailabilityIndex holds each clinician's available from date as a day number,
+sorted, for the "available within" filter and earliest-available ordering.
+"""
+
+import copy
+
+import numpy as np
+
+from app.models.availability import ROLLOVER_STATUSES, parse_date
+from app.models.roster import FLAG_Y
+
+# Availability statuses that exclude a clinician from search results
+CLOSED_STATUSES = ('Unavailable', 'Closed')
+
+# Status ranked ahead of all others in search results
+AVAILABLE_STATUS = 'Available'
+
+# Day number given to clinicians without an available from date, so they sort last
+NO_DATE = np.iinfo(np.int64).max
+
+
+# Helper function to convert a presentation label to its column name prefix
+def presentation_key(presentation):
+    return presentation.lower().replace(' ', '_')
+
+
+# Helper function to pack a boolean array into an integer bitmask (bit i = row i)
+def to_mask(array):
+    return int.from_bytes(np.packbits(array, bitorder='little').tobytes(), 'little')
+
+
+# Helper function to build the closed and available bitmasks from a status column
+def status_masks(statuses):
+    closed = to_mask(np.array([status in CLOSED_STATUSES for status in statuses], dtype=bool))
+    available = to_mask(np.array([status == AVAILABLE_STATUS for status in statuses], dtype=bool))
+    return closed, available
+
+
+# Helper function to convert an available_from_date value to a day number
+def to_day(value):
+    parsed = parse_date(value)
+    return parsed.toordinal() if parsed is not None else NO_DATE
+
+
+# Helper function to list the row ids set in a bitmask, in ascending order
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class SearchIndex:
+    """Bitset index over a roster snapshot, or over some of its rows"""
+
+    def __init__(self, roster, rows=None):
+        # Roster rows covered, in ascending order; bit i stands for rows[i]
+        self.rows = np.arange(len(roster)) if rows is None else rows
+        self.size = len(self.rows)
+        self.all = (1 << self.size) - 1
+        self._row_ids = self.rows.tolist()
+
+        # column -> bitmask of clinicians with a 'Y' in that column
+        self.flags = {}
+        yes = np.asarray(roster.flags)[self.rows] == FLAG_Y
+        for j, column in enumerate(roster.flag_columns):
+            mask = to_mask(yes[:, j])
+            if mask:
+                self.flags[column] = mask
+        for column, y_rows in roster.y_rows.items():
+            mask = to_mask(np.isin(self.rows, y_rows))
+            if mask:
+                self.flags[column] = mask
+
+        # primary_location -> bitmask of clinicians at that location
+        self.locations = {}
+        locations = roster.column('primary_location')
+        for i, row in enumerate(self._row_ids):
+            location = locations[row]
+            self.locations[location] = self.locations.get(location, 0) | (1 << i)
+
+        # bitmasks of clinicians marked Unavailable or Closed, and of those Available
+        self.closed, self.available = status_masks(self._values(roster.column('availability_status')))
+
+    # Helper function to pick this index's rows out of a whole column
+    def _values(self, column):
+        return [column[row] for row in self._row_ids]
+
+    def with_statuses(self, statuses):
+        """Return a copy of this index with the status sets recomputed from a new status column"""
+        index = copy.copy(self)
+        index.closed, index.available = status_masks(self._values(statuses))
+        return index
+
+    def flag(self, column):
+        """Bitmask of clinicians with a 'Y' in the given column"""
+        return self.flags.get(column, 0)
+
+    def location(self, location):
+        """Bitmask of clinicians eligible for a location ("Flexible" matches all)"""
+        if location == "Flexible":
+            return self.all
+        return self.locations.get(location, 0)
+
+    def match(self, age_group, presentation_column, funding_source, location):
+        """Bitmask of clinicians meeting every strict search criterion"""
+        mask = self.all & ~self.closed
+        mask &= self.location(location)
+        mask &= self.flag(presentation_column)
+        mask &= self.flag(age_group)
+
+        # Special case: if MHCP is selected, all clinicians are considered to accept it
+        if funding_source != 'mhcp':
+            mask &= self.flag(funding_source)
+
+        return mask
+
+    def ranked(self, mask):
+        """Roster rows in a bitmask in result order: Available clinicians first, each group in roster order"""
+        row_ids = self._row_ids
+        return ([row_ids[i] for i in iter_bits(mask & self.available)]
+                + [row_ids[i] for i in iter_bits(mask & ~self.available)])
+
+
+class AvailabilityIndex:
+    """Sorted available from dates over a roster version"""
+
+    def __init__(self, statuses, days, primary_rows):
+        self.size = len(days)
+        self.days = days
+        self.available = np.array([status == AVAILABLE_STATUS for status in statuses], dtype=bool)
+
+        # Rows in date order (undated last), the sorted dates, and each row's position
+        self.order = np.argsort(days, kind='stable')
+        self.sorted_days = days[self.order]
+        self.rank = np.empty(self.size, dtype=np.int64)
+        self.rank[self.order] = np.arange(self.size)
+
+        # Earliest date on which a waitlisted clinician becomes available. Only the
+        # first row of a repeated name can have its availability edited
+        rollover = np.array([status in ROLLOVER_STATUSES for status in statuses], dtype=bool)
+        rollover &= np.isin(np.arange(self.size), primary_rows)
+        self.rollover = rollover
+        self.next_rollover = int(days[rollover].min()) if rollover.any() else NO_DATE
+
+        self._within = {}
+
+    @classmethod
+    def from_values(cls, statuses, dates, primary_rows):
+        """Build the index from availability_status and available_from_date columns"""
+        return cls(statuses, np.array([to_day(value) for value in dates], dtype=np.int64), primary_rows)
+
+    def with_changes(self, statuses, dates, rows, primary_rows):
+        """Return an index for new statuses, re-reading the dates of the given rows only"""
+        days = self.days.copy()
+        for row in rows:
+            days[row] = to_day(dates[row])
+        return AvailabilityIndex(statuses, days, primary_rows)
+
+    def rows_until(self, day):
+        """Row ids with an available from date on or before a day number, earliest first"""
+        return self.order[:np.searchsorted(self.sorted_days, day, side='right')]
+
+    def rollover_rows(self, day):
+        """Rows of waitlisted clinicians whose available from date is on or before a day number"""
+        rows = self.rows_until(day)
+        return rows[self.rollover[rows]].tolist()
+
+    def within(self, day):
+        """Boolean array of clinicians available now or by a day number"""
+        within = self._within.get(day)
+        if within is None:
+            within = self.available.copy()
+            within[self.rows_until(day)] = True
+            self._within[day] = within
+        return within
+
+    def refine(self, rows, available_by=None, earliest=False):
+        """Filter ranked rows to those available by a day number, and/or order them earliest available first
+
+        Available clinicians stay first, in their existing order.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if available_by is not None:
+            rows = rows[self.within(available_by)[rows]]
+        if earliest:
+            key = np.where(self.available[rows], -1, self.rank[rows])
+            rows = rows[np.argsort(key, kind='stable')]
+        return rows.tolist()
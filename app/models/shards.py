@@ -0,0 +1,136 @@
+"""
+Per-location shards of the clinician roster
+
+Apart from "Flexible", a search only matches clinicians at the requested
+primary_location. The roster is therefore split into one shard per location.
+Each shard has its own search index and scoring arrays, built over its rows
+only, and its own version: the snapshot id plus that location's availability
+counter (see app.models.availability). A search for one site uses only that
+site's shard. A Flexible search runs on every shard and merges the ranked
+results.
+
+When availability is edited, shards whose location counter hasn't changed
+are carried over to the new roster version as they are. Only the edited
+location's shard is rebuilt, and it reuses its flag bitsets. Search results
+cached under other locations' versions stay valid.
+"""
+
+import heapq
+from collections.abc import Mapping
+from functools import cached_property
+
+import numpy as np
+
+from app.models.scoring import ScoringTable, rank_order, to_results
+from app.models.search_index import SearchIndex
+
+
+class Shard:
+    """The clinicians at one primary_location, with their own search structures"""
+
+    def __init__(self, roster, location, rows, version, base=None):
+        self.roster = roster
+        self.location = location
+        # Roster rows at this location, in ascending order
+        self.rows = rows
+        self.size = len(rows)
+        self.version = version
+        # The same location's shard from an earlier version of this snapshot, if any
+        self._base = base
+
+    @cached_property
+    def index(self):
+        """Bitset index over this shard's rows"""
+        if self._base is not None and 'index' in self._base.__dict__:
+            # Only availability differs, so reuse the flag bitsets
+            return self._base.index.with_statuses(self.roster.column('availability_status'))
+        return SearchIndex(self.roster, self.rows)
+
+    @cached_property
+    def scoring(self):
+        """Numeric arrays for weighted scoring over this shard's rows"""
+        base = self._base.scoring if self._base is not None and 'scoring' in self._base.__dict__ else None
+        return ScoringTable(self.roster, self.rows, base)
+
+    def ranked(self, age_group, presentation_column, funding_source):
+        """Roster rows meeting every strict criterion: Available first, each group in roster order"""
+        index = self.index
+        return index.ranked(index.match(age_group, presentation_column, funding_source, self.location))
+
+
+class Shards(Mapping):
+    """A roster version's shards, by primary_location, in location order"""
+
+    def __init__(self, roster, previous=None):
+        self.roster = roster
+        self.version = roster.version
+        snapshot = roster.meta.get('snapshot')
+        # A snapshot with no availability applied has no location counters
+        versions = roster.location_versions
+
+        self._shards = {}
+        for location, rows in roster.location_rows.items():
+            version = (snapshot, versions.get(location or '', 0) if versions is not None else None)
+            old = previous.get(location) if previous is not None else None
+            if old is not None and old.version == version:
+                shard = old
+            elif old is not None and old.version[0] == snapshot:
+                # Derive from the shard the old one was derived from, so shards never form a chain
+                shard = Shard(roster, location, rows, version, base=old._base or old)
+            else:
+                shard = Shard(roster, location, rows, version)
+            self._shards[location] = shard
+
+    def __getitem__(self, location):
+        return self._shards[location]
+
+    def __iter__(self):
+        return iter(self._shards)
+
+    def __len__(self):
+        return len(self._shards)
+
+    def version_for(self, location):
+        """The version search results for a location depend on: its shard's, or the roster's for Flexible"""
+        shard = self._shards.get(location)
+        return shard.version if shard is not None else self.version
+
+    def ranked(self, age_group, presentation_column, funding_source, location):
+        """Roster rows meeting every strict criterion, Available first, each group in roster order"""
+        if location != "Flexible":
+            shard = self._shards.get(location)
+            return shard.ranked(age_group, presentation_column, funding_source) if shard is not None else []
+
+        available = self._available
+        return list(heapq.merge(*(shard.ranked(age_group, presentation_column, funding_source)
+                                  for shard in self._shards.values()),
+                                key=lambda row: (not available[row], row)))
+
+    def score(self, age_group, presentation, funding_source, location, weights, gender_preference=None,
+              today=None, available_by=None, earliest=False):
+        """Return [(row, score, detail bits)] for every eligible clinician, best first (see ScoringTable.score)"""
+        args = (age_group, presentation, funding_source, location, weights, gender_preference, today,
+                available_by, earliest)
+        if location != "Flexible":
+            shard = self._shards.get(location)
+            return shard.scoring.score(*args) if shard is not None else []
+
+        # Each shard's results are already ranked; sorting them together by the same key merges them
+        parts = [shard.scoring.score_arrays(*args) for shard in self._shards.values()]
+        if not parts:
+            return []
+        rows, scores, details = (np.concatenate(arrays) for arrays in zip(*parts))
+        dates = self.roster.availability_index
+        order = rank_order(rows, scores, dates.available[rows], dates.rank[rows], earliest)
+        return to_results(rows[order], scores[order], details[order])
+
+    # Availability of every row as a list, for merging shard results
+    @cached_property
+    def _available(self):
+        return self.roster.availability_index.available.tolist()
+
+    def warm(self):
+        """Build every shard's search structures"""
+        for shard in self._shards.values():
+            shard.index
+            shard.scoring
@@ -0,0 +1,92 @@
+"""
+User accounts for the Psychology Clinic Triage Tool
+
+Passwords are stored as werkzeug hashes. The hashing method and its cost are
+set with PASSWORD_HASH_METHOD; when it changes, each user's hash is upgraded
+the next time they log in, so no one has to reset their password.
+"""
+
+import functools
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.models.database import get_db
+
+# werkzeug's default, written out in full so a stored hash can be compared with it directly
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Accounts created the first time the database is opened, matching the
+# credentials documented in the README (admin123 and staff123). The hashes are
+# precomputed so no worker spends time hashing at startup.
+DEFAULT_USERS = (
+    ('admin', 'scrypt:32768:8:1$bsNfvzI479Nv4K1M$3e28fb3dac674638e2bcb116c70a826eb9729ca530d815ba2716454866a50b47'
+              '97f05cece30cfe62480b18e7b7f2b48e8a4a9551074af1337f8f768a0e081e02', 'super_admin', 'Super Admin'),
+    ('staff', 'scrypt:32768:8:1$tpOgp6GfgHgerfrr$e6a45ea50163e5568b6380ea3235ee94b20fdba39f48983e28fdf6d630015ba7'
+              'ddbdf84432b0580944e89a78a3c98a3909b6e3705c1e422a599b02addb81c007', 'triage_admin', 'Triage Staff'),
+)
+
+
+def get_hash_method():
+    """Return the configured password hashing method"""
+    return current_app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_HASH_METHOD
+
+
+def get_user(username, upload_folder=None):
+    """Return a user's row (username, password_hash, role, name) or None"""
+    db = get_db(upload_folder)
+    seed_default_users(db)
+    return db.execute('SELECT username, password_hash, role, name FROM users WHERE username = ?',
+                      (username,)).fetchone()
+
+
+def save_user(username, password, role, name, upload_folder=None, method=None):
+    """Create a user, or replace an existing user's password, role and name"""
+    password_hash = generate_password_hash(password, method or get_hash_method())
+    get_db(upload_folder).execute(
+        'INSERT INTO users (username, password_hash, role, name) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(username) DO UPDATE SET password_hash = excluded.password_hash, '
+        'role = excluded.role, name = excluded.name',
+        (username, password_hash, role, name))
+
+
+def check_password(user, password, upload_folder=None, method=None):
+    """Check a user's password, rehashing it with the configured method if it was hashed differently"""
+    if not check_password_hash(user['password_hash'], password):
+        return False
+
+    method = method or get_hash_method()
+    if needs_rehash(user['password_hash'], method):
+        # Only replace the hash we checked, in case the password changed meanwhile
+        get_db(upload_folder).execute('UPDATE users SET password_hash = ? WHERE username = ? AND password_hash = ?',
+                                      (generate_password_hash(password, method), user['username'],
+                                       user['password_hash']))
+    return True
+
+
+def needs_rehash(password_hash, method):
+    """Return True if password_hash wasn't made with method (e.g. after its cost was changed)"""
+    used = password_hash.split('$', 1)[0]
+    return used != method and used != _full_method(method)
+
+
+# Helper function to expand a method like 'pbkdf2' to the full form werkzeug records, e.g. 'pbkdf2:sha256:1000000'
+@functools.lru_cache(maxsize=8)
+def _full_method(method):
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def seed_default_users(db):
+    """Create the default accounts if there are no users yet"""
+    if db.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+        return
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Another worker may have seeded the table since we looked
+        if not db.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+            db.executemany('INSERT INTO users (username, password_hash, role, name) VALUES (?, ?, ?, ?)',
+                           DEFAULT_USERS)
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
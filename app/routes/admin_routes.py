@@ -2,13 +2,14 @@
 Admin routes for the Psychology Clinic Triage Tool
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
 from werkzeug.utils import secure_filename
 import os
-import pandas as pd
-import json
 from datetime import datetime
 from app.routes.auth_routes import super_admin_required, login_required
+from app.models import roster, availability
+from app.utils import audit, jobs, cache
+from app.utils.ingest import STREAMING_THRESHOLD
 
 # Create blueprint
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -17,62 +18,31 @@ bp = Blueprint('admin', __name__, url_prefix='/admin')
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'xlsx', 'xls'}
 
-# Helper function to process spreadsheet
-def process_spreadsheet(file_path):
-    """Process the uploaded spreadsheet and convert it to a JSON format for the database"""
-    try:
-        # Read the Excel file
-        df = pd.read_excel(file_path)
-        
-        # Convert to dictionary format
-        clinicians = []
-        
-        for _, row in df.iterrows():
-            clinician = {}
-            for column in df.columns:
-                # Handle NaN values
-                if pd.isna(row[column]):
-                    clinician[column] = None
-                else:
-                    clinician[column] = row[column]
-            
-            clinicians.append(clinician)
-        
-        # Save to a JSON file
-        json_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'clinicians.json')
-        with open(json_path, 'w') as f:
-            json.dump(clinicians, f, default=str)
-        
-        return True, f"Successfully processed {len(clinicians)} clinicians"
-    
-    except Exception as e:
-        return False, f"Error processing spreadsheet: {str(e)}"
-
 # Admin dashboard
 @bp.route('/')
 @super_admin_required
 def dashboard():
     # Check if clinicians data exists
-    json_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'clinicians.json')
-    clinicians_exist = os.path.exists(json_path)
+    clinicians_exist = roster.roster_exists()
     
     if clinicians_exist:
         try:
-            with open(json_path, 'r') as f:
-                clinicians = json.load(f)
-            last_updated = os.path.getmtime(json_path)
+            # Row count comes from the snapshot metadata, without loading the roster
+            clinician_count = roster.get_metadata().get('rows', 0)
+            last_updated = os.path.getmtime(roster.get_roster_path())
             last_updated = datetime.fromtimestamp(last_updated).strftime('%Y-%m-%d %H:%M:%S')
         except:
-            clinicians = []
+            clinician_count = 0
             last_updated = "Unknown"
     else:
-        clinicians = []
+        clinician_count = 0
         last_updated = "Never"
     
     return render_template('admin/dashboard.html', 
                            clinicians_exist=clinicians_exist,
-                           clinician_count=len(clinicians),
-                           last_updated=last_updated)
+                           clinician_count=clinician_count,
+                           last_updated=last_updated,
+                           job=jobs.latest_job())
 
 # Upload spreadsheet
 @bp.route('/upload', methods=['GET', 'POST'])
@@ -93,46 +63,56 @@ def upload_spreadsheet():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+            job_id, file_path = jobs.new_upload_path(filename)
             file.save(file_path)
             
-            # Process the spreadsheet
-            success, message = process_spreadsheet(file_path)
+            # Process the spreadsheet in the background so this worker stays free for triage traffic
+            jobs.submit_ingest(job_id, file_path, filename,
+                               streaming_threshold=current_app.config.get('INGEST_STREAMING_THRESHOLD',
+                                                                          STREAMING_THRESHOLD),
+                               keep_availability='keep_availability' in request.form)
             
-            if success:
-                flash(message, 'success')
-                return redirect(url_for('admin.dashboard'))
-            else:
-                flash(message, 'error')
-                return redirect(request.url)
+            flash(f"{filename} uploaded. The clinician database will update once it has been processed.", 'success')
+            return redirect(url_for('admin.dashboard'))
         else:
             flash('Invalid file type. Please upload an Excel file (.xlsx or .xls)', 'error')
             return redirect(request.url)
     
-    return render_template('admin/upload.html')
+    # Show the report from the most recent successful upload
+    last_job = jobs.latest_job(status='succeeded')
+    return render_template('admin/upload.html', report=last_job['report'] if last_job else None)
+
+# Upload job status, polled by the dashboard's progress display
+@bp.route('/jobs/<job_id>')
+@super_admin_required
+def job_status(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+# Search cache counters, as JSON
+@bp.route('/cache')
+@super_admin_required
+def cache_stats():
+    search_cache = cache.get_cache()
+    if search_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(search_cache.stats(), enabled=True))
 
 # Manage clinicians
 @bp.route('/clinicians')
 @super_admin_required
 def manage_clinicians():
     # Load clinicians data
-    json_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'clinicians.json')
-    
-    if os.path.exists(json_path):
+    if roster.roster_exists():
         try:
-            with open(json_path, 'r') as f:
-                clinicians = json.load(f)
-                
-            # Group clinicians by location
-            locations = {}
-            for clinician in clinicians:
-                location = clinician.get('primary_location', 'Unknown')
-                if location not in locations:
-                    locations[location] = []
-                locations[location].append(clinician)
+            current = roster.get_roster()
+            clinicians = current.clinicians
                 
-            # Sort locations alphabetically
-            sorted_locations = sorted(locations.items())
+            # Clinicians grouped by location, straight from the roster's shards (in location order)
+            sorted_locations = [(location, [clinicians[row] for row in shard.rows.tolist()])
+                                for location, shard in current.shards.items()]
                 
         except Exception as e:
             flash(f"Error loading clinicians: {str(e)}", 'error')
@@ -156,27 +136,18 @@ def update_clinician():
         available_from_date = request.form.get('available_from_date')
         availability_notes = request.form.get('availability_notes')
         
-        # Load clinicians data
-        json_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'clinicians.json')
-        
-        if os.path.exists(json_path):
+        if roster.roster_exists():
             try:
-                with open(json_path, 'r') as f:
-                    clinicians = json.load(f)
-                
-                # Update the clinician
-                for clinician in clinicians:
-                    if clinician['clinician_name'] == clinician_name:
-                        clinician['availability_status'] = availability_status
-                        clinician['available_from_date'] = available_from_date
-                        clinician['availability_notes'] = availability_notes
-                        break
-                
-                # Save the updated data
-                with open(json_path, 'w') as f:
-                    json.dump(clinicians, f, default=str)
+                current = roster.get_roster()
                 
-                flash(f"Successfully updated availability for {clinician_name}", 'success')
+                # Look the clinician up by name, then write just their availability
+                if clinician_name not in current.name_index:
+                    flash(f"Clinician {clinician_name} not found", 'error')
+                else:
+                    availability.update_availability(current.meta['snapshot'], clinician_name,
+                                                     availability_status, available_from_date, availability_notes,
+                                                     changed_by=session.get('user_id'))
+                    flash(f"Successfully updated availability for {clinician_name}", 'success')
             except Exception as e:
                 flash(f"Error updating clinician: {str(e)}", 'error')
         else:
@@ -184,3 +155,12 @@ def update_clinician():
         
         return redirect(url_for('admin.manage_clinicians'))
 
+# Search audit report, from the rollups of the audit log
+@bp.route('/audit')
+@super_admin_required
+def audit_report():
+    # Reporting period in days; 0 for everything logged
+    days = max(0, request.args.get('days', 30, type=int))
+    # Fold in the searches logged since the report was last viewed
+    audit.maintain()
+    return render_template('admin/audit.html', report=audit.report(days or None), days=days)
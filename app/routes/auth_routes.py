@@ -2,28 +2,16 @@
 Authentication routes for the Psychology Clinic Triage Tool
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 import functools
+import math
+from app.models import users
+from app.utils import metrics, ratelimit
 
 # Create blueprint
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
-# Mock user database - in a real application, this would be stored in a database
-users = {
-    'admin': {
-        'password': generate_password_hash('admin123'),
-        'role': 'super_admin',
-        'name': 'Super Admin'
-    },
-    'staff': {
-        'password': generate_password_hash('staff123'),
-        'role': 'triage_admin',
-        'name': 'Triage Staff'
-    }
-}
-
-# Login required decorator
+# Login required decorator; the role comes from the signed session cookie, so checks need no lookup
 def login_required(view):
     @functools.wraps(view)
     def wrapped_view(**kwargs):
@@ -44,6 +32,16 @@ def super_admin_required(view):
         return view(**kwargs)
     return wrapped_view
 
+# Helper function to get the login limiter and the keys an attempt counts against
+def get_login_limits(username):
+    config = current_app.config
+    limit = config.get('LOGIN_RATE_LIMIT', 10)
+    if not limit:
+        return None, ()
+    limiter = ratelimit.get_limiter('login', limit, config.get('LOGIN_RATE_WINDOW', 60))
+    # Never per username alone, or anyone could keep an account locked out
+    return limiter, (('address', request.remote_addr), ('user', request.remote_addr, username.lower()))
+
 # Login route
 @bp.route('/login', methods=('GET', 'POST'))
 def login():
@@ -52,24 +50,43 @@ def login():
         password = request.form['password']
         error = None
 
-        if username not in users:
+        # Turn away a burst of failed attempts before spending time on hashing
+        limiter, keys = get_login_limits(username)
+        retry_after = max((limiter.check(key) for key in keys), default=0)
+        if retry_after:
+            metrics.LOGINS.inc(outcome='throttled')
+            metrics.log('login throttled', address=request.remote_addr, username=username)
+            flash('Too many failed login attempts. Please try again shortly.', 'error')
+            return render_template('auth/login.html'), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+        user = users.get_user(username)
+
+        if user is None:
             error = 'Invalid username.'
-        elif not check_password_hash(users[username]['password'], password):
+        elif not users.check_password(user, password):
             error = 'Invalid password.'
 
         if error is None:
+            metrics.LOGINS.inc(outcome='success')
+            if limiter:
+                # Mistyped passwords before this don't count against the user any more
+                limiter.reset(keys[1])
+
             # Store user info in session
             session.clear()
             session['user_id'] = username
-            session['user_role'] = users[username]['role']
-            session['user_name'] = users[username]['name']
+            session['user_role'] = user['role']
+            session['user_name'] = user['name']
             
             # Redirect based on role
-            if users[username]['role'] == 'super_admin':
+            if user['role'] == 'super_admin':
                 return redirect(url_for('admin.dashboard'))
             else:
                 return redirect(url_for('triage.index'))
 
+        metrics.LOGINS.inc(outcome='failed')
+        for key in keys:
+            limiter.hit(key)
         flash(error, 'error')
 
     return render_template('auth/login.html')
@@ -2,238 +2,391 @@
 Triage routes for the Psychology Clinic Triage Tool
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
-import os
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify, Response, stream_with_context, make_response
+import csv
+from datetime import date, timedelta
+import hashlib
 import json
+import logging
 from app.routes.auth_routes import login_required
-import pandas as pd
+from app.models import roster, clinicians, scoring
+from app.models.search_index import presentation_key
+from app.models.form_metadata import AGE_GROUPS, FUNDING_SOURCES, DEFAULT_LOCATIONS, get_template_hash
+from app.models.allocation import SOLVERS, allocate
+from app.models.batch import match_referrals, parse_referrals
+from app.utils import audit, cache, metrics
 
 # Create blueprint
 bp = Blueprint('triage', __name__, url_prefix='/triage')
 
+# Presentation autocomplete: default and largest number of suggestions, and
+# how many seconds the browser may reuse a response
+AUTOCOMPLETE_LIMIT = 20
+AUTOCOMPLETE_MAX_LIMIT = 100
+AUTOCOMPLETE_MAX_AGE = 60
+
+# Largest page of search results that can be requested
+MAX_PAGE_SIZE = 200
+
+# Search fields that must be filled in
+REQUIRED_FIELDS = ('age_group', 'presentation', 'funding_source', 'location')
+
+# Scoring options that can be switched on per search, on top of the SCORING config
+SCORING_OPTIONS = ('allow_conditional', 'allow_adjacent_age')
+
+# Helper function to get the search form's options and labels, built once per roster snapshot
+def get_form_metadata():
+    return roster.get_roster().form_metadata
+
 # Helper function to get all unique presentations from the clinicians data
 def get_all_presentations():
-    json_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'clinicians.json')
-    
-    if not os.path.exists(json_path):
-        return []
-    
     try:
-        with open(json_path, 'r') as f:
-            clinicians = json.load(f)
-        
-        # Extract all presentation columns
-        presentation_columns = [col for col in clinicians[0].keys() if col.endswith('_treats')]
-        
-        # Remove the '_treats' suffix and replace underscores with spaces
-        presentations = [col.replace('_treats', '').replace('_', ' ').title() for col in presentation_columns]
-        
-        return sorted(presentations)
+        return get_form_metadata().presentations
     except:
         return []
 
 # Helper function to get all age groups
 def get_age_groups():
-    return [
-        {"id": "age_0_6", "label": "0-6 years"},
-        {"id": "age_6_12", "label": "6-12 years"},
-        {"id": "age_12_18", "label": "12-18 years"},
-        {"id": "age_18_plus", "label": "18+ years"},
-        {"id": "age_70_plus", "label": "70+ years"}
-    ]
+    return list(AGE_GROUPS)
 
 # Helper function to get all funding sources
 def get_funding_sources():
-    return [
-        {"id": "mhcp", "label": "MHCP"},
-        {"id": "ndis", "label": "NDIS"},
-        {"id": "dva", "label": "DVA"},
-        {"id": "wc", "label": "Workers Compensation"},
-        {"id": "qps", "label": "QPS"},
-        {"id": "eap", "label": "EAP"},
-        {"id": "private", "label": "Private"}
-    ]
+    return list(FUNDING_SOURCES)
 
 # Helper function to get all locations
 def get_locations():
-    locations = ["Maroochydore", "Sippy Downs", "Flexible"]
-    
-    json_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'clinicians.json')
-    
-    if not os.path.exists(json_path):
-        return locations
-    
     try:
-        with open(json_path, 'r') as f:
-            clinicians = json.load(f)
-        
-        # Extract all unique locations
-        db_locations = set()
-        for clinician in clinicians:
-            if clinician.get('primary_location'):
-                db_locations.add(clinician['primary_location'])
-        
-        # Make sure Maroochydore, Sippy Downs, and Flexible are always included
-        for loc in locations:
-            if loc in db_locations:
-                db_locations.remove(loc)
-        
-        # Combine the standard locations with any additional ones from the database
-        all_locations = locations + sorted(list(db_locations))
-        
-        return all_locations
+        # Maroochydore, Sippy Downs and Flexible are always included, then any other roster locations
+        return get_form_metadata().locations
     except:
-        return locations
+        return list(DEFAULT_LOCATIONS)
 
-# Helper function to search for matching clinicians
-def search_clinicians(age_group, presentation, funding_source, location):
-    json_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'clinicians.json')
-    
-    if not os.path.exists(json_path):
+# Helper function to get the genders clinicians can be searched by
+def get_genders():
+    try:
+        return get_form_metadata().genders
+    except:
         return []
+
+# Helper function to build the result entry for a matching clinician
+def build_match(clinician, presentation, funding_source, match_score=scoring.FULL_SCORE, details=0):
+    # The score and its deductions come from the ranking, see app.models.scoring
+    match_details = scoring.explain(details, clinician)
+
+    # Get service type for the presentation
+    service_type_column = presentation_key(presentation) + '_service_type'
+    service_type = clinician.get(service_type_column, 'Unknown')
+
+    # Get notes for the presentation
+    notes_column = presentation_key(presentation) + '_notes'
+    notes = clinician.get(notes_column)
+
+    return {
+        'name': clinician.get('clinician_name', 'Unknown'),
+        'profession': clinician.get('profession', 'Unknown'),
+        'gender': clinician.get('gender', 'Unknown'),
+        'location': clinician.get('primary_location', 'Unknown'),
+        'service_type': service_type,
+        'notes': notes,
+        'match_score': match_score,
+        'match_percentage': match_score,
+        'match_details': match_details,
+        'availability_status': clinician.get('availability_status', 'Unknown'),
+        'available_from_date': clinician.get('available_from_date'),
+        'availability_notes': clinician.get('availability_notes')
+    }
+
+# Helper function to search for matching clinicians, returning result dicts
+def search_clinicians(age_group, presentation, funding_source, location, offset=0, limit=None,
+                      gender_preference=None, options=None, available_within=None, earliest=False):
+    return search_page(age_group, presentation, funding_source, location, offset, limit,
+                       gender_preference, options, available_within, earliest)[1]
+
+# Helper function to run a search, returning (total matches, result dicts for one page)
+def search_page(age_group, presentation, funding_source, location, offset=0, limit=None,
+                gender_preference=None, options=None, available_within=None, earliest=False):
+    current = roster.get_roster()
+    weights = scoring.get_weights(current_app.config.get('SCORING'))
+    weights.update(options or {})
     
-    try:
-        with open(json_path, 'r') as f:
-            clinicians = json.load(f)
-        
-        # Convert presentation to column name format
-        presentation_column = presentation.lower().replace(' ', '_') + '_treats'
-        
-        # Filter clinicians based on criteria
-        matches = []
-        
-        for clinician in clinicians:
-            # Skip if clinician is closed (marked as Unavailable or Closed)
-            if clinician.get('availability_status') == 'Unavailable' or clinician.get('availability_status') == 'Closed':
-                continue
-            
-            # STRICT LOCATION MATCHING: If a specific location is selected, only show clinicians from that location
-            if location != "Flexible" and clinician.get('primary_location') != location:
-                continue
-            
-            # STRICT PRESENTATION MATCHING: Only include clinicians who definitely treat this presentation
-            if clinician.get(presentation_column) != 'Y':
-                continue
-            
-            # Check age group match - must be exact
-            if clinician.get(age_group) != 'Y':
-                continue
-            
-            # Check funding source match
-            # Special case: if MHCP is selected, all clinicians are considered to accept it
-            if funding_source != 'mhcp' and clinician.get(funding_source) != 'Y':
-                continue
-            
-            # Calculate match score - now all included clinicians meet the basic requirements
-            match_score = 100  # Start with 100% match
-            match_details = []
-            
-            # Reduce score for conditional matches (though we're now filtering these out)
-            if clinician.get(presentation_column) == 'Conditional':
-                match_score -= 10
-                match_details.append("Conditional treatment for this presentation")
-            
-            if funding_source != 'mhcp' and clinician.get(funding_source) == 'Conditional':
-                match_score -= 10
-                match_details.append("Conditional acceptance of this funding")
-            
-            # Get service type for the presentation
-            service_type_column = presentation.lower().replace(' ', '_') + '_service_type'
-            service_type = clinician.get(service_type_column, 'Unknown')
-            
-            # Get notes for the presentation
-            notes_column = presentation.lower().replace(' ', '_') + '_notes'
-            notes = clinician.get(notes_column)
-            
-            matches.append({
-                'name': clinician.get('clinician_name', 'Unknown'),
-                'profession': clinician.get('profession', 'Unknown'),
-                'gender': clinician.get('gender', 'Unknown'),
-                'location': clinician.get('primary_location', 'Unknown'),
-                'service_type': service_type,
-                'notes': notes,
-                'match_score': match_score,
-                'match_percentage': match_score,
-                'match_details': match_details,
-                'availability_status': clinician.get('availability_status', 'Unknown'),
-                'available_from_date': clinician.get('available_from_date'),
-                'availability_notes': clinician.get('availability_notes')
-            })
-        
-        # Sort by match score (descending) and availability
-        matches.sort(key=lambda x: (
-            0 if x['availability_status'] == 'Available' else 1,  # Available first
-            -x['match_score']  # Higher score first
-        ))
+    # "Available within N weeks" keeps Available clinicians and those available by that day
+    available_by = None
+    if available_within is not None:
+        available_by = (date.today() + timedelta(weeks=available_within)).toordinal()
+    
+    # Repeat searches against the same roster version come from the cache, which
+    # holds only the ranked [row, score, details] entries. A search for one site
+    # depends only on that site's shard, so edits at other sites keep it cached
+    version = current.shards.version_for(location)
+    if scoring.is_strict(weights, gender_preference):
+        key = ('rows', age_group, presentation, funding_source, location)
+        rows = cache.cached(key, version,
+                            lambda: rank_rows(current, age_group, presentation, funding_source, location))
+        if available_by is not None or earliest:
+            rows = current.availability_index.refine(rows, available_by, earliest)
+        ranked = [(i, scoring.FULL_SCORE, 0) for i in rows]
+    else:
+        key = ('scored', age_group, presentation, funding_source, location, gender_preference,
+               tuple(sorted(weights.items())), available_by, earliest)
+        ranked = cache.cached(key, version,
+                              lambda: current.shards.score(age_group, presentation, funding_source, location,
+                                                           weights, gender_preference, available_by=available_by,
+                                                           earliest=earliest))
+    metrics.SEARCH_MATCHES.observe(len(ranked))
+    
+    # Result dicts are only built for the page being shown
+    end = None if limit is None else offset + limit
+    return len(ranked), [build_match(current.row(i), presentation, funding_source, score, details)
+                         for i, score, details in ranked[offset:end]]
+
+# Helper function to find the matching roster rows, best first
+def rank_rows(current, age_group, presentation, funding_source, location):
+    # Convert presentation to column name format
+    presentation_column = presentation_key(presentation) + '_treats'
+    
+    # Strict location, presentation, age group and funding matching, skipping
+    # Unavailable/Closed clinicians, either as one indexed query against the
+    # database or as bitset intersections over the location's shard (every
+    # shard for "Flexible"). Both return Available clinicians first, in roster
+    # order, so no sort is needed
+    if current_app.config.get('SEARCH_BACKEND') == 'sqlite':
+        return clinicians.search_rows(current.meta['snapshot'], age_group, presentation_column,
+                                      funding_source, location)
+    return current.shards.ranked(age_group, presentation_column, funding_source, location)
+
+# Helper function to read the search criteria and page from a form or query string
+def get_search_args():
+    criteria = {name: request.values.get(name) for name in REQUIRED_FIELDS}
+    page = max(1, request.values.get('page', 1, type=int))
+    per_page = max(1, min(request.values.get('limit', current_app.config.get('SEARCH_PAGE_SIZE', 20), type=int),
+                          MAX_PAGE_SIZE))
+    return criteria, page, per_page
+
+# Helper function to read the optional ranking preferences: gender, availability and any scoring options switched on
+def get_scoring_args():
+    available_within = request.values.get('available_within', type=int)
+    preferences = {
+        'gender_preference': request.values.get('gender_preference') or None,
+        'available_within': max(0, available_within) if available_within is not None else None,
+        'earliest': request.values.get('sort') == 'earliest',
+    }
+    options = {name: True for name in SCORING_OPTIONS if request.values.get(name) in ('1', 'on', 'true')}
+    return preferences, options
+
+# Helper function to match a batch of referrals, yielding one result dict per referral
+def batch_results(current, referrals, limit=None):
+    for referral, ids, error in match_referrals(current.matrix, referrals):
+        if error:
+            yield {'referral': referral, 'error': error}
+            continue
         
-        return matches
-    except Exception as e:
-        print(f"Error searching clinicians: {str(e)}")
-        return []
+        yield {
+            'referral': referral,
+            'match_count': len(ids),
+            'matches': [build_match(current.row(i), referral['presentation'], referral['funding_source'])
+                        for i in ids[:limit]]
+        }
 
 # Triage index page
 @bp.route('/')
 @login_required
 def index():
-    age_groups = get_age_groups()
-    presentations = get_all_presentations()
-    funding_sources = get_funding_sources()
-    locations = get_locations()
+    form = get_form_metadata()
+    render = lambda: render_template('triage/index.html', options=form.options)
+    
+    # A pending flash message is shown once, so that page can't be reused
+    if session.get('_flashes'):
+        return render()
     
-    return render_template('triage/index.html',
-                          age_groups=age_groups,
-                          presentations=presentations,
-                          funding_sources=funding_sources,
-                          locations=locations)
+    # The page only changes with the roster snapshot, the templates and the
+    # menu for the user's role, so it is rendered once per combination and
+    # the browser revalidates it with If-None-Match/If-Modified-Since
+    role = session.get('user_role')
+    response = make_response(form.page(role, render))
+    response.set_etag(form.etag(get_template_hash(current_app), role))
+    response.last_modified = form.last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 # Search for matching clinicians
-@bp.route('/search', methods=['POST'])
+@bp.route('/search', methods=['GET', 'POST'])
 @login_required
 def search():
-    age_group = request.form.get('age_group')
-    presentation = request.form.get('presentation')
-    funding_source = request.form.get('funding_source')
-    location = request.form.get('location')
+    criteria, page, per_page = get_search_args()
+    preferences, options = get_scoring_args()
     
     # Validate inputs
-    if not all([age_group, presentation, funding_source, location]):
+    if not all(criteria.values()):
         flash('Please fill in all fields', 'error')
         return redirect(url_for('triage.index'))
     
-    # Search for matching clinicians
-    matches = search_clinicians(age_group, presentation, funding_source, location)
+    # Search for matching clinicians, building results for this page only
+    try:
+        total, matches = search_page(offset=(page - 1) * per_page, limit=per_page, options=options,
+                                     **criteria, **preferences)
+        if total and not matches:
+            # Past the last page (e.g. the roster changed); show the last one instead
+            page = -(-total // per_page)
+            total, matches = search_page(offset=(page - 1) * per_page, limit=per_page, options=options,
+                                         **criteria, **preferences)
+    except Exception as e:
+        # Report the failure rather than showing it as "no matches"
+        metrics.SEARCH_ERRORS.inc()
+        metrics.log('search failed', level=logging.ERROR, exc_info=True, **criteria)
+        flash(f"Error searching clinicians: {str(e)}", 'error')
+        return redirect(url_for('triage.index'))
     
-    # Store search parameters in session for reference
-    session['last_search'] = {
-        'age_group': age_group,
-        'presentation': presentation,
-        'funding_source': funding_source,
-        'location': location
-    }
+    # Store search parameters in session for reference, and in the audit log
+    session['last_search'] = criteria
+    audit.record_search('search', criteria, total, matches, page=page, options=sorted(options), **preferences)
     
-    # Get the labels for display
-    age_groups = get_age_groups()
-    age_group_label = next((g['label'] for g in age_groups if g['id'] == age_group), age_group)
+    # Everything the page links need to repeat this search
+    search_args = dict(criteria, **{name: 1 for name in options})
+    if preferences['gender_preference']:
+        search_args['gender_preference'] = preferences['gender_preference']
+    if preferences['available_within'] is not None:
+        search_args['available_within'] = preferences['available_within']
+    if preferences['earliest']:
+        search_args['sort'] = 'earliest'
     
-    funding_sources = get_funding_sources()
-    funding_source_label = next((f['label'] for f in funding_sources if f['id'] == funding_source), funding_source)
+    # Get the labels for display
+    form = get_form_metadata()
+    age_group_label = form.age_group_labels.get(criteria['age_group'], criteria['age_group'])
+    funding_source_label = form.funding_source_labels.get(criteria['funding_source'], criteria['funding_source'])
     
     return render_template('triage/results.html',
                           matches=matches,
+                          total=total,
+                          page=page,
+                          per_page=per_page,
+                          pages=max(1, -(-total // per_page)),
+                          first=(page - 1) * per_page + 1,
+                          criteria=search_args,
+                          gender_preference=preferences['gender_preference'],
                           age_group=age_group_label,
-                          presentation=presentation,
+                          presentation=criteria['presentation'],
                           funding_source=funding_source_label,
-                          location=location)
+                          location=criteria['location'])
+
+# JSON version of the search, for scripts and integrations
+@bp.route('/api/search', methods=['GET', 'POST'])
+@login_required
+def api_search():
+    criteria, page, per_page = get_search_args()
+    preferences, options = get_scoring_args()
+    missing = [name for name, value in criteria.items() if not value]
+    if missing:
+        return jsonify({'error': f"Missing fields: {', '.join(missing)}"}), 400
+    
+    try:
+        total, matches = search_page(offset=(page - 1) * per_page, limit=per_page, options=options,
+                                     **criteria, **preferences)
+    except Exception as e:
+        metrics.SEARCH_ERRORS.inc()
+        metrics.log('search failed', level=logging.ERROR, exc_info=True, **criteria)
+        return jsonify({'error': f"Error searching clinicians: {str(e)}"}), 500
+    
+    audit.record_search('api', criteria, total, matches, page=page, options=sorted(options), **preferences)
+    return jsonify({
+        'criteria': dict(criteria, **preferences, **options),
+        'total': total,
+        'page': page,
+        'limit': per_page,
+        'matches': matches
+    })
 
 # API endpoint for presentation autocomplete
 @bp.route('/api/presentations')
 @login_required
 def api_presentations():
-    query = request.args.get('q', '').lower()
-    presentations = get_all_presentations()
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), AUTOCOMPLETE_MAX_LIMIT))
+    current = roster.get_roster()
     
-    # Filter presentations based on query
-    filtered = [p for p in presentations if query in p.lower()]
+    # Results only change with the roster snapshot, so the browser can reuse them
+    # and revalidate with If-None-Match without the search being run again
+    snapshot = (current.meta or {}).get('snapshot')
+    etag = hashlib.md5(json.dumps([snapshot, query, limit]).encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(current.autocomplete.search(query, limit))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = AUTOCOMPLETE_MAX_AGE
+    return response
+
+
+# Helper function to read a batch of referrals from an uploaded CSV/JSON file or a CSV/JSON request body
+def get_batch_text():
+    upload = request.files.get('file')
+    if upload:
+        text = upload.read().decode('utf-8-sig')
+        return text, 'json' if upload.filename.lower().endswith('.json') else 'csv'
+    text = request.get_data(as_text=True)
+    return text, 'json' if request.is_json else ('csv' if request.mimetype == 'text/csv' else None)
+
+# API endpoint for batch triage of many referrals in one call
+@bp.route('/api/batch', methods=['POST'])
+@login_required
+def api_batch():
+    text, fmt = get_batch_text()
+    try:
+        referrals = parse_referrals(text, fmt)
+    except (ValueError, TypeError, csv.Error) as e:
+        return jsonify({'error': f"Could not parse referrals: {str(e)}"}), 400
     
-    return jsonify(filtered)
+    limit = request.args.get('limit', type=int)
+    current = roster.get_roster()
+    
+    # Stream one JSON line per referral so large batches don't buffer in memory
+    def generate():
+        for result in batch_results(current, referrals, limit):
+            if 'error' not in result:
+                audit.record_search('batch', result['referral'], result['match_count'], result['matches'])
+            yield json.dumps(result, default=str) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
+# API endpoint to allocate a batch of referrals across clinicians, within each clinician's capacity
+@bp.route('/api/allocate', methods=['POST'])
+@login_required
+def api_allocate():
+    text, fmt = get_batch_text()
+    try:
+        referrals = parse_referrals(text, fmt)
+        # A JSON object may also carry {"capacity": {clinician_name: referrals}} overrides
+        data = json.loads(text) if fmt != 'csv' and text.lstrip()[:1] == '{' else None
+        capacities = data.get('capacity') if isinstance(data, dict) else None
+        if capacities is not None and not isinstance(capacities, dict):
+            raise ValueError("capacity must map clinician names to numbers")
+    except (ValueError, TypeError, csv.Error) as e:
+        return jsonify({'error': f"Could not parse referrals: {str(e)}"}), 400
+    
+    solver = request.args.get('solver', 'flow')
+    if solver not in SOLVERS:
+        return jsonify({'error': f"Unknown solver: {solver} (use {' or '.join(SOLVERS)})"}), 400
+    default_capacity = request.args.get('default_capacity', current_app.config.get('ALLOCATION_DEFAULT_CAPACITY'),
+                                        type=int)
+    _, options = get_scoring_args()
+    weights = scoring.get_weights(current_app.config.get('SCORING'))
+    weights.update(options)
+    
+    current = roster.get_roster()
+    results, summary = allocate(current, referrals, weights, max(0, default_capacity), capacities, solver)
+    
+    allocations = []
+    for result in results:
+        referral = result['referral']
+        if result['error']:
+            allocations.append({'referral': referral, 'error': result['error']})
+            continue
+        clinician = None
+        if result['row'] is not None:
+            clinician = build_match(current.row(result['row']), referral['presentation'],
+                                    referral['funding_source'], result['score'], result['details'])
+        audit.record_search('allocate', referral, result['match_count'], [clinician] if clinician else ())
+        allocations.append({'referral': referral, 'match_count': result['match_count'], 'clinician': clinician})
+    
+    return jsonify({'summary': summary, 'allocations': allocations})
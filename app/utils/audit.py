@@ -0,0 +1,369 @@
+"""
+Search audit log for the Psychology Clinic Triage Tool
+
+Every triage search is appended to a log of JSON lines under uploads/audit/,
+recording who searched, the criteria, how many clinicians matched and the
+matches shown. A request only puts its record on a queue. A background
+thread in each worker writes the queue out in batches, so logging adds no
+latency to the search. Each worker writes its own segment files, so lines
+from different processes never interleave. A worker starts a new segment once
+the current one has been open for AUDIT_SEGMENT_SECONDS or has grown past
+AUDIT_SEGMENT_BYTES, and never writes to the old one again.
+
+The admin report reads rollups from the database: searches and zero-match
+searches per day for each combination of criteria. update_rollups() only
+reads the lines appended since it last ran, because it records how far it
+has read each segment. When a day is over, its segments are compacted into
+one gzipped archive for that day. Archives are kept for AUDIT_RETENTION_DAYS,
+and the rollups keep the counts after an archive is deleted.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app, session
+
+from app.models.database import get_db
+from app.utils import metrics
+from app.utils.locking import file_lock
+
+AUDIT_DIRNAME = 'audit'
+SEGMENT_PREFIX = 'searches-'
+SEGMENT_SUFFIX = '.jsonl'
+ARCHIVE_PREFIX = 'archive-'
+ARCHIVE_SUFFIX = '.jsonl.gz'
+
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DEFAULT_SEGMENT_SECONDS = 60 * 60
+DEFAULT_RETENTION_DAYS = 365
+
+# Seconds the writer gathers records for before writing them out together
+FLUSH_INTERVAL = 1.0
+# Records written in one batch at most
+MAX_BATCH = 1000
+# Records waiting for the writer; beyond this (e.g. if the disk stalls) new ones are dropped
+QUEUE_SIZE = 10000
+# A segment can still be written this long after its writer's last check of its age
+CLOSE_GRACE = 60
+
+# Matched clinicians recorded per search at most
+MAX_MATCHES = 50
+
+# Criteria the rollups count searches by
+ROLLUP_FIELDS = ('age_group', 'presentation', 'funding_source', 'location')
+# Rows in the report's hotspot table
+HOTSPOT_LIMIT = 20
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+# Helper function to get the folder holding the audit log
+def get_audit_folder(upload_folder=None):
+    if upload_folder is None:
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+    folder = os.path.join(upload_folder, AUDIT_DIRNAME)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+class AuditWriter:
+    """Writes queued search records to this process's segment files on a background thread"""
+
+    def __init__(self, upload_folder, segment_bytes=DEFAULT_SEGMENT_BYTES, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                 retention_days=DEFAULT_RETENTION_DAYS):
+        self.upload_folder = upload_folder
+        self.folder = get_audit_folder(upload_folder)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention_days = retention_days
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self._file = None
+        self._opened = 0
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        """Queue a record without waiting; it is dropped if the writer has fallen too far behind"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.AUDIT_DROPPED.inc()
+
+    def close(self, timeout=5):
+        """Write out every queued record and close the segment"""
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while batch[-1] is not None and len(batch) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is None
+            records = batch[:-1] if stopping else batch
+            try:
+                if records:
+                    self._write(records)
+            except Exception:
+                metrics.log('audit write failed', level=logging.ERROR, exc_info=True, records=len(records))
+            if stopping:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    # Helper function to append a batch of records as one write, starting a new segment first if due
+    def _write(self, records):
+        data = ''.join(json.dumps(record, default=str) + '\n' for record in records).encode()
+        rotated = False
+        if self._file is not None and (time.time() - self._opened >= self.segment_seconds
+                                       or self._file.tell() + len(data) > self.segment_bytes):
+            self._file.close()
+            self._file = None
+            rotated = True
+        if self._file is None:
+            self._opened = time.time()
+            name = (f"{SEGMENT_PREFIX}{datetime.fromtimestamp(self._opened).strftime('%Y%m%dT%H%M%S%f')}"
+                    f"-{os.getpid()}{SEGMENT_SUFFIX}")
+            self._file = open(os.path.join(self.folder, name), 'ab')
+
+        self._file.write(data)
+        self._file.flush()
+
+        # The old segment is finished, so this is a good time to fold it in and compact
+        if rotated:
+            try:
+                maintain(self.upload_folder, self.segment_seconds, self.retention_days)
+            except Exception:
+                metrics.log('audit compaction failed', level=logging.ERROR, exc_info=True)
+
+
+def get_writer():
+    """Return this process's audit writer for the app's upload folder, or None if the audit log is off"""
+    config = current_app.config
+    if not config.get('AUDIT_LOG', True):
+        return None
+
+    key = (config['UPLOAD_FOLDER'], config.get('AUDIT_SEGMENT_BYTES', DEFAULT_SEGMENT_BYTES),
+           config.get('AUDIT_SEGMENT_SECONDS', DEFAULT_SEGMENT_SECONDS),
+           config.get('AUDIT_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = _writers[key] = AuditWriter(*key)
+    return writer
+
+
+def record_search(endpoint, criteria, total, matches=(), **fields):
+    """Queue one search for the audit log and return straight away
+
+    criteria holds the four search fields, matches the result dicts shown, and
+    fields anything else worth keeping (page, preferences, scoring options).
+    """
+    writer = get_writer()
+    if writer is None:
+        return
+    record = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'user': session.get('user_id'),
+        'endpoint': endpoint,
+    }
+    record.update(criteria)
+    record.update(fields)
+    record['total'] = total
+    record['matches'] = [match['name'] for match in matches[:MAX_MATCHES]]
+    writer.put(record)
+
+
+def close_writers():
+    """Write out every queued record (run at exit)"""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_writers)
+
+
+# A forked child has none of its parent's threads, so it starts its own writer
+def _reset_after_fork():
+    global _writers_lock
+    _writers.clear()
+    _writers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Helper function to list segment file names, oldest first
+def _segments(folder):
+    return sorted(name for name in os.listdir(folder)
+                  if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+
+# Helper function to get when a segment was opened, from its name
+def _segment_opened(name):
+    return datetime.strptime(name[len(SEGMENT_PREFIX):].split('-', 1)[0], '%Y%m%dT%H%M%S%f')
+
+
+def update_rollups(upload_folder=None):
+    """Fold the lines appended to each segment since the last update into the rollups; returns lines read"""
+    folder = get_audit_folder(upload_folder)
+    db = get_db(upload_folder)
+    counts = {}
+    lines = 0
+
+    # One write transaction, so two processes never count the same lines
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        read = {row['name']: row['bytes_read'] for row in db.execute('SELECT name, bytes_read FROM audit_segments')}
+        names = _segments(folder)
+        for name in names:
+            start = read.get(name, 0)
+            try:
+                with open(os.path.join(folder, name), 'rb') as f:
+                    f.seek(start)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            # A writer may be part-way through a line; leave it for the next update
+            end = data.rfind(b'\n') + 1
+            if not end:
+                continue
+            for line in data[:end].splitlines():
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                # Paging through results repeats a search rather than making a new one
+                if record.get('page', 1) != 1:
+                    continue
+                key = (record['time'][:10],) + tuple(str(record.get(field) or '') for field in ROLLUP_FIELDS)
+                entry = counts.setdefault(key, [0, 0])
+                entry[0] += 1
+                entry[1] += not record.get('total')
+            db.execute('INSERT INTO audit_segments (name, bytes_read) VALUES (?, ?) '
+                       'ON CONFLICT(name) DO UPDATE SET bytes_read = excluded.bytes_read', (name, start + end))
+
+        db.executemany('INSERT INTO audit_rollups (day, age_group, presentation, funding_source, location, '
+                       'searches, zero_matches) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                       'ON CONFLICT(day, age_group, presentation, funding_source, location) DO UPDATE SET '
+                       'searches = searches + excluded.searches, zero_matches = zero_matches + excluded.zero_matches',
+                       [key + tuple(entry) for key, entry in counts.items()])
+        # Forget segments that have been compacted
+        gone = set(read) - set(names)
+        db.executemany('DELETE FROM audit_segments WHERE name = ?', [(name,) for name in gone])
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    return lines
+
+
+def compact(upload_folder=None, segment_seconds=DEFAULT_SEGMENT_SECONDS, retention_days=DEFAULT_RETENTION_DAYS):
+    """Move finished segments from earlier days into that day's archive and delete expired archives
+
+    Only segments that update_rollups() has read to the end are compacted.
+    Returns the number of segments compacted.
+    """
+    folder = get_audit_folder(upload_folder)
+    db = get_db(upload_folder)
+    read = {row['name']: row['bytes_read'] for row in db.execute('SELECT name, bytes_read FROM audit_segments')}
+    today = date.today()
+    closed_before = datetime.now() - timedelta(seconds=segment_seconds + CLOSE_GRACE)
+
+    by_day = {}
+    for name in _segments(folder):
+        opened = _segment_opened(name)
+        path = os.path.join(folder, name)
+        if opened.date() < today and opened < closed_before and read.get(name) == os.path.getsize(path):
+            by_day.setdefault(opened.date(), []).append(name)
+
+    for day, names in by_day.items():
+        # Each append adds a gzip member; reading the archive returns them all as one stream
+        with gzip.open(os.path.join(folder, f"{ARCHIVE_PREFIX}{day.isoformat()}{ARCHIVE_SUFFIX}"), 'ab') as archive:
+            for name in names:
+                with open(os.path.join(folder, name), 'rb') as f:
+                    archive.write(f.read())
+        for name in names:
+            os.remove(os.path.join(folder, name))
+
+    if retention_days:
+        oldest = (today - timedelta(days=retention_days)).isoformat()
+        for name in os.listdir(folder):
+            if name.startswith(ARCHIVE_PREFIX) and name.endswith(ARCHIVE_SUFFIX) \
+                    and name[len(ARCHIVE_PREFIX):-len(ARCHIVE_SUFFIX)] < oldest:
+                os.remove(os.path.join(folder, name))
+
+    return sum(len(names) for names in by_day.values())
+
+
+def maintain(upload_folder=None, segment_seconds=None, retention_days=None):
+    """Update the rollups, then compact, holding the audit folder's lock"""
+    if segment_seconds is None:
+        segment_seconds = current_app.config.get('AUDIT_SEGMENT_SECONDS', DEFAULT_SEGMENT_SECONDS)
+    if retention_days is None:
+        retention_days = current_app.config.get('AUDIT_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    folder = get_audit_folder(upload_folder)
+    with file_lock(folder):
+        update_rollups(upload_folder)
+        compacted = compact(upload_folder, segment_seconds, retention_days)
+        if compacted:
+            update_rollups(upload_folder)
+    if compacted:
+        metrics.log('audit segments compacted', segments=compacted)
+
+
+# Helper function to add the zero-match rate to summed rollup rows
+def _with_rates(rows):
+    return [dict(row, zero_match_rate=row['zero_matches'] / row['searches'] if row['searches'] else 0.0)
+            for row in rows]
+
+
+def report(days=None, upload_folder=None):
+    """Summarise the rollups over the last `days` days (None for all of them)"""
+    db = get_db(upload_folder)
+    since = (date.today() - timedelta(days=days - 1)).isoformat() if days else ''
+
+    def grouped(columns, order='searches DESC', having='', limit=None):
+        sql = (f"SELECT {columns}, SUM(searches) AS searches, SUM(zero_matches) AS zero_matches "
+               f"FROM audit_rollups WHERE day >= ? GROUP BY {columns} {having} ORDER BY {order}, {columns}")
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return _with_rates([dict(row) for row in db.execute(sql, (since,))])
+
+    totals = db.execute('SELECT COALESCE(SUM(searches), 0) AS searches, COALESCE(SUM(zero_matches), 0) '
+                        'AS zero_matches FROM audit_rollups WHERE day >= ?', (since,)).fetchone()
+    return {
+        'since': since or None,
+        'totals': _with_rates([dict(totals)])[0],
+        'by_day': grouped('day', order='day DESC'),
+        'by_presentation': grouped('presentation'),
+        'by_location': grouped('location'),
+        'by_funding_source': grouped('funding_source'),
+        # Unmet demand: the criteria most often searched without a match
+        'hotspots': grouped(', '.join(ROLLUP_FIELDS), order='zero_matches DESC, searches DESC',
+                            having='HAVING SUM(zero_matches) > 0', limit=HOTSPOT_LIMIT),
+    }
@@ -0,0 +1,179 @@
+"""
+Search result cache for the Psychology Clinic Triage Tool
+
+Triage staff run the same few searches all day, so search results are cached
+per (age group, presentation, funding source, location). Every entry also
+records the version it was computed from: that of the location's shard of
+the roster, or of the whole roster for "Flexible" (see app.models.shards). An
+upload changes every version; an availability edit changes its location's
+and the roster's. Stale results are never served, and are dropped when next
+looked up, so an edit at one site leaves other sites' entries in place.
+
+Two stores are available, chosen with the SEARCH_CACHE setting:
+
+    'memory'  a bounded LRU per worker process (the default)
+    'sqlite'  a table in the triage database shared by every worker
+    'off'     no caching
+
+Both also expire entries after SEARCH_CACHE_TTL seconds. Cached results are
+shared between requests and must be treated as read-only.
+"""
+
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import current_app
+
+from app.models.database import get_db
+
+DEFAULT_SIZE = 256
+DEFAULT_TTL = 300
+
+# Cache instances by (store, size, ttl, upload folder)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class SearchCache:
+    """A bounded, thread-safe LRU cache with expiry, local to this process"""
+
+    def __init__(self, max_size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.counters = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Return (True, value) for a fresh cached entry, otherwise (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] != version:
+                del self._entries[key]
+                self.counters['invalidations'] += 1
+                entry = None
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.counters['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return True, entry[2]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, size=len(self._entries), max_size=self.max_size, ttl=self.ttl)
+
+
+class SQLiteSearchCache(SearchCache):
+    """The same cache kept in the triage database, so every worker shares it
+
+    Values are stored as JSON. The hit, miss and eviction counters are still
+    per process.
+    """
+
+    def __init__(self, max_size=DEFAULT_SIZE, ttl=DEFAULT_TTL, upload_folder=None):
+        super().__init__(max_size, ttl)
+        self.upload_folder = upload_folder
+
+    def get(self, key, version):
+        db = get_db(self.upload_folder)
+        row = db.execute('SELECT value, created FROM search_cache WHERE key = ? AND version = ?',
+                         (json.dumps(key), json.dumps(version))).fetchone()
+        now = time.time()
+        with self._lock:
+            if row is None or now - row['created'] > self.ttl:
+                if row is not None:
+                    self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return False, None
+            self.counters['hits'] += 1
+
+        db.execute('UPDATE search_cache SET used = ? WHERE key = ?', (now, json.dumps(key)))
+        return True, json.loads(row['value'])
+
+    def put(self, key, version, value):
+        db = get_db(self.upload_folder)
+        now = time.time()
+        version = json.dumps(version)
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # Drop this key's entry from an older version, and expired entries
+            stale = db.execute('DELETE FROM search_cache WHERE (key = ? AND version != ?) OR created < ?',
+                               (json.dumps(key), version, now - self.ttl)).rowcount
+            db.execute('INSERT OR REPLACE INTO search_cache (key, version, value, created, used) '
+                       'VALUES (?, ?, ?, ?, ?)', (json.dumps(key), version, json.dumps(value, default=str), now, now))
+            # Trim to size, least recently used first
+            evicted = db.execute('DELETE FROM search_cache WHERE key IN (SELECT key FROM search_cache '
+                                 'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_size,)).rowcount
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        with self._lock:
+            self.counters['invalidations'] += stale
+            self.counters['evictions'] += evicted
+
+    def clear(self):
+        get_db(self.upload_folder).execute('DELETE FROM search_cache')
+
+    def stats(self):
+        size = get_db(self.upload_folder).execute('SELECT COUNT(*) FROM search_cache').fetchone()[0]
+        with self._lock:
+            return dict(self.counters, size=size, max_size=self.max_size, ttl=self.ttl)
+
+
+def get_cache():
+    """Return the search cache configured for this app, or None if caching is off"""
+    config = current_app.config
+    store = config.get('SEARCH_CACHE', 'memory')
+    if store == 'off':
+        return None
+
+    upload_folder = config['UPLOAD_FOLDER']
+    key = (store, config.get('SEARCH_CACHE_SIZE', DEFAULT_SIZE), config.get('SEARCH_CACHE_TTL', DEFAULT_TTL),
+           upload_folder)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                if store == 'sqlite':
+                    cache = SQLiteSearchCache(key[1], key[2], upload_folder)
+                elif store == 'memory':
+                    cache = SearchCache(key[1], key[2])
+                else:
+                    raise ValueError(f"Unknown SEARCH_CACHE store: {store}")
+                _caches[key] = cache
+    return cache
+
+
+def cached(key, version, compute):
+    """Return compute()'s result for key, from the cache when it's fresh"""
+    cache = get_cache()
+    if cache is None:
+        return compute()
+
+    hit, value = cache.get(key, version)
+    if hit:
+        return value
+    value = compute()
+    cache.put(key, version, value)
+    return value
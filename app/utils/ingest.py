@@ -0,0 +1,234 @@
+"""
+Spreadsheet ingestion for the Psychology Clinic Triage Tool
+
+Converts an uploaded master spreadsheet into a roster snapshot in five
+stages, each timed for the upload report:
+
+    read       load the first worksheet (pandas, or openpyxl read-only
+               streaming for large workbooks)
+    normalise  turn each column into a list of JSON-compatible values,
+               with blanks/NaN as None
+    validate   check the required columns and the *_treats conventions
+    diff       hash each row and compare it with the live roster
+    save       write the columnar snapshot and make it live, copying
+               unchanged rows from the live one
+
+A re-upload that changes nothing isn't saved at all, so workers keep their
+roster, indexes and caches.
+"""
+
+import math
+import os
+import time
+from collections import Counter
+
+from app.models import availability, roster
+from app.models.roster import FLAG_VALUES
+from app.models.roster_diff import RosterDiff, row_hashes
+
+REQUIRED_COLUMNS = ('clinician_name', 'primary_location')
+FUNDING_COLUMNS = ('mhcp', 'ndis', 'dva', 'wc', 'qps', 'eap', 'private')
+AGE_COLUMNS = ('age_0_6', 'age_6_12', 'age_12_18', 'age_18_plus', 'age_70_plus')
+
+# Workbooks larger than this are streamed row by row with openpyxl rather than
+# loaded into a DataFrame, keeping memory flat
+STREAMING_THRESHOLD = 5 * 1024 * 1024
+
+
+class IngestError(Exception):
+    """Raised when a spreadsheet can't be turned into a roster"""
+
+
+# Helper function to convert a cell value into something JSON can store
+def _json_value(value):
+    if value is None or isinstance(value, (str, bool, int)):
+        return value
+    if isinstance(value, float):
+        return None if math.isnan(value) else value
+    # Dates, times and anything else are stored as text, as the JSON roster did
+    return str(value)
+
+
+# Helper function to name columns the way pandas does (blank -> "Unnamed: n", duplicates -> "name.1")
+def _column_names(header):
+    names = []
+    seen = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def normalise_frame(df):
+    """Convert a DataFrame column-wise into lists of JSON-compatible values"""
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        # Blank cells become None in one vectorised step per column
+        values = series.astype(object).where(series.notna(), None).tolist()
+        if series.dtype.kind not in 'iufb':
+            values = [_json_value(value) for value in values]
+        columns[str(name)] = values
+    return columns
+
+
+def read_streaming(file_path):
+    """Read the first worksheet into {column: list of values} row by row
+
+    Uses openpyxl's read-only mode, so the workbook is never held in memory
+    as a whole and no DataFrame is built.
+    """
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return {}
+
+        names = _column_names(header)
+        lists = [[] for _ in names]
+        width = len(names)
+
+        for row in rows:
+            # Skip fully blank rows, as pandas does
+            if all(value is None for value in row):
+                continue
+            for i in range(width):
+                value = row[i] if i < len(row) else None
+                lists[i].append(_json_value(value))
+
+        return dict(zip(names, lists))
+    finally:
+        workbook.close()
+
+
+def validate_columns(columns):
+    """Check a roster's schema, returning (errors, warnings)
+
+    Errors stop the upload; warnings are shown alongside the report.
+    """
+    errors = []
+    warnings = []
+
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        errors.append(f"Missing required columns: {', '.join(missing)}")
+
+    presentations = [name[:-len('_treats')] for name in columns if name.endswith('_treats')]
+    if not presentations:
+        errors.append("No presentation columns found (expected columns ending in _treats)")
+
+    if 'clinician_name' in columns:
+        names = columns['clinician_name']
+        blank = sum(1 for name in names if not name)
+        if blank:
+            errors.append(f"{blank} rows have no clinician_name")
+        duplicates = sorted((name for name, count in Counter(names).items() if name and count > 1), key=str)
+        if duplicates:
+            warnings.append(f"Duplicate clinician names: {', '.join(map(str, duplicates))}")
+
+    # Flag columns should only hold Y, N or Conditional
+    flag_columns = [name for name in columns
+                    if name.endswith('_treats') or name in AGE_COLUMNS or name in FUNDING_COLUMNS]
+    invalid = [name for name in flag_columns if any(value not in FLAG_VALUES for value in columns[name])]
+    if invalid:
+        warnings.append(f"Columns with values other than Y/N/Conditional: {', '.join(invalid)}")
+
+    incomplete = [key for key in presentations
+                  if f"{key}_service_type" not in columns or f"{key}_notes" not in columns]
+    if incomplete:
+        warnings.append(f"Presentations missing _service_type or _notes columns: {', '.join(incomplete)}")
+
+    missing_ages = [name for name in AGE_COLUMNS if name not in columns]
+    if missing_ages:
+        warnings.append(f"Missing age group columns: {', '.join(missing_ages)}")
+
+    return errors, warnings
+
+
+# Helper function to list the stages a run will go through
+def pipeline_stages(streaming):
+    if streaming:
+        return ['read', 'validate', 'diff', 'save']
+    return ['read', 'normalise', 'validate', 'diff', 'save']
+
+
+def diff_columns(columns, upload_folder=None):
+    """Compare uploaded columns with the live roster, returning a RosterDiff or None if there's no roster yet"""
+    hashes = row_hashes(list(columns), columns.__getitem__)
+    base = roster.get_snapshot(upload_folder)
+    if base is None or not len(base):
+        return None
+    return RosterDiff(base, columns, hashes)
+
+
+def ingest_spreadsheet(file_path, upload_folder=None, streaming=None, streaming_threshold=STREAMING_THRESHOLD,
+                       progress=None, keep_availability=True):
+    """Run the ingestion pipeline and return a report of what it did
+
+    Raises IngestError if the spreadsheet fails validation; the live roster is
+    only replaced once every stage before 'save' has succeeded. If given,
+    progress(stage, done, total) is called as each stage starts. With
+    keep_availability, availability edits made in the app are kept for
+    clinicians still on the roster, even where the spreadsheet changed them.
+    report['applied'] is False if the spreadsheet matched the live roster.
+    """
+    report = {'file': os.path.basename(file_path), 'stages': [], 'warnings': []}
+    started = time.perf_counter()
+
+    def timed(name, func, *args):
+        if progress is not None:
+            progress(name, len(report['stages']), len(stages))
+        start = time.perf_counter()
+        result = func(*args)
+        report['stages'].append({'name': name, 'seconds': round(time.perf_counter() - start, 4)})
+        return result
+
+    if streaming is None:
+        # .xls workbooks can't be streamed with openpyxl
+        streaming = (file_path.lower().endswith('.xlsx')
+                     and os.path.getsize(file_path) > streaming_threshold)
+    report['streaming'] = streaming
+    stages = pipeline_stages(streaming)
+
+    if streaming:
+        columns = timed('read', read_streaming, file_path)
+    else:
+        # Only ingestion needs pandas, so it isn't imported until a spreadsheet arrives
+        import pandas as pd
+        df = timed('read', pd.read_excel, file_path)
+        columns = timed('normalise', normalise_frame, df)
+        del df
+
+    errors, warnings = timed('validate', validate_columns, columns)
+    report['warnings'] = warnings
+    if errors:
+        raise IngestError('; '.join(errors))
+
+    columns = roster.prepare_columns(columns)
+    diff = timed('diff', diff_columns, columns, upload_folder)
+    report['diff'] = None
+    report['applied'] = True
+    if diff is not None:
+        overrides = availability.get_overrides(diff.snapshot, upload_folder)
+        # Edits that win over availability the spreadsheet changed
+        kept = [name for name, groups in diff.changed.items()
+                if 'availability' in groups and name in overrides] if keep_availability else []
+        report['diff'] = diff.summary(kept)
+        # Dropping edits still needs a new snapshot, even if the spreadsheet is unchanged
+        report['applied'] = diff.has_changes or (not keep_availability and bool(overrides))
+
+    if report['applied']:
+        timed('save', roster.save_columns, columns, upload_folder, diff, keep_availability)
+
+    report['rows'] = len(columns['clinician_name'])
+    report['columns'] = len(columns)
+    report['presentations'] = sum(1 for name in columns if name.endswith('_treats'))
+    report['total_seconds'] = round(time.perf_counter() - started, 4)
+    return report
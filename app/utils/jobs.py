@@ -0,0 +1,224 @@
+"""
+Background ingestion jobs for the Psychology Clinic Triage Tool
+
+An upload is saved under uploads/jobs/ and processed on a background thread,
+so the request that received it returns straight away. Each job's state is
+kept in its own JSON file next to the upload, so any worker can answer a
+status query, not just the one running the job.
+
+A job moves through queued -> running -> succeeded | failed. The live roster
+is only replaced by the final 'save' stage, after validation has passed.
+Under gunicorn with preload, a successful job then asks the master to re-fork
+the workers from the new snapshot (see app.utils.prefork).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app.utils import metrics, prefork
+from app.utils.ingest import ingest_spreadsheet, IngestError, STREAMING_THRESHOLD
+
+JOBS_DIRNAME = 'jobs'
+
+# Number of finished jobs (and their uploaded files) kept for the dashboard
+KEEP_JOBS = 20
+
+# A job that hasn't reported progress for this long is assumed to have died
+# with its worker
+STALE_AFTER = 30 * 60
+
+# One ingestion at a time per worker process
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Helper function to get the folder holding job records and uploads
+def get_jobs_folder(upload_folder=None):
+    if upload_folder is None:
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+    folder = os.path.join(upload_folder, JOBS_DIRNAME)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+# Helper function to get the shared executor, creating it on first use
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest')
+        return _executor
+
+
+# Helper function to write a job record atomically
+def _write_job(folder, job):
+    job['updated'] = time.time()
+    path = os.path.join(folder, f"{job['id']}.json")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f, default=str)
+    os.replace(tmp_path, path)
+
+
+# Helper function to mark jobs whose worker disappeared as failed
+def _check_stale(job):
+    if job['status'] in ('queued', 'running') and time.time() - job.get('updated', 0) > STALE_AFTER:
+        job['status'] = 'failed'
+        job['error'] = 'Job stopped reporting progress (the worker may have restarted)'
+    return job
+
+
+def new_upload_path(filename, upload_folder=None):
+    """Return (job id, path) to save a new upload to before submitting it"""
+    job_id = datetime.now().strftime('%Y%m%d%H%M%S%f') + '-' + uuid.uuid4().hex[:8]
+    return job_id, os.path.join(get_jobs_folder(upload_folder), f"{job_id}-{filename}")
+
+
+def get_job(job_id, upload_folder=None):
+    """Return a job's record, or None if it doesn't exist"""
+    # Job ids come from URLs, so only accept the characters new_upload_path() uses
+    if not job_id or not all(c.isalnum() or c == '-' for c in job_id):
+        return None
+    path = os.path.join(get_jobs_folder(upload_folder), f"{job_id}.json")
+    try:
+        with open(path, 'r') as f:
+            return _check_stale(json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def list_jobs(upload_folder=None, limit=5):
+    """Return the most recent jobs, newest first"""
+    folder = get_jobs_folder(upload_folder)
+    names = sorted((name for name in os.listdir(folder) if name.endswith('.json')), reverse=True)
+    jobs = []
+    for name in names[:limit]:
+        job = get_job(name[:-len('.json')], upload_folder)
+        if job is not None:
+            jobs.append(job)
+    return jobs
+
+
+def latest_job(upload_folder=None, status=None):
+    """Return the newest job, optionally only one with the given status"""
+    for job in list_jobs(upload_folder, limit=KEEP_JOBS):
+        if status is None or job['status'] == status:
+            return job
+    return None
+
+
+def submit_ingest(job_id, file_path, filename, upload_folder=None, streaming_threshold=STREAMING_THRESHOLD,
+                  keep_availability=True):
+    """Queue an uploaded spreadsheet for ingestion and return its job record"""
+    if upload_folder is None:
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+    folder = get_jobs_folder(upload_folder)
+
+    job = {
+        'id': job_id,
+        'filename': filename,
+        'status': 'queued',
+        'stage': None,
+        'progress': 0,
+        'report': None,
+        'error': None,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    _write_job(folder, job)
+
+    _get_executor().submit(_run_ingest, job, file_path, upload_folder, folder, streaming_threshold,
+                           keep_availability)
+    return job
+
+
+# Helper function run on the background thread for each job
+def _run_ingest(job, file_path, upload_folder, folder, streaming_threshold, keep_availability=True):
+    def progress(stage, done, total):
+        job['status'] = 'running'
+        job['stage'] = stage
+        job['progress'] = int(100 * done / total)
+        _write_job(folder, job)
+
+    try:
+        job['report'] = ingest_spreadsheet(file_path, upload_folder, streaming_threshold=streaming_threshold,
+                                           progress=progress, keep_availability=keep_availability)
+        job['status'] = 'succeeded'
+        job['progress'] = 100
+    except IngestError as e:
+        job['status'] = 'failed'
+        job['error'] = f"Spreadsheet failed validation: {str(e)}"
+    except Exception as e:
+        job['status'] = 'failed'
+        job['error'] = f"Error processing spreadsheet: {str(e)}"
+
+    # Nothing waits on this thread's future, so failures past here must be logged
+    try:
+        job['finished'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        _write_job(folder, job)
+        _remove_old_jobs(folder)
+        _record_metrics(job)
+
+        # Restarting workers now would cut short other uploads, so the last one to finish asks
+        if job['status'] == 'succeeded' and not _other_jobs_active(job['id'], upload_folder) \
+                and _roster_changed(job, upload_folder):
+            prefork.request_reload()
+    except Exception:
+        metrics.log('ingest job bookkeeping failed', level=logging.ERROR, exc_info=True, job=job['id'],
+                    status=job['status'])
+
+
+# Helper function to check whether this job, or one that finished while it ran, replaced the roster
+def _roster_changed(job, upload_folder):
+    if (job['report'] or {}).get('applied', True):
+        return True
+    return any(other['status'] == 'succeeded' and (other['report'] or {}).get('applied', True)
+               and other.get('finished', '') >= job['created']
+               for other in list_jobs(upload_folder, limit=KEEP_JOBS) if other['id'] != job['id'])
+
+
+# Helper function to check whether any other job is still queued or running
+def _other_jobs_active(job_id, upload_folder):
+    return any(job['id'] != job_id and job['status'] in ('queued', 'running')
+               for job in list_jobs(upload_folder, limit=KEEP_JOBS))
+
+
+# Helper function to record a finished job's outcome and stage timings
+def _record_metrics(job):
+    metrics.INGEST_JOBS.inc(status=job['status'])
+    report = job['report']
+    if report:
+        for stage in report['stages']:
+            metrics.INGEST_SECONDS.observe(stage['seconds'], stage=stage['name'])
+        metrics.INGEST_SECONDS.observe(report['total_seconds'], stage='total')
+    metrics.log('ingest job finished', job=job['id'], file=job['filename'], status=job['status'],
+                error=job['error'], seconds=report and report['total_seconds'])
+
+
+# Helper function to delete all but the newest job records and their uploads
+def _remove_old_jobs(folder):
+    job_ids = sorted((name[:-len('.json')] for name in os.listdir(folder) if name.endswith('.json')), reverse=True)
+    for job_id in job_ids[KEEP_JOBS:]:
+        for name in os.listdir(folder):
+            if name.startswith(job_id):
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+
+def wait_for_job(job_id, upload_folder=None, timeout=60, interval=0.1):
+    """Block until a job finishes and return its record (used by scripts)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_job(job_id, upload_folder)
+        if job is None or job['status'] in ('succeeded', 'failed') or time.monotonic() > deadline:
+            return job
+        time.sleep(interval)
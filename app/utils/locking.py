@@ -0,0 +1,31 @@
+"""
+Cross-process file locks for the Psychology Clinic Triage Tool
+
+Workers are separate processes, so work that must not run twice at once
+(replacing the roster, compacting the audit log) holds an exclusive flock()
+on a lock file in the folder it changes.
+"""
+
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single-process dev server only
+    fcntl = None
+
+LOCK_FILENAME = '.lock'
+
+
+@contextmanager
+def file_lock(folder):
+    """Hold an exclusive lock on folder across processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(folder, LOCK_FILENAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,254 @@
+"""
+Performance instrumentation for the Psychology Clinic Triage Tool
+
+Keeps in-process counters and latency histograms and serves them at /metrics
+in the Prometheus text format. Each request is also logged as one JSON line.
+Metrics are per worker process; every sample carries a worker label so the
+scraper can sum them.
+
+An opt-in profiler can run cProfile around a request. It covers a random
+sample of requests (PROFILE_SAMPLE_RATE), or any request a super admin sends
+with ?profile=1. Each profile is saved under uploads/profiles/ and its
+hottest functions are logged.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, g, request, session, Response
+
+from app.utils import cache
+
+# Latency buckets in seconds, and size buckets for match counts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+PROFILES_DIRNAME = 'profiles'
+KEEP_PROFILES = 50
+
+logger = logging.getLogger('triage')
+
+_registry = []
+
+
+class Metric:
+    """A named family of samples, one per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    # Helper function to turn label keyword arguments into a key in label order
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key + (('le', _number(bound)),), bucket_count))
+                samples.append((f"{self.name}_bucket", key + (('le', '+Inf'),), count))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+REQUEST_SECONDS = Histogram('triage_request_seconds', 'Request latency by endpoint',
+                            ('endpoint', 'method', 'status'))
+ROSTER_LOAD_SECONDS = Histogram('triage_roster_load_seconds',
+                                'Time to load a roster snapshot or apply availability edits', ('kind',))
+SEARCH_MATCHES = Histogram('triage_search_matches', 'Clinicians matched per search', buckets=COUNT_BUCKETS)
+SEARCH_ERRORS = Counter('triage_search_errors_total', 'Searches that failed with an error')
+INGEST_SECONDS = Histogram('triage_ingest_seconds', 'Spreadsheet ingestion time by stage', ('stage',))
+INGEST_JOBS = Counter('triage_ingest_jobs_total', 'Finished ingestion jobs by outcome', ('status',))
+AUDIT_DROPPED = Counter('triage_audit_dropped_total', 'Search audit records dropped because the writer fell behind')
+LOGINS = Counter('triage_logins_total', 'Login attempts by outcome (success, failed or throttled)', ('outcome',))
+
+
+# Helper function to format a number the way Prometheus expects
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Helper function to escape a label value
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(extra=()):
+    """Return every metric in the Prometheus text format
+
+    extra is a list of (name, type, help, value) for values read at scrape time.
+    """
+    worker = str(os.getpid())
+    lines = []
+    families = [(metric.name, metric.kind, metric.help, metric.labels, metric.samples()) for metric in _registry]
+    families += [(name, kind, help, (), [(name, (), value)]) for name, kind, help, value in extra]
+
+    for name, kind, help, labels, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, key, value in samples:
+            pairs = [('worker', worker)]
+            for i, item in enumerate(key):
+                pairs.append(item if isinstance(item, tuple) else (labels[i], item))
+            label_text = ','.join(f'{label}="{_escape(value)}"' for label, value in pairs)
+            lines.append(f"{sample_name}{{{label_text}}} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def log(message, level=logging.INFO, exc_info=None, **fields):
+    """Log a message with extra structured fields"""
+    logger.log(level, message, exc_info=exc_info, extra={'fields': fields})
+
+
+def init_app(app):
+    """Add request timing, JSON request logs, the profiler hook and /metrics to an app"""
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JSONFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    if _should_profile():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _save_profile(profiler)
+
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+
+    REQUEST_SECONDS.observe(duration, endpoint=endpoint, method=request.method, status=response.status_code)
+    log('request', method=request.method, path=request.path, endpoint=endpoint,
+        status=response.status_code, duration_ms=round(1000 * duration, 3), user=session.get('user_id'))
+    return response
+
+
+# Helper function to decide whether to profile this request
+def _should_profile():
+    if request.args.get('profile') == '1' and session.get('user_role') == 'super_admin':
+        return True
+    rate = current_app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+# Helper function to save a request's profile and log its hottest functions
+def _save_profile(profiler):
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], PROFILES_DIRNAME)
+    os.makedirs(folder, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{request.endpoint or 'unmatched'}.prof"
+    path = os.path.join(folder, name)
+    profiler.dump_stats(path)
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+    log('profile', path=request.path, file=path, summary=summary.getvalue())
+
+    # Keep only the newest profiles
+    for old in sorted(os.listdir(folder), reverse=True)[KEEP_PROFILES:]:
+        try:
+            os.remove(os.path.join(folder, old))
+        except OSError:
+            pass
+
+
+def _metrics_view():
+    if not current_app.config.get('METRICS_ENABLED', True):
+        return Response('Metrics are disabled\n', status=404, mimetype='text/plain')
+
+    extra = []
+    search_cache = cache.get_cache()
+    if search_cache is not None:
+        stats = search_cache.stats()
+        for counter in ('hits', 'misses', 'evictions', 'expirations', 'invalidations'):
+            extra.append((f"triage_search_cache_{counter}_total", 'counter',
+                          f"Search cache {counter} in this worker", stats.get(counter, 0)))
+        extra.append(('triage_search_cache_size', 'gauge', 'Searches held in the cache', stats['size']))
+
+    return Response(render(extra), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,71 @@
+"""
+Pre-fork worker support for the Psychology Clinic Triage Tool
+
+Used by gunicorn.conf.py. With preload_app the master process imports the app
+and loads the live roster snapshot, with the structures searches need, before
+it forks any workers, so every worker shares those pages copy-on-write rather
+than building its own copy. gc.freeze() then moves them out of the garbage
+collector's reach, so collections in the workers don't write to them (which
+would copy the pages).
+
+When an upload finishes, the worker that ran it sends the master SIGHUP. The
+master loads the new snapshot, forks fresh workers from it and retires the
+old ones gracefully. Until then the old workers load the new snapshot
+themselves on their next request, as they would without preload.
+"""
+
+import gc
+import os
+import signal
+import time
+
+from app.models import database, roster
+from app.utils import metrics
+
+# Pid of the gunicorn master, set in each worker after it forks
+_master_pid = None
+
+
+def warm(app):
+    """Load the live roster and everything a search builds from it (run in the master before forking)"""
+    started = time.perf_counter()
+    # Objects from a previous snapshot must be collectable again before it's replaced
+    gc.unfreeze()
+
+    load(app)
+    # Workers open their own database connections; the master's mustn't be inherited open
+    database.close_connections()
+
+    gc.collect()
+    gc.freeze()
+    metrics.log('roster preloaded', pid=os.getpid(), seconds=round(time.perf_counter() - started, 3))
+
+
+def load(app):
+    """Load the live roster, if there is one, and build the structures searches use"""
+    with app.app_context():
+        if roster.roster_exists():
+            current = roster.get_roster()
+            # Touch each lazily built structure so it exists before the fork
+            current.availability_index
+            current.shards.warm()
+            current.form_metadata
+            current.autocomplete
+
+
+def set_master(pid):
+    """Record the master's pid so this worker can ask it to reload"""
+    global _master_pid
+    _master_pid = pid
+
+
+def request_reload():
+    """Ask the gunicorn master to reload workers from the new snapshot; returns False if not under gunicorn"""
+    if _master_pid is None:
+        return False
+    try:
+        os.kill(_master_pid, signal.SIGHUP)
+    except OSError:
+        return False
+    metrics.log('reload requested', pid=os.getpid(), master=_master_pid)
+    return True
@@ -0,0 +1,82 @@
+"""
+In-process rate limiting for the Psychology Clinic Triage Tool
+
+Checking a password is deliberately slow, so a burst of login attempts could
+otherwise keep every worker busy hashing. The login route counts failed
+attempts per client address, and per username from that address, over a
+sliding window. Once either is over the limit, further attempts are turned
+away before any hashing is done. Successful logins never use up the
+allowance. Nothing is counted per username alone, so failed attempts from
+elsewhere can't lock a user out.
+
+Limits are kept per worker process, so with several workers a client can make
+up to (workers x limit) attempts in a window.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Keys tracked at once; the least recently seen are forgotten first
+MAX_KEYS = 10000
+
+# Limiter instances by (name, limit, window)
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Allows up to limit hits per key in any window seconds"""
+
+    def __init__(self, limit, window, max_keys=MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._hits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Return 0 if key is under its limit, otherwise the seconds until it will be"""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                return 0
+            self._expire(hits, now)
+            if len(hits) < self.limit:
+                return 0
+            return self.window - (now - hits[0])
+
+    def hit(self, key):
+        """Record a hit for key (e.g. a failed login)"""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque(maxlen=self.limit)
+                while len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)
+            else:
+                self._hits.move_to_end(key)
+            self._expire(hits, now)
+            hits.append(now)
+
+    def reset(self, key):
+        """Forget key's hits (e.g. after a successful login)"""
+        with self._lock:
+            self._hits.pop(key, None)
+
+    # Helper function to drop hits that have left the window
+    def _expire(self, hits, now):
+        while hits and now - hits[0] >= self.window:
+            hits.popleft()
+
+
+def get_limiter(name, limit, window):
+    """Return this process's limiter for name with the given settings"""
+    key = (name, limit, window)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(key, RateLimiter(limit, window))
+    return limiter
@@ -0,0 +1,2 @@
+# Psychology Clinic Triage Tool
+# Benchmarks package initialization
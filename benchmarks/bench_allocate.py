@@ -0,0 +1,57 @@
+"""
+Referral allocation benchmark
+
+Allocates a batch of referrals across a synthetic roster whose clinicians
+each have a capacity, with the greedy and min-cost flow solvers, under strict
+and relaxed scoring. Compares both with sending every referral to its top
+search result, which ignores capacity.
+
+    python -m benchmarks.bench_allocate [--clinicians 500] [--referrals 5000] [--max-capacity 8]
+"""
+
+import argparse
+import tempfile
+import time
+from collections import Counter
+
+from app.models import roster, scoring
+from app.models.allocation import SOLVERS, allocate
+from benchmarks.synthetic import make_clinicians, make_referrals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clinicians', type=int, default=500)
+    parser.add_argument('--referrals', type=int, default=5000)
+    parser.add_argument('--max-capacity', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    upload_folder = tempfile.mkdtemp()
+    roster.save_clinicians(make_clinicians(args.clinicians, max_capacity=args.max_capacity), upload_folder)
+    referrals = make_referrals(args.referrals)
+    current = roster.get_roster(upload_folder)
+    current.shards.warm()
+
+    print(f"{args.referrals} referrals x {args.clinicians} clinicians, capacity 0-{args.max_capacity}")
+    for label, options in (('strict', {}), ('relaxed', {'allow_conditional': True, 'allow_adjacent_age': True})):
+        weights = scoring.get_weights(options)
+
+        # Top search result for every referral, however many that clinician already has
+        top = Counter()
+        for r in referrals:
+            ranked = current.shards.score(r['age_group'], r['presentation'], r['funding_source'], r['location'],
+                                          weights)
+            if ranked:
+                top[ranked[0][0]] += 1
+        print(f"  {label}: top result only sends up to {max(top.values(), default=0)} referrals to one clinician")
+
+        for solver in SOLVERS:
+            start = time.perf_counter()
+            _, summary = allocate(current, referrals, weights, solver=solver)
+            seconds = time.perf_counter() - start
+            print(f"  {label} {solver:<6} {seconds:.3f}s  assigned {summary['assigned']}"
+                  f"  unassigned {summary['unassigned']}  total score {summary['total_score']}")
+
+
+if __name__ == '__main__':
+    main()
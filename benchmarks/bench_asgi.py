@@ -0,0 +1,170 @@
+"""
+Concurrency scaling: gunicorn sync workers against the ASGI entry point
+
+Starts gunicorn with gunicorn.conf.py on a synthetic roster twice, with the
+same number of worker processes: sync workers, then uvicorn workers serving
+app.asgi (TRIAGE_ASGI=1). Each is
+driven with GET /triage/api/search from increasing numbers of concurrent
+clients, with persistent connections, for a fixed time per level. Throughput
+and p50/p95/p99 are reported for each level.
+
+A second run repeats one level while --slow-clients clients trickle a batch
+upload a byte at a time. That is how a slow upload or a poor connection
+looks to the server: a sync worker is held for the whole upload, while the
+ASGI server holds only a connection. Needs uvicorn (pip install uvicorn).
+
+    python -m benchmarks.bench_asgi [--workers 2] [--concurrency 1 4 16 64] [--slow-clients 4]
+"""
+
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from app.models import roster
+from benchmarks.bench_memory import free_port, wait_until_up
+from benchmarks.harness import ROOT, percentiles, save_results
+from benchmarks.load import HTTPSession
+from benchmarks.synthetic import make_clinicians, make_referrals
+
+# Both run under gunicorn.conf.py with the same number of preloaded worker processes
+SERVERS = {
+    'gunicorn': {'TRIAGE_ASGI': '0'},
+    'asgi': {'TRIAGE_ASGI': '1'},
+}
+
+
+# Helper function to start a server with the given number of workers, returning (process, url)
+def start_server(name, upload_folder, workers):
+    port = free_port()
+    env = dict(os.environ, TRIAGE_UPLOAD_FOLDER=upload_folder, BIND=f"127.0.0.1:{port}",
+               WEB_CONCURRENCY=str(workers), SECRET_KEY=os.environ.get('SECRET_KEY', 'bench-asgi'), **SERVERS[name])
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(url)
+    except RuntimeError:
+        server.terminate()
+        raise
+    return server, url
+
+
+# Helper function to log in once and return the session cookie header every client sends
+def login_cookie(url):
+    session = HTTPSession(url, 'staff', 'staff123')
+    jar = next(handler.cookiejar for handler in session.opener.handlers
+               if isinstance(handler, urllib.request.HTTPCookieProcessor))
+    return '; '.join(f"{cookie.name}={cookie.value}" for cookie in jar)
+
+
+# Helper function run by each client thread: send searches until stop is set, recording latencies
+def run_client(url, cookie, paths, stop, timings, errors):
+    host, port = urllib.parse.urlsplit(url).netloc.split(':')
+    connection = http.client.HTTPConnection(host, int(port), timeout=30)
+    rng = random.Random()
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            connection.request('GET', rng.choice(paths), headers={'Cookie': cookie})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            ok = False
+        timings.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(1)
+    connection.close()
+
+
+# Helper function run by each slow client: send a batch upload one byte at a time until stop is set
+def run_slow_client(url, cookie, stop, interval=0.25):
+    host, port = urllib.parse.urlsplit(url).netloc.split(':')
+    with socket.create_connection((host, int(port))) as s:
+        s.sendall((f"POST /triage/api/batch HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n"
+                   f"Content-Type: application/json\r\nContent-Length: 100000\r\n\r\n").encode())
+        while not stop.is_set():
+            try:
+                s.sendall(b' ')
+            except OSError:
+                return
+            stop.wait(interval)
+
+
+# Helper function to drive a server at one concurrency level for duration seconds
+def run_level(url, cookie, paths, concurrency, duration, slow_clients=0):
+    stop = threading.Event()
+    slow = [threading.Thread(target=run_slow_client, args=(url, cookie, stop)) for _ in range(slow_clients)]
+    for thread in slow:
+        thread.start()
+    if slow:
+        # Give the slow uploads time to reach the workers
+        time.sleep(0.5)
+
+    timings, errors = [], []
+    clients = [threading.Thread(target=run_client, args=(url, cookie, paths, stop, timings, errors))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in clients + slow:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return dict(percentiles(timings), errors=len(errors), throughput_rps=round(len(timings) / elapsed, 1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare concurrency scaling of gunicorn sync workers and ASGI')
+    parser.add_argument('--clinicians', type=int, default=2000)
+    parser.add_argument('--presentations', type=int, default=25)
+    parser.add_argument('--workers', type=int, default=2, help='worker processes for each server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=5, help='seconds per level')
+    parser.add_argument('--slow-clients', type=int, default=4, help='slow uploads during the last run (0 to skip)')
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['gunicorn', 'asgi'])
+    parser.add_argument('--output', default=None, help='results file (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    upload_folder = tempfile.mkdtemp()
+    roster.save_clinicians(make_clinicians(args.clinicians, args.presentations), upload_folder)
+    paths = [f"/triage/api/search?{urllib.parse.urlencode(referral)}"
+             for referral in make_referrals(200, args.presentations, seed=1)]
+
+    results = {'clinicians': args.clinicians, 'workers': args.workers, 'duration': args.duration}
+    for name in args.servers:
+        server, url = start_server(name, upload_folder, args.workers)
+        try:
+            cookie = login_cookie(url)
+            # Warm every worker's search cache and roster before measuring
+            run_level(url, cookie, paths, 4 * args.workers, 1)
+
+            results[name] = {}
+            levels = [(f"c{n}", n, 0) for n in args.concurrency]
+            if args.slow_clients:
+                n = args.concurrency[len(args.concurrency) // 2]
+                levels.append((f"c{n}_slow{args.slow_clients}", n, args.slow_clients))
+            for label, concurrency, slow_clients in levels:
+                r = results[name][label] = run_level(url, cookie, paths, concurrency, args.duration, slow_clients)
+                print(f"{name:<9} {label:<12} {r['throughput_rps']:>8,.0f} req/s  p50 {r.get('p50_ms', 0):.2f} ms  "
+                      f"p95 {r.get('p95_ms', 0):.2f} ms  p99 {r.get('p99_ms', 0):.2f} ms  errors {r['errors']}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"Results saved to {save_results('asgi', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Presentation autocomplete benchmark
+
+Fires keystroke-style queries at /triage/api/presentations from several
+worker processes (like gunicorn workers) through the Flask test client and
+reports latency percentiles. Exits non-zero if p99 misses the target.
+
+    python -m benchmarks.bench_autocomplete [--presentations 200] [--requests 5000] [--workers 2] [--target-ms 10]
+"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Flask
+
+from app.models import roster
+from app.routes import auth_routes, triage_routes
+from benchmarks.harness import percentiles, save_results
+from benchmarks.synthetic import make_clinicians
+
+# Words used to build realistic multi-word presentation names
+WORDS = ['anxiety', 'depression', 'trauma', 'eating', 'disorders', 'grief', 'anger', 'social', 'panic',
+         'sleep', 'chronic', 'pain', 'substance', 'use', 'gambling', 'adjustment', 'parenting', 'school',
+         'refusal', 'self', 'harm', 'personality', 'psychosis', 'bipolar', 'perinatal', 'relationship']
+
+
+# The app under test, set up by main() before the workers are forked
+_app = None
+
+
+# Helper function to give the synthetic roster readable presentation names
+def rename_presentations(clinicians, count, rng):
+    names = set()
+    while len(names) < count:
+        names.add('_'.join(rng.sample(WORDS, rng.choice([1, 2, 3]))))
+    mapping = dict(zip((f'presentation_{i}' for i in range(count)), sorted(names)))
+    renamed = []
+    for clinician in clinicians:
+        row = {}
+        for column, value in clinician.items():
+            for old, new in mapping.items():
+                if column.startswith(old + '_'):
+                    column = new + column[len(old):]
+                    break
+            row[column] = value
+        renamed.append(row)
+    return renamed, sorted(names)
+
+
+# Helper function run in each worker process: time one request per query
+def run_queries(chunk):
+    client = _app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 'staff'
+        session['user_role'] = 'triage_admin'
+    timings = []
+    for query in chunk:
+        start = time.perf_counter()
+        response = client.get('/triage/api/presentations', query_string={'q': query})
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure autocomplete latency under concurrent load')
+    parser.add_argument('--presentations', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--target-ms', type=float, default=10.0, help='p99 latency target')
+    parser.add_argument('--output', default=None, help='results file (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    upload_folder = tempfile.mkdtemp()
+    clinicians, names = rename_presentations(make_clinicians(50, presentations=args.presentations),
+                                             args.presentations, rng)
+    roster.save_clinicians(clinicians, upload_folder)
+
+    global _app
+    _app = app = Flask(__name__)
+    app.config.update(SECRET_KEY='bench', UPLOAD_FOLDER=upload_folder)
+    app.register_blueprint(auth_routes.bp)
+    app.register_blueprint(triage_routes.bp)
+
+    # Every prefix of a word, as typed one keystroke at a time, plus a few typos
+    queries = []
+    for name in names:
+        word = name.split('_')[0]
+        queries.extend(word[:n] for n in range(2, len(word) + 1))
+        queries.append(word[:2] + word[3:])
+    queries = [rng.choice(queries) for _ in range(args.requests)]
+
+    chunks = [queries[i::args.workers] for i in range(args.workers)]
+    start = time.perf_counter()
+    # Workers are forked, so they inherit the app and roster set up above
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        samples = [t for timings in pool.map(run_queries, chunks) for t in timings]
+    elapsed = time.perf_counter() - start
+
+    results = dict(percentiles(samples), workers=args.workers, presentations=args.presentations,
+                   throughput_rps=round(args.requests / elapsed, 1), target_p99_ms=args.target_ms)
+    print(f"{args.requests} requests, {args.workers} workers, {args.presentations} presentations")
+    print(f"  throughput: {results['throughput_rps']:,.0f} requests/s")
+    print(f"  p50 {results['p50_ms']:.2f} ms  p95 {results['p95_ms']:.2f} ms  p99 {results['p99_ms']:.2f} ms "
+          f"(target {args.target_ms:.0f} ms)")
+    print(f"Results saved to {save_results('autocomplete', results, args.output)}")
+    return 0 if results['p99_ms'] <= args.target_ms else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Batch triage benchmark
+
+Compares matching 10k referrals one search_clinicians() call at a time with a
+single batch_results() pass over the same synthetic roster, and times the
+vectorised matching step on its own.
+
+    python -m benchmarks.bench_batch [--clinicians 300] [--referrals 10000]
+"""
+
+import argparse
+import tempfile
+import time
+
+from flask import Flask
+
+from app.models import roster
+from app.models.batch import match_referrals
+from app.routes.triage_routes import batch_results, search_clinicians
+from benchmarks.synthetic import make_clinicians, make_referrals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clinicians', type=int, default=300)
+    parser.add_argument('--referrals', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    upload_folder = tempfile.mkdtemp()
+    roster.save_clinicians(make_clinicians(args.clinicians), upload_folder)
+    referrals = make_referrals(args.referrals)
+
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = upload_folder
+
+    with app.app_context():
+        current = roster.get_roster()
+        # Build the shards' indexes and the matrix up front so neither timing includes them
+        current.shards.warm()
+        current.matrix
+
+        start = time.perf_counter()
+        for r in referrals:
+            search_clinicians(r['age_group'], r['presentation'], r['funding_source'], r['location'])
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in batch_results(current, referrals):
+            pass
+        batch = time.perf_counter() - start
+
+        # Matching alone, without building the result dicts
+        start = time.perf_counter()
+        for _ in match_referrals(current.matrix, referrals):
+            pass
+        matching = time.perf_counter() - start
+
+    print(f"{args.referrals} referrals x {args.clinicians} clinicians")
+    print(f"  search_clinicians loop: {single:.3f}s ({args.referrals / single:,.0f} referrals/s)")
+    print(f"  batch_results:          {batch:.3f}s ({args.referrals / batch:,.0f} referrals/s)")
+    print(f"  match_referrals only:   {matching:.3f}s ({args.referrals / matching:,.0f} referrals/s)")
+
+
+if __name__ == '__main__':
+    main()
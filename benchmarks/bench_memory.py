@@ -0,0 +1,187 @@
+"""
+Worker memory under gunicorn, with and without preload_app
+
+Starts gunicorn with gunicorn.conf.py against a synthetic roster, warms every
+worker with searches, autocomplete and form requests, then reads each process's
+/proc/<pid>/smaps_rollup. The figure that matters is the worker's private
+memory (USS): what each extra worker really costs. Pages shared copy-on-write
+with the master show up in PSS instead.
+
+With --swap it then uploads a new spreadsheet as the super admin, waits for
+the workers to be replaced and measures again, to check the snapshot swap keeps
+the sharing. Linux only.
+
+    python -m benchmarks.bench_memory [--clinicians 10000] [--workers 4] [--swap]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from app.models import roster
+from app.utils import jobs
+from benchmarks.harness import ROOT, save_results
+from benchmarks.load import HTTPSession, make_requests
+from benchmarks.synthetic import make_clinicians, write_spreadsheet
+
+# smaps_rollup fields reported, in kB
+FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty', 'Shared_Clean', 'Shared_Dirty')
+
+
+# Helper function to find a free local port
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Helper function to list the pids of a process's children
+def child_pids(pid):
+    children = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # The command name is in brackets and may contain spaces; ppid follows it
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(name))
+    return sorted(children)
+
+
+def memory(pid):
+    """Return a process's smaps_rollup figures in MB, plus its USS (private memory)"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0].rstrip(':') in FIELDS:
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    values['Uss'] = values['Private_Clean'] + values['Private_Dirty']
+    return {key: round(value, 1) for key, value in values.items()}
+
+
+# Helper function to wait until the server answers
+def wait_until_up(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/auth/login") as response:
+                response.read()
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn didn't start")
+
+
+# Helper function to send enough requests that every worker builds what searches need
+def warm_workers(url, presentations, requests):
+    session = HTTPSession(url, 'staff', 'staff123')
+    for scenario in ('search', 'presentations'):
+        for method, path, data in make_requests(scenario, requests, presentations, seed=1):
+            getattr(session, method)(path, data)
+    for _ in range(requests // 10):
+        session.get('/triage/', {})
+
+
+# Helper function to measure the master and each worker
+def measure(master):
+    workers = [memory(pid) for pid in child_pids(master)]
+    summary = {'master': memory(master), 'workers': workers}
+    for key in ('Uss', 'Pss', 'Rss'):
+        summary[f'worker_{key.lower()}_mb'] = round(sum(w[key] for w in workers) / len(workers), 1)
+    summary['total_pss_mb'] = round(summary['master']['Pss'] + sum(w['Pss'] for w in workers), 1)
+    return summary
+
+
+# Helper function to upload a new spreadsheet and wait for it to go live (and, with preload, new workers)
+def swap_snapshot(url, master, upload_folder, clinicians, presentations, preload, timeout=120):
+    old_workers = set(child_pids(master))
+    path = os.path.join(tempfile.mkdtemp(), 'roster.xlsx')
+    write_spreadsheet(path, make_clinicians(clinicians, presentations, seed=1))
+
+    session = HTTPSession(url, 'admin', 'admin123')
+    boundary = 'triage-benchmark'
+    with open(path, 'rb') as f:
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="roster.xlsx"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        body += f.read() + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(f"{url}/admin/upload", body,
+                                     {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with session.opener.open(request) as response:
+        response.read()
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.latest_job(upload_folder)
+        finished = job is not None and job['status'] in ('succeeded', 'failed')
+        workers = set(child_pids(master))
+        replaced = bool(workers) and not workers & old_workers
+        if finished and (replaced or not preload):
+            return {'job': job['status'], 'workers_replaced': replaced}
+        time.sleep(0.5)
+    return {'job': None, 'workers_replaced': False}
+
+
+def run(args, preload):
+    upload_folder = tempfile.mkdtemp()
+    roster.save_clinicians(make_clinicians(args.clinicians, args.presentations), upload_folder)
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, TRIAGE_UPLOAD_FOLDER=upload_folder, TRIAGE_PRELOAD='1' if preload else '0',
+               BIND=f"127.0.0.1:{port}", WEB_CONCURRENCY=str(args.workers),
+               SECRET_KEY=os.environ.get('SECRET_KEY', 'bench-memory'))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(url)
+        warm_workers(url, args.presentations, args.requests)
+        result = {'preload': preload, 'after_start': measure(server.pid)}
+        if args.swap:
+            result['swap'] = swap_snapshot(url, server.pid, upload_folder, args.clinicians, args.presentations,
+                                           preload)
+            warm_workers(url, args.presentations, args.requests)
+            result['after_swap'] = measure(server.pid)
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure gunicorn worker memory with and without preload')
+    parser.add_argument('--clinicians', type=int, default=10000)
+    parser.add_argument('--presentations', type=int, default=25)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400, help='warm-up requests per scenario')
+    parser.add_argument('--swap', action='store_true', help='also measure after uploading a new roster')
+    parser.add_argument('--output', default=None, help='results file (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    results = {'clinicians': args.clinicians, 'workers': args.workers}
+    for preload in (False, True):
+        name = 'preload' if preload else 'no_preload'
+        results[name] = run(args, preload)
+        for stage in ('after_start', 'after_swap'):
+            if stage in results[name]:
+                r = results[name][stage]
+                print(f"{name:<11} {stage:<12} worker USS {r['worker_uss_mb']:>7.1f} MB  "
+                      f"PSS {r['worker_pss_mb']:>7.1f} MB  RSS {r['worker_rss_mb']:>7.1f} MB  "
+                      f"total PSS {r['total_pss_mb']:>7.1f} MB")
+
+    saving = results['no_preload']['after_start']['worker_uss_mb'] - results['preload']['after_start']['worker_uss_mb']
+    results['uss_saving_per_worker_mb'] = round(saving, 1)
+    print(f"Private memory saved per worker: {saving:.1f} MB")
+    print(f"Results saved to {save_results('memory', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Micro-benchmarks for the triage hot paths
+
+Times search_clinicians() (with the result cache off and on),
+get_all_presentations(), get_locations() and spreadsheet ingestion (pandas
+and streaming, into an empty database, then re-uploads with a few rows
+changed) against a synthetic roster, and saves the results as JSON.
+
+    python -m benchmarks.bench_micro [--clinicians 1000] [--presentations 40] [--searches 500]
+                                     [--changed-rows 2] [--output FILE]
+"""
+
+import argparse
+import copy
+import os
+import tempfile
+import time
+
+from app.routes.triage_routes import search_clinicians, get_all_presentations, get_locations
+from app.utils.ingest import ingest_spreadsheet
+from benchmarks.harness import load_app, percentiles, save_results
+from benchmarks.synthetic import make_clinicians, make_referrals, write_spreadsheet
+
+
+# Helper function to time func(*args) once per entry in calls
+def time_calls(func, calls):
+    samples = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# Helper function to summarise ingestion reports, with the fastest time for each stage across the runs
+def ingest_results(reports):
+    stage_seconds = {}
+    for report in reports:
+        for stage in report['stages']:
+            stage_seconds[stage['name']] = min(stage['seconds'], stage_seconds.get(stage['name'], stage['seconds']))
+    return dict(percentiles([report['total_seconds'] for report in reports]), stage_seconds=stage_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time search, form helpers and ingestion')
+    parser.add_argument('--clinicians', type=int, default=1000)
+    parser.add_argument('--presentations', type=int, default=40)
+    parser.add_argument('--searches', type=int, default=500)
+    parser.add_argument('--ingest-runs', type=int, default=3)
+    parser.add_argument('--changed-rows', type=int, default=2, help='rows that differ between re-uploads')
+    parser.add_argument('--output', default=None, help='results file (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    upload_folder = tempfile.mkdtemp()
+    clinicians = make_clinicians(args.clinicians, args.presentations)
+    spreadsheet = os.path.join(upload_folder, 'roster.xlsx')
+    write_spreadsheet(spreadsheet, clinicians)
+    # The same roster with a few clinicians moved, for incremental re-uploads
+    changed = copy.deepcopy(clinicians)
+    for clinician in changed[:args.changed_rows]:
+        clinician['primary_location'] = 'Relocated'
+    changed_spreadsheet = os.path.join(upload_folder, 'roster_changed.xlsx')
+    write_spreadsheet(changed_spreadsheet, changed)
+    app = load_app(upload_folder)
+
+    results = {'clinicians': args.clinicians, 'presentations': args.presentations,
+               'changed_rows': args.changed_rows}
+
+    with app.app_context():
+        for mode, streaming in (('ingest_pandas', False), ('ingest_streaming', True)):
+            # Each run starts from an empty database, so every row is written
+            reports = [ingest_spreadsheet(spreadsheet, tempfile.mkdtemp(), streaming=streaming)
+                       for _ in range(args.ingest_runs)]
+            results[mode] = ingest_results(reports)
+
+        # Alternate between the two spreadsheets, so each run applies only the changed rows
+        ingest_spreadsheet(spreadsheet, upload_folder)
+        reports = [ingest_spreadsheet(changed_spreadsheet if i % 2 == 0 else spreadsheet, upload_folder)
+                   for i in range(args.ingest_runs)]
+        results['ingest_reupload'] = ingest_results(reports)
+
+        searches = [(r['age_group'], r['presentation'], r['funding_source'], r['location'])
+                    for r in make_referrals(args.searches, args.presentations)]
+
+        app.config['SEARCH_CACHE'] = 'off'
+        search_clinicians(*searches[0])
+        results['search_uncached'] = percentiles(time_calls(search_clinicians, searches))
+
+        # Repeat a handful of common searches, as triage staff do
+        app.config['SEARCH_CACHE'] = 'memory'
+        repeated = [searches[i % 10] for i in range(args.searches)]
+        results['search_cached'] = percentiles(time_calls(search_clinicians, repeated))
+
+        results['get_all_presentations'] = percentiles(time_calls(get_all_presentations, [()] * args.searches))
+        results['get_locations'] = percentiles(time_calls(get_locations, [()] * args.searches))
+
+    for name, value in results.items():
+        if isinstance(value, dict):
+            print(f"{name:<22} mean {value['mean_ms']:>9.3f} ms  p50 {value['p50_ms']:>9.3f}  "
+                  f"p95 {value['p95_ms']:>9.3f}  p99 {value['p99_ms']:>9.3f}")
+    print(f"Results saved to {save_results('micro', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Search backend benchmark
+
+Times a triage search's matching step three ways over the same synthetic
+roster at several sizes:
+
+    json scan  the original approach: load clinicians.json and test each
+               clinician in a Python loop
+    sqlite     one indexed query against the normalised clinician tables
+    index      bitset intersections over the in-memory search index of the
+               location's shard (every shard for "Flexible")
+
+    python -m benchmarks.bench_sqlite [--sizes 100 1000 10000] [--searches 200]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from app.models import roster, clinicians
+from app.models.search_index import presentation_key
+from benchmarks.synthetic import make_clinicians, make_referrals
+
+
+# Helper function reproducing the original per-request JSON scan's filter
+def json_scan(json_path, age_group, presentation_column, funding_source, location):
+    with open(json_path, 'r') as f:
+        rows = json.load(f)
+    matches = []
+    for i, clinician in enumerate(rows):
+        if clinician.get('availability_status') in ('Unavailable', 'Closed'):
+            continue
+        if location != 'Flexible' and clinician.get('primary_location') != location:
+            continue
+        if clinician.get(presentation_column) != 'Y' or clinician.get(age_group) != 'Y':
+            continue
+        if funding_source != 'mhcp' and clinician.get(funding_source) != 'Y':
+            continue
+        matches.append(i)
+    return matches
+
+
+# Helper function to time a search function over every referral, in milliseconds per search
+def time_searches(search, searches):
+    start = time.perf_counter()
+    for args in searches:
+        search(*args)
+    return 1000 * (time.perf_counter() - start) / len(searches)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare search latency of the JSON scan, SQLite and the index')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--searches', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    searches = [(r['age_group'], presentation_key(r['presentation']) + '_treats', r['funding_source'], r['location'])
+                for r in make_referrals(args.searches)]
+
+    print(f"{'clinicians':>10}  {'json scan':>12}  {'sqlite':>12}  {'index':>12}   (ms per search)")
+    for size in args.sizes:
+        upload_folder = tempfile.mkdtemp()
+        rows = make_clinicians(size)
+        json_path = os.path.join(upload_folder, 'clinicians.json')
+        with open(json_path, 'w') as f:
+            json.dump(rows, f)
+
+        current = roster.save_clinicians(rows, upload_folder)
+        snapshot = current.meta['snapshot']
+
+        # Every backend must agree (the JSON scan doesn't rank, so compare as sets)
+        for search in searches[:20]:
+            expected = sorted(json_scan(json_path, *search))
+            assert sorted(clinicians.search_rows(snapshot, *search, upload_folder=upload_folder)) == expected
+            assert sorted(current.shards.ranked(*search)) == expected
+
+        scan = time_searches(lambda *a: json_scan(json_path, *a), searches)
+        sqlite = time_searches(lambda *a: clinicians.search_rows(snapshot, *a, upload_folder=upload_folder),
+                               searches)
+        current.shards.warm()
+        index = time_searches(current.shards.ranked, searches)
+
+        print(f"{size:>10}  {scan:>12.3f}  {sqlite:>12.3f}  {index:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
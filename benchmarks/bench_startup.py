@@ -0,0 +1,109 @@
+"""
+Cold start budget: how long a fresh worker takes to import and create the app
+
+Runs `python -X importtime -c "from app import create_app; create_app()"`
+several times and takes the median import time. It fails (exit status 1) if
+that exceeds the budget, or if a module that should only load on demand
+(pandas, openpyxl) is imported at startup. The slowest imports are listed so a
+regression can be traced. Results are saved as JSON.
+
+    python -m benchmarks.bench_startup [--budget-ms 450] [--runs 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.harness import ROOT, save_results
+
+STARTUP_CODE = 'from app import create_app; create_app()'
+
+# Only needed to ingest a spreadsheet, so they must not load at startup
+LAZY_MODULES = ('pandas', 'openpyxl')
+
+DEFAULT_BUDGET_MS = 450
+
+
+def parse_importtime(output):
+    """Return {module: (self ms, cumulative ms)} and the total import time in ms from -X importtime output"""
+    modules = {}
+    total = 0.0
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Names are indented two spaces per level below the top-level imports
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+        # Top-level imports' cumulative times add up to the whole
+        if depth == 0:
+            total += int(cumulative_us) / 1000
+    return modules, total
+
+
+# Helper function to start a fresh interpreter that creates the app, returning (wall ms, importtime output)
+def cold_start(upload_folder):
+    env = dict(os.environ, TRIAGE_UPLOAD_FOLDER=upload_folder)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_CODE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return 1000 * (time.perf_counter() - start), result.stderr
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check app cold start time against a budget')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='largest acceptable median import time')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    parser.add_argument('--output', default=None, help='results file (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    upload_folder = tempfile.mkdtemp()
+    # Warm the bytecode and OS file caches so every measured run is comparable
+    cold_start(upload_folder)
+
+    runs = [cold_start(upload_folder) for _ in range(args.runs)]
+    parsed = [parse_importtime(output) for _, output in runs]
+    import_ms = statistics.median(total for _, total in parsed)
+    wall_ms = statistics.median(wall for wall, _ in runs)
+
+    modules = parsed[-1][0]
+    lazy_loaded = sorted(name for name in modules if name.split('.')[0] in LAZY_MODULES)
+    slowest = sorted(((name, times[1]) for name, times in modules.items() if name.count('.') == 0),
+                     key=lambda item: item[1], reverse=True)[:args.top]
+
+    print(f"Median import time {import_ms:.0f} ms (budget {args.budget_ms:.0f} ms), "
+          f"process wall time {wall_ms:.0f} ms, {len(modules)} modules")
+    for name, cumulative in slowest:
+        print(f"  {cumulative:>8.1f} ms  {name}")
+
+    failures = []
+    if import_ms > args.budget_ms:
+        failures.append(f"import time {import_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    if lazy_loaded:
+        roots = sorted({name.split('.')[0] for name in lazy_loaded})
+        failures.append(f"{', '.join(roots)} imported at startup")
+
+    results = {
+        'import_ms': round(import_ms, 1),
+        'wall_ms': round(wall_ms, 1),
+        'budget_ms': args.budget_ms,
+        'modules': len(modules),
+        'slowest': [{'module': name, 'cumulative_ms': round(ms, 1)} for name, ms in slowest],
+        'failures': failures,
+    }
+    print(f"Results saved to {save_results('startup', results, args.output)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
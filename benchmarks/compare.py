@@ -0,0 +1,50 @@
+"""
+Compare two benchmark result files
+
+Prints every number the two runs have in common with the change between
+them, e.g. to check a branch against main before deploying:
+
+    python -m benchmarks.compare benchmarks/results/micro-A.json benchmarks/results/micro-B.json
+"""
+
+import argparse
+import json
+
+
+# Helper function to flatten nested results into {'a.b.c': number}
+def flatten(results, prefix=''):
+    values = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    runs = []
+    for path in (args.before, args.after):
+        with open(path, 'r') as f:
+            runs.append(json.load(f))
+    before, after = (flatten(run['results']) for run in runs)
+
+    print(f"before: {runs[0].get('benchmark')} {runs[0].get('time')} ({runs[0].get('commit')})")
+    print(f"after:  {runs[1].get('benchmark')} {runs[1].get('time')} ({runs[1].get('commit')})")
+    width = max((len(name) for name in before), default=10)
+    for name in before:
+        if name not in after:
+            continue
+        old, new = before[name], after[name]
+        change = f"{100 * (new - old) / old:+.1f}%" if old else ''
+        print(f"{name:<{width}}  {old:>12,.3f}  {new:>12,.3f}  {change:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Shared helpers for the benchmarks: loading the app, latency percentiles and
+saving results as JSON so runs can be compared (see benchmarks.compare)
+"""
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from app import create_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FOLDER = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def load_app(upload_folder, **config):
+    """Return the real application, using upload_folder for its data"""
+    app = create_app(dict(config, UPLOAD_FOLDER=upload_folder))
+    # A JSON log line per request would swamp the benchmark output
+    logging.getLogger('triage').setLevel(logging.WARNING)
+    return app
+
+
+def percentiles(samples):
+    """Summarise latencies in seconds as milliseconds: mean, p50, p95, p99 and max"""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+
+    def pct(p):
+        return round(1000 * samples[min(len(samples) - 1, int(len(samples) * p / 100))], 4)
+
+    return {
+        'count': len(samples),
+        'mean_ms': round(1000 * sum(samples) / len(samples), 4),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'max_ms': round(1000 * samples[-1], 4),
+    }
+
+
+# Helper function to get the current git commit, if there is one
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def save_results(name, results, output=None):
+    """Write a benchmark's results, with details of the run, to a JSON file and return its path
+
+    By default results go to benchmarks/results/<name>-<timestamp>.json.
+    """
+    if output is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        output = os.path.join(RESULTS_FOLDER, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+
+    record = {
+        'benchmark': name,
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(record, f, indent=2)
+    return output
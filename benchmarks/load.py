@@ -0,0 +1,152 @@
+"""
+HTTP load driver for the triage endpoints
+
+Logs in through auth.login like a browser, then drives POST /triage/search
+and GET /triage/api/presentations, reporting throughput and p50/p95/p99 for
+each. Results are saved as JSON.
+
+By default it runs the real app through the Flask test client in forked
+worker processes, against a synthetic roster. With --url it drives a
+running server instead (e.g. a local gunicorn), using threads and whatever
+roster that server has:
+
+    python -m benchmarks.load [--clinicians 300] [--requests 2000] [--workers 2]
+    python -m benchmarks.load --url http://127.0.0.1:5000 --workers 8
+"""
+
+import argparse
+import http.cookiejar
+import multiprocessing
+import random
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.models import roster
+from benchmarks.harness import load_app, percentiles, save_results
+from benchmarks.synthetic import make_clinicians, make_referrals
+
+SCENARIOS = ('search', 'presentations')
+
+# Set up by main() before test-client workers are forked
+_app = None
+
+
+class TestClientSession:
+    """A logged-in session against the app via the Flask test client"""
+
+    def __init__(self, app, username, password):
+        self.client = app.test_client()
+        response = self.client.post('/auth/login', data={'username': username, 'password': password})
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed for {username}")
+
+    def get(self, path, params):
+        return self.client.get(path, query_string=params).status_code
+
+    def post(self, path, form):
+        return self.client.post(path, data=form).status_code
+
+
+class HTTPSession:
+    """A logged-in session against a running server, keeping cookies like a browser"""
+
+    def __init__(self, url, username, password):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.post('/auth/login', {'username': username, 'password': password})
+
+    def get(self, path, params):
+        with self.opener.open(f"{self.url}{path}?{urllib.parse.urlencode(params)}") as response:
+            response.read()
+            return response.status
+
+    def post(self, path, form):
+        with self.opener.open(f"{self.url}{path}", urllib.parse.urlencode(form).encode()) as response:
+            response.read()
+            return response.status
+
+
+# Helper function to build the requests a scenario sends
+def make_requests(scenario, count, presentations, seed):
+    rng = random.Random(seed)
+    if scenario == 'search':
+        return [('post', '/triage/search', referral) for referral in make_referrals(count, presentations, seed)]
+    # Autocomplete: prefixes of presentation names, as typed one keystroke at a time
+    labels = [r['presentation'] for r in make_referrals(50, presentations, seed)]
+    queries = [label[:rng.randint(2, len(label))] for label in labels for _ in range(5)]
+    return [('get', '/triage/api/presentations', {'q': rng.choice(queries)}) for _ in range(count)]
+
+
+# Helper function run by each worker: log in, send its share of requests, return latencies
+def run_requests(target, username, password, requests):
+    if target is None:
+        session = TestClientSession(_app, username, password)
+    else:
+        session = HTTPSession(target, username, password)
+
+    timings = []
+    errors = 0
+    for method, path, data in requests:
+        start = time.perf_counter()
+        try:
+            status = getattr(session, method)(path, data)
+        except OSError:
+            status = None
+        timings.append(time.perf_counter() - start)
+        if status != 200:
+            errors += 1
+    return timings, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the triage search and autocomplete endpoints')
+    parser.add_argument('--url', default=None, help='running server to drive (default: Flask test client)')
+    parser.add_argument('--username', default='staff')
+    parser.add_argument('--password', default='staff123')
+    parser.add_argument('--clinicians', type=int, default=300, help='synthetic roster size (test client only)')
+    parser.add_argument('--presentations', type=int, default=25)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--output', default=None, help='results file (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    global _app
+    if args.url is None:
+        upload_folder = tempfile.mkdtemp()
+        roster.save_clinicians(make_clinicians(args.clinicians, args.presentations), upload_folder)
+        _app = load_app(upload_folder)
+        # Worker processes are forked so they inherit the app set up above
+        pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        pool = ThreadPoolExecutor(args.workers)
+
+    results = {'target': args.url or 'test client', 'workers': args.workers}
+    with pool:
+        for seed, scenario in enumerate(args.scenarios):
+            requests = make_requests(scenario, args.requests, args.presentations, seed)
+            chunks = [requests[i::args.workers] for i in range(args.workers)]
+
+            start = time.perf_counter()
+            futures = [pool.submit(run_requests, args.url, args.username, args.password, chunk)
+                       for chunk in chunks]
+            outcomes = [future.result() for future in futures]
+            elapsed = time.perf_counter() - start
+
+            samples = [t for timings, _ in outcomes for t in timings]
+            results[scenario] = dict(percentiles(samples),
+                                     errors=sum(errors for _, errors in outcomes),
+                                     throughput_rps=round(len(samples) / elapsed, 1))
+
+            r = results[scenario]
+            print(f"{scenario:<14} {r['throughput_rps']:>8,.0f} req/s  p50 {r['p50_ms']:.2f} ms  "
+                  f"p95 {r['p95_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms  errors {r['errors']}")
+
+    print(f"Results saved to {save_results('load', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Synthetic roster and referral generators for the benchmarks
+
+Can also write a roster as a master spreadsheet for upload or ingestion
+benchmarks:
+
+    python -m benchmarks.synthetic roster.xlsx --clinicians 1000 --presentations 40
+"""
+
+import argparse
+import random
+
+AGE_GROUPS = ['age_0_6', 'age_6_12', 'age_12_18', 'age_18_plus', 'age_70_plus']
+FUNDING_SOURCES = ['mhcp', 'ndis', 'dva', 'wc', 'qps', 'eap', 'private']
+LOCATIONS = ['Maroochydore', 'Sippy Downs']
+STATUSES = ['Available', 'Available', 'Waitlist', 'Unavailable']
+FLAGS = ['Y', 'Y', 'N', 'Conditional']
+
+
+# Helper function to name the synthetic presentations
+def presentation_names(count):
+    return [f'presentation_{i}' for i in range(count)]
+
+
+def make_clinicians(count, presentations=25, seed=0, max_capacity=None):
+    """Generate clinician dicts using the roster's column conventions
+
+    With max_capacity, each clinician also gets a 'capacity' of 0 to
+    max_capacity new referrals (drawn separately, so the other columns are the
+    same either way).
+    """
+    rng = random.Random(seed)
+    capacity_rng = random.Random(seed + 1)
+    names = presentation_names(presentations)
+    clinicians = []
+
+    for i in range(count):
+        clinician = {
+            'clinician_name': f'Clinician {i}',
+            'gender': rng.choice(['F', 'M']),
+            'profession': rng.choice(['Psychologist', 'Clinical Psychologist', 'Social Worker']),
+            'employment_type': rng.choice(['Salaried', 'Contractor']),
+            'primary_location': rng.choice(LOCATIONS),
+            'availability_status': rng.choice(STATUSES),
+            'available_from_date': None,
+            'availability_notes': None,
+        }
+        for age in AGE_GROUPS:
+            clinician[age] = rng.choice(['Y', 'N'])
+        clinician['age_restrictions_notes'] = None
+        for name in names:
+            clinician[f'{name}_treats'] = rng.choice(FLAGS)
+            clinician[f'{name}_service_type'] = rng.choice(['Both', 'Telehealth', 'Face to face'])
+            clinician[f'{name}_notes'] = rng.choice([None, None, 'Case by case basis'])
+        for funding in FUNDING_SOURCES:
+            clinician[funding] = rng.choice(FLAGS)
+        clinician['funding_notes'] = None
+        if max_capacity is not None:
+            clinician['capacity'] = capacity_rng.randint(0, max_capacity)
+        clinicians.append(clinician)
+
+    return clinicians
+
+
+def make_referrals(count, presentations=25, seed=1):
+    """Generate referral dicts spread across every search criterion"""
+    rng = random.Random(seed)
+    labels = [name.replace('_', ' ').title() for name in presentation_names(presentations)]
+    return [{
+        'age_group': rng.choice(AGE_GROUPS),
+        'presentation': rng.choice(labels),
+        'funding_source': rng.choice(FUNDING_SOURCES),
+        'location': rng.choice(LOCATIONS + ['Flexible']),
+    } for _ in range(count)]
+
+
+def write_spreadsheet(path, clinicians):
+    """Write clinician dicts as a master spreadsheet (.xlsx), one row per clinician"""
+    import pandas as pd
+    pd.DataFrame(clinicians).to_excel(path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic master spreadsheet')
+    parser.add_argument('path', help='.xlsx file to write')
+    parser.add_argument('--clinicians', type=int, default=300)
+    parser.add_argument('--presentations', type=int, default=25)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    write_spreadsheet(args.path, make_clinicians(args.clinicians, args.presentations, args.seed))
+    print(f"Wrote {args.clinicians} clinicians x {args.presentations} presentations to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Gunicorn configuration for the Psychology Clinic Triage Tool
+
+    gunicorn -c gunicorn.conf.py
+
+The app and the live roster snapshot are loaded once in the master and
+shared copy-on-write by the workers (see app.utils.prefork). Set
+TRIAGE_PRELOAD=0 to have each worker load its own copy instead.
+
+Set TRIAGE_ASGI=1 to serve the ASGI entry point (app.asgi) with uvicorn's
+worker class instead of sync workers (pip install uvicorn).
+"""
+
+import os
+
+if os.environ.get('TRIAGE_ASGI') == '1':
+    wsgi_app = 'app.asgi:create_asgi_app()'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+preload_app = os.environ.get('TRIAGE_PRELOAD', '1') != '0'
+
+# Uploads are ingested on a background thread; give old workers time to finish
+# any in flight when they're replaced
+graceful_timeout = 60
+
+
+# Helper function to get the Flask app from the loaded application, which may be the ASGI wrapper
+def _flask_app(server):
+    app = server.app.wsgi()
+    return getattr(app, 'flask_app', app)
+
+
+def when_ready(server):
+    # Runs in the master before the first workers are forked
+    if preload_app:
+        from app.utils import prefork
+        prefork.warm(_flask_app(server))
+
+
+def on_reload(server):
+    # SIGHUP (sent by a worker after an upload): load the new snapshot before re-forking
+    if preload_app:
+        from app.utils import prefork
+        prefork.warm(_flask_app(server))
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app.utils import prefork
+        prefork.set_master(server.pid)
@@ -0,0 +1,53 @@
+"""
+Psychology Clinic Triage Tool
+Database migration command line entry point
+
+Brings the SQLite database in the uploads folder up to date: applies any
+pending schema migrations, imports the roster (converting an old
+clinicians.json if that is all there is) and creates the default user
+accounts if there are none, e.g.
+
+    python migrate.py
+    python migrate.py --json backup/clinicians.json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from app.models import roster, users
+from app.models.database import get_db, MIGRATIONS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create or upgrade the triage database')
+    parser.add_argument('--uploads', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'),
+                        help='folder containing the uploaded roster and database')
+    parser.add_argument('--json', default=None, help='clinicians.json file to import as the roster')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.uploads, exist_ok=True)
+    db = get_db(args.uploads)
+    print(f"Schema at version {db.execute('PRAGMA user_version').fetchone()[0]} of {len(MIGRATIONS)}")
+
+    if args.json:
+        with open(args.json, 'r') as f:
+            roster.save_clinicians(json.load(f), args.uploads)
+
+    # Loading the roster copies it into the database if it isn't there yet
+    current = roster.get_roster(args.uploads)
+    if not len(current):
+        print("No roster to import")
+    else:
+        count = db.execute('SELECT COUNT(*) FROM clinicians WHERE snapshot = ?',
+                           (current.meta['snapshot'],)).fetchone()[0]
+        print(f"Roster snapshot {current.meta['snapshot']}: {count} clinicians in the database")
+
+    users.seed_default_users(db)
+    print(f"{db.execute('SELECT COUNT(*) FROM users').fetchone()[0]} user accounts")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
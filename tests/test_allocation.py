@@ -0,0 +1,76 @@
+"""Tests for caseload-aware referral allocation"""
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from app import create_app
+from app.models import roster, scoring
+from app.models.allocation import _solve_flow, _solve_greedy, allocate
+from benchmarks.synthetic import make_clinicians, make_referrals
+
+
+class SolverTests(unittest.TestCase):
+
+    def test_no_clinicians(self):
+        cost = np.full((2, 0), np.inf)
+        capacity = np.zeros(0, dtype=np.int64)
+        for solve in (_solve_greedy, _solve_flow):
+            self.assertEqual(solve(cost, [1, 2], capacity), [{}, {}])
+
+    def test_kind_with_no_eligible_clinician(self):
+        cost = np.array([[np.inf, np.inf], [-5.0, np.inf]])
+        capacity = np.array([1, 1])
+        for solve in (_solve_greedy, _solve_flow):
+            self.assertEqual(solve(cost, [2, 1], capacity), [{}, {0: 1}])
+
+    def test_flow_moves_earlier_referral(self):
+        # Greedy gives kind 1 the only clinician kind 0 can take
+        cost = np.array([[-10.0, np.inf], [-10.0, -9.0]])
+        capacity = np.array([1, 1])
+        self.assertEqual(_solve_flow(cost, [1, 1], capacity), [{0: 1}, {1: 1}])
+
+
+class AllocateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.app = create_app({'UPLOAD_FOLDER': self.folder, 'AUDIT_LOG': False, 'METRICS_ENABLED': False})
+        roster.save_clinicians(make_clinicians(60, 5, max_capacity=2), self.folder)
+        self.roster = roster.get_roster(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_within_capacity(self):
+        for solver in ('greedy', 'flow'):
+            results, summary = allocate(self.roster, make_referrals(200, 5), scoring.get_weights(), solver=solver)
+            self.assertEqual(summary['assigned'] + summary['unassigned'], 200)
+            for clinician in summary['clinicians']:
+                self.assertLessEqual(clinician['assigned'], clinician['capacity'])
+
+    def test_no_eligible_clinician(self):
+        referrals = [{'age_group': 'age_18_plus', 'presentation': 'Presentation 0',
+                      'funding_source': 'mhcp', 'location': 'Nowhere'}] * 3
+        for solver in ('greedy', 'flow'):
+            results, summary = allocate(self.roster, referrals, scoring.get_weights(), solver=solver)
+            self.assertEqual([(r['row'], r['match_count']) for r in results], [(None, 0)] * 3)
+            self.assertEqual((summary['assigned'], summary['unassigned']), (0, 3))
+
+    def test_api_no_eligible_clinician(self):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 'admin'
+            session['user_role'] = 'admin'
+        response = client.post('/triage/api/allocate', json=[['age_18_plus', 'Presentation 0', 'mhcp', 'Nowhere']])
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['summary']['unassigned'], 1)
+        self.assertIsNone(data['allocations'][0]['clinician'])
+        self.assertEqual(data['allocations'][0]['match_count'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Tests for the ASGI entry point"""
+
+import asyncio
+import unittest
+
+from flask import Flask, Response, request
+
+from app.asgi import TriageASGI, build_environ
+
+CHUNKS = 1000
+
+
+def make_app(produced, closed):
+    app = Flask(__name__)
+
+    @app.route('/cookies')
+    def cookies():
+        return dict(request.cookies)
+
+    @app.route('/stream')
+    def stream():
+        def generate():
+            try:
+                for i in range(CHUNKS):
+                    produced.append(i)
+                    yield f'{i}\n'
+            finally:
+                closed.append(True)
+        return Response(generate(), mimetype='text/plain')
+
+    return app
+
+
+def scope(path, headers=()):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': list(headers)}
+
+
+class BuildEnvironTests(unittest.TestCase):
+
+    def test_repeated_headers(self):
+        environ = build_environ(scope('/', [(b'cookie', b'a=1'), (b'cookie', b'b=2'),
+                                            (b'accept', b'text/html'), (b'accept', b'application/json')]), b'')
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,application/json')
+
+    def test_content_headers(self):
+        environ = build_environ(scope('/', [(b'content-type', b'text/csv'), (b'content-length', b'99'),
+                                            (b'transfer-encoding', b'chunked')]), b'abc')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/csv')
+        self.assertEqual(environ['CONTENT_LENGTH'], '3')
+        self.assertNotIn('HTTP_TRANSFER_ENCODING', environ)
+
+
+class TriageASGITests(unittest.TestCase):
+
+    def setUp(self):
+        self.produced = []
+        self.closed = []
+        self.asgi = TriageASGI(make_app(self.produced, self.closed), threads=2, search_threads=1)
+        self.addCleanup(self.asgi.shutdown)
+
+    # Helper function to run one request, with the client leaving after disconnect_after body messages
+    def request(self, scope, disconnect_after=None):
+        sent = []
+
+        async def run():
+            gone = asyncio.Event()
+            messages = [{'type': 'http.request', 'body': b''}]
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await gone.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                bodies = [m for m in sent if m['type'] == 'http.response.body']
+                if disconnect_after is not None and len(bodies) >= disconnect_after:
+                    gone.set()
+
+            await self.asgi(scope, receive, send)
+
+        asyncio.run(run())
+        return sent
+
+    def test_repeated_cookie_headers(self):
+        sent = self.request(scope('/cookies', [(b'cookie', b'a=1'), (b'cookie', b'b=2')]))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(sent[1]['body'], b'{"a":"1","b":"2"}\n')
+
+    def test_stream(self):
+        sent = self.request(scope('/stream'))
+        body = b''.join(m.get('body', b'') for m in sent[1:])
+        self.assertEqual(body.count(b'\n'), CHUNKS)
+        self.assertFalse(sent[-1].get('more_body', False))
+        self.assertEqual(self.closed, [True])
+
+    def test_disconnect_mid_stream(self):
+        sent = self.request(scope('/stream'), disconnect_after=5)
+        # The rest isn't produced for a client that has gone, and the response is closed
+        self.assertLess(len(self.produced), CHUNKS)
+        self.assertEqual(self.closed, [True])
+        self.assertTrue(all(m.get('more_body') for m in sent[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
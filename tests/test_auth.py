@@ -0,0 +1,53 @@
+"""Tests for login rate limiting"""
+
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+from app.utils import ratelimit
+
+
+class LoginRateLimitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        # Limiters are kept per process, not per app
+        ratelimit._limiters.clear()
+
+    def make_client(self, **config):
+        config = dict({'UPLOAD_FOLDER': self.folder, 'AUDIT_LOG': False, 'METRICS_ENABLED': False,
+                       'LOGIN_RATE_LIMIT': 3, 'LOGIN_RATE_WINDOW': 60}, **config)
+        return create_app(config).test_client()
+
+    def login(self, client, address, username='admin', password='wrong', **headers):
+        return client.post('/auth/login', data={'username': username, 'password': password},
+                           environ_base={'REMOTE_ADDR': address}, headers=headers)
+
+    def test_other_addresses_cant_lock_a_user_out(self):
+        client = self.make_client()
+        for _ in range(3):
+            self.assertEqual(self.login(client, '10.0.0.1').status_code, 200)
+        self.assertEqual(self.login(client, '10.0.0.1').status_code, 429)
+        # The same username from another address is still checked
+        self.assertEqual(self.login(client, '10.0.0.2').status_code, 200)
+        self.assertEqual(self.login(client, '10.0.0.2', password='admin123').status_code, 302)
+
+    def test_forwarded_address_behind_trusted_proxy(self):
+        client = self.make_client(TRUSTED_PROXIES=1)
+        for _ in range(3):
+            self.login(client, '10.0.0.1', X_Forwarded_For='203.0.113.1')
+        self.assertEqual(self.login(client, '10.0.0.1', X_Forwarded_For='203.0.113.1').status_code, 429)
+        # Another client behind the same proxy isn't throttled
+        self.assertEqual(self.login(client, '10.0.0.1', X_Forwarded_For='203.0.113.2').status_code, 200)
+
+    def test_forwarded_address_ignored_without_proxy(self):
+        client = self.make_client()
+        for i in range(3):
+            self.login(client, '10.0.0.1', X_Forwarded_For=f'203.0.113.{i}')
+        self.assertEqual(self.login(client, '10.0.0.1', X_Forwarded_For='203.0.113.9').status_code, 429)
+
+
+if __name__ == '__main__':
+    unittest.main()
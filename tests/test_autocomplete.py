@@ -0,0 +1,49 @@
+"""Tests for presentation autocomplete"""
+
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+from app.models import roster
+from app.models.autocomplete import Autocomplete
+from benchmarks.synthetic import make_clinicians
+
+NAMES = ['Anxiety', 'Depression', 'Eating Disorders', 'Self_Harm', 'Sleep Disorders']
+
+
+class AutocompleteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.autocomplete = Autocomplete(NAMES)
+
+    def test_tiers(self):
+        self.assertEqual(self.autocomplete.search('anx'), ['Anxiety'])
+        self.assertEqual(self.autocomplete.search('dis eat'), ['Eating Disorders'])
+        self.assertEqual(self.autocomplete.search('iety'), ['Anxiety'])
+        self.assertEqual(self.autocomplete.search('anxeity'), ['Anxiety'])
+
+    def test_empty_query(self):
+        self.assertEqual(self.autocomplete.search('', limit=2), NAMES[:2])
+
+    def test_separators_only(self):
+        self.assertEqual(self.autocomplete.search('_'), ['Self_Harm'])
+        self.assertEqual(self.autocomplete.search(' _ '), ['Self_Harm'])
+        self.assertEqual(Autocomplete(['Anxiety']).search('_'), [])
+
+    def test_api_separators_only(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, True)
+        app = create_app({'UPLOAD_FOLDER': folder, 'AUDIT_LOG': False, 'METRICS_ENABLED': False})
+        roster.save_clinicians(make_clinicians(5, 3), folder)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 'admin'
+            session['user_role'] = 'admin'
+        response = client.get('/triage/api/presentations', query_string={'q': '_'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.get_json(), list)
+
+
+if __name__ == '__main__':
+    unittest.main()
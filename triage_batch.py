@@ -0,0 +1,53 @@
+"""
+Psychology Clinic Triage Tool
+Batch triage command line entry point
+
+Matches a CSV or JSON file of referrals against the uploaded roster and writes
+one JSON line of ranked matches per referral, e.g.
+
+    python triage_batch.py referrals.csv --limit 5 > matches.ndjson
+
+CSV files need a header row with age_group, presentation, funding_source and
+location columns.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from app.models import roster
+from app.models.batch import parse_referrals
+from app.routes.triage_routes import batch_results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Match a batch of referrals against the clinician roster')
+    parser.add_argument('referrals', help='CSV or JSON file of referrals, or - for stdin')
+    parser.add_argument('--uploads', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'),
+                        help='folder containing the uploaded roster')
+    parser.add_argument('--limit', type=int, default=None, help='maximum matches per referral')
+    parser.add_argument('--format', choices=['csv', 'json'], default=None, help='input format (default: guess)')
+    args = parser.parse_args(argv)
+
+    if args.referrals == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.referrals, 'r', encoding='utf-8-sig') as f:
+            text = f.read()
+
+    fmt = args.format
+    if fmt is None and args.referrals.lower().endswith(('.csv', '.json')):
+        fmt = args.referrals.rsplit('.', 1)[1].lower()
+
+    referrals = parse_referrals(text, fmt)
+    current = roster.get_roster(args.uploads)
+
+    for result in batch_results(current, referrals, args.limit):
+        sys.stdout.write(json.dumps(result, default=str) + '\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())